@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+"""CLI to build any missing approximate-nearest-neighbor indexes on vector columns."""
+
+import argparse
+import asyncio
+import logging
+import os
+
+from rich.logging import RichHandler
+
+from mime_db import MimeDb
+
+
+async def main() -> None:
+    """Command-line entry-point."""
+
+    parser = argparse.ArgumentParser(description="Description: {}".format(__doc__))
+
+    parser.add_argument("--table", action="store", required=False)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=(os.getenv("LOG_LEVEL") or "INFO").upper(),
+        format="%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[RichHandler(rich_tracebacks=True)],
+    )
+
+    # Connect to the database
+    db = await MimeDb.create()
+
+    await db.ensure_vector_indexes(args.table)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+"""CLI to convert the face embedding and pose action vector columns in the db to
+half-precision (pgvector halfvec) storage, roughly halving their size, or back."""
+
+import argparse
+import asyncio
+import logging
+import os
+
+from rich.logging import RichHandler
+
+from mime_db import MimeDb
+
+
+async def main() -> None:
+    """Command-line entry-point."""
+
+    parser = argparse.ArgumentParser(description="Description: {}".format(__doc__))
+
+    parser.add_argument(
+        "--revert",
+        action="store_true",
+        default=False,
+        help="Convert the columns back to full-precision vectors",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=(os.getenv("LOG_LEVEL") or "INFO").upper(),
+        format="%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[RichHandler(rich_tracebacks=True)],
+    )
+
+    # Connect to the database
+    db = await MimeDb.create()
+
+    await db.compact_vectors(compact=not args.revert)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""CLI to export a video's pose embeddings from the db into the memory-mapped files
+used by the in-process vector search backend (VECTOR_SEARCH_BACKEND=mmap). Run it
+again after any of the video's poses or embeddings change (the ingest and annotation
+recipes in the justfile do, with --if-used)."""
+
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from rich.logging import RichHandler
+
+from lib.vector_store import VectorStore
+from mime_db import MimeDb
+
+
+async def main() -> None:
+    """Command-line entry-point."""
+
+    parser = argparse.ArgumentParser(description="Description: {}".format(__doc__))
+
+    parser.add_argument(
+        "--video-name",
+        action="store",
+        required=True,
+        help="The name of the video file (with extension)",
+    )
+    parser.add_argument(
+        "--if-used",
+        action="store_true",
+        help="Only export the vectors if the video's were exported before, or if "
+        "VECTOR_SEARCH_BACKEND is mmap",
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=(os.getenv("LOG_LEVEL") or "INFO").upper(),
+        format="%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[RichHandler(rich_tracebacks=True)],
+    )
+
+    cache_folder = os.getenv("CACHE_FOLDER")
+    assert cache_folder, "CACHE_FOLDER is required"
+
+    # Connect to the database
+    db = await MimeDb.create()
+
+    video_name = Path(args.video_name).name
+    video_id = await db.get_video_id(video_name)
+    assert video_id, f"No video named '{video_name}' in the db"
+
+    vectors = VectorStore(cache_folder)
+    if (
+        args.if_used
+        and os.getenv("VECTOR_SEARCH_BACKEND") != "mmap"
+        and vectors.get(video_id) is None
+    ):
+        logging.info(f"Not exporting the pose vectors of '{video_name}'")
+        return
+
+    await vectors.export(db, video_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""Compact columnar binary encoding of per-frame data series.
+
+The encoded payload is a small JSON header followed by one raw little-endian
+typed array per column, so a browser can map each column straight into a
+TypedArray (e.g. `new Float32Array(buffer, offset, length)`) with no per-row
+parsing:
+
+    bytes 0-3   uint32 length of the JSON header, in bytes
+    bytes 4-    the JSON header, space-padded so the first column starts at an
+                offset that is a multiple of 8
+    ...         the column buffers, each starting at a multiple of 8
+
+The header is {"rows": <int>, "columns": [{"name", "dtype", "offset", "length"}]},
+with offsets (in bytes, from the start of the payload) and lengths (in elements).
+"""
+
+import json
+import struct
+
+import numpy as np
+
+ALIGNMENT = 8
+
+# Column name, source record key, dtype
+POSE_DATA_COLUMNS = [
+    ("frame", "frame", "uint32"),
+    ("trackCt", "trackCt", "uint16"),
+    ("faceCt", "faceCt", "uint16"),
+    ("avgScore", "avgScore", "float32"),
+    ("isShot", "isShot", "uint8"),
+    ("movement", "movement", "float32"),
+    ("movement3d", "movement3d", "float32"),
+    ("pose_interest", "pose_interest", "float32"),
+    ("action_interest", "action_interest", "float32"),
+]
+
+
+def _padded(length: int) -> int:
+    return -length % ALIGNMENT
+
+
+def records_to_columns(records, columns=POSE_DATA_COLUMNS) -> dict:
+    """
+    Convert a list of records (asyncpg.Record or dicts) into a dict of typed arrays.
+    NULL values become NaN for float columns and 0 for integer columns.
+    """
+    arrays = {}
+    for name, key, dtype in columns:
+        is_float = np.issubdtype(np.dtype(dtype), np.floating)
+        fill = np.nan if is_float else 0
+        arrays[name] = np.fromiter(
+            (fill if record[key] is None else record[key] for record in records),
+            dtype=np.float64 if is_float else np.int64,
+            count=len(records),
+        ).astype(dtype)
+    return arrays
+
+
+def encode_columns(arrays: dict) -> bytes:
+    """Encode a dict of equal-length 1D arrays into the columnar binary format."""
+    rows = len(next(iter(arrays.values()))) if arrays else 0
+
+    # Header length determines the column offsets, which are part of the header, so
+    # lay the columns out relative to the (padded) header end in a second pass
+    column_meta = []
+    offset = 0
+    for name, array in arrays.items():
+        column_meta.append(
+            {
+                "name": name,
+                "dtype": str(array.dtype),
+                "offset": offset,
+                "length": len(array),
+            }
+        )
+        offset += array.nbytes + _padded(array.nbytes)
+
+    # Leave room for the offsets to grow by a few digits once the header size is known
+    slack = 16 * len(column_meta)
+    header_size = len(json.dumps({"rows": rows, "columns": column_meta})) + slack
+    data_start = 4 + header_size + _padded(4 + header_size)
+    for meta in column_meta:
+        meta["offset"] += data_start
+
+    header = json.dumps({"rows": rows, "columns": column_meta}).encode("utf-8")
+    header += b" " * (data_start - 4 - len(header))
+
+    parts = [struct.pack("<I", len(header)), header]
+    for array in arrays.values():
+        buffer = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        parts.append(buffer.tobytes())
+        parts.append(b"\0" * _padded(buffer.nbytes))
+    return b"".join(parts)
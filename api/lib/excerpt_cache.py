@@ -0,0 +1,195 @@
+"""On-disk cache of encoded pose excerpt (cutout) and resized thumbnail images.
+
+Excerpts are stored under CACHE_FOLDER/<video_id>/excerpts/, with file names
+derived from the normalized request parameters, so repeat requests only cost a
+file read. When the source frame is a cached JPEG, the excerpt is cut out of it
+with a lossless DCT-domain crop (via libjpeg-turbo), so the full frame is never
+decoded; if the requested region is MCU-aligned and doesn't need padding or
+resizing, the losslessly cropped JPEG is served as-is.
+"""
+
+import hashlib
+import logging
+from pathlib import Path
+from uuid import UUID
+
+import cv2
+import imageio.v3 as iio
+import numpy as np
+
+from lib.frame_access import FrameAccess
+from lib.pose_drawing import excerpt_extent, pad_and_excerpt_image
+from lib.precompressed import write_atomic
+
+try:
+    from turbojpeg import TJPF_RGB, TurboJPEG, tjMCUHeight, tjMCUWidth
+
+    turbo_jpeg = TurboJPEG()
+except (ImportError, OSError, RuntimeError):
+    logging.info("libjpeg-turbo not available; excerpts will use full-frame decoding")
+    turbo_jpeg = None
+
+SPRITE_MAX_WIDTH = 4096
+
+
+def resize_excerpt(img_region, w, h, resize_dims):
+    rw, rh = resize_dims
+    if rw is not None and rh is not None:
+        return cv2.resize(img_region, (rw, rh))
+    elif rw is not None and rh is None:
+        return cv2.resize(img_region, (rw, h))
+    elif rw is None and rh is not None:
+        return cv2.resize(img_region, (w, rh))
+    else:
+        raise ValueError("Invalid resize dimensions specified")
+
+
+def excerpt_image(img, xywh, resize_dims=None) -> np.ndarray:
+    x, y, w, h = xywh
+    img_region = pad_and_excerpt_image(img, x, y, w, h)
+    if resize_dims is not None:
+        img_region = resize_excerpt(img_region, w, h, resize_dims)
+    return img_region
+
+
+def excerpt_from_image(img, xywh, resize_dims=None) -> bytes:
+    img_region = excerpt_image(img, xywh, resize_dims)
+    return iio.imwrite("<bytes>", img_region, extension=".jpeg")
+
+
+def pack_sprite(images, max_width=SPRITE_MAX_WIDTH):
+    """
+    Pack excerpt images into rows ("shelves") of a single sprite sheet image, in the
+    order given. Returns the sheet and a list of the (x, y, w, h) of each image in it.
+    """
+    offsets = []
+    sheet_width = 0
+    row_x, row_y, row_height = 0, 0, 0
+    for img in images:
+        img_h, img_w = img.shape[:2]
+        if row_x > 0 and row_x + img_w > max_width:
+            row_x, row_y, row_height = 0, row_y + row_height, 0
+        offsets.append((row_x, row_y, img_w, img_h))
+        row_x += img_w
+        row_height = max(row_height, img_h)
+        sheet_width = max(sheet_width, row_x)
+
+    sheet_height = row_y + row_height
+    sheet = np.zeros((max(sheet_height, 1), max(sheet_width, 1), 3), dtype=np.uint8)
+    for img, (x, y, w, h) in zip(images, offsets, strict=True):
+        sheet[y : y + h, x : x + w] = img
+    return sheet, offsets
+
+
+def pack_jpeg_sprite(excerpts, max_width=SPRITE_MAX_WIDTH):
+    """Pack JPEG-encoded excerpts into a sprite sheet, as with pack_sprite()"""
+    images = [iio.imread(content, extension=".jpeg") for content in excerpts]
+    return pack_sprite(images, max_width)
+
+
+def excerpt_from_jpeg(jpeg_bytes: bytes, xywh, resize_dims=None) -> bytes | None:
+    """
+    Cut an excerpt out of a JPEG-encoded frame without decoding the full frame.
+    Returns None if this isn't possible (so the caller should fall back to
+    decoding the frame).
+    """
+    if turbo_jpeg is None:
+        return None
+
+    x, y, w, h = xywh
+    img_w, img_h, subsample, _ = turbo_jpeg.decode_header(jpeg_bytes)
+    x0, y0, x1, y1 = excerpt_extent(img_w, img_h, x, y, w, h)
+
+    # The part of the excerpt that lies within the frame
+    in_x0, in_y0 = max(x0, 0), max(y0, 0)
+    in_x1, in_y1 = min(x1, img_w), min(y1, img_h)
+    if in_x1 <= in_x0 or in_y1 <= in_y0:
+        return None
+
+    # Lossless crops have to start on an MCU boundary
+    crop_x = in_x0 - in_x0 % tjMCUWidth[subsample]
+    crop_y = in_y0 - in_y0 % tjMCUHeight[subsample]
+    cropped = turbo_jpeg.crop(
+        jpeg_bytes, crop_x, crop_y, in_x1 - crop_x, in_y1 - crop_y
+    )
+
+    if resize_dims is None and (crop_x, crop_y, in_x1, in_y1) == (x0, y0, x1, y1):
+        return cropped
+
+    region = turbo_jpeg.decode(cropped, pixel_format=TJPF_RGB)
+    region = region[in_y0 - crop_y :, in_x0 - crop_x :]
+
+    img_region = np.zeros((y1 - y0, x1 - x0, 3), dtype=region.dtype)
+    img_region[
+        in_y0 - y0 : in_y0 - y0 + region.shape[0],
+        in_x0 - x0 : in_x0 - x0 + region.shape[1],
+    ] = region
+
+    if resize_dims is not None:
+        img_region = resize_excerpt(img_region, w, h, resize_dims)
+    return iio.imwrite("<bytes>", img_region, extension=".jpeg")
+
+
+class ExcerptCache:
+    """Content-addressed on-disk cache of encoded excerpt images."""
+
+    def __init__(self, frames: FrameAccess, cache_folder: str):
+        self.frames = frames
+        self.cache_folder = cache_folder
+
+    def excerpt_path(self, video_id: UUID, frame: int, xywh, resize_dims=None) -> Path:
+        key = f"{frame}|{','.join(map(str, xywh))}"
+        if resize_dims is not None:
+            key += f"|{','.join(map(str, resize_dims))}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return Path(self.cache_folder, str(video_id), "excerpts", f"{digest}.jpeg")
+
+    def read(self, video_id: UUID, frame: int, xywh, resize_dims=None) -> bytes | None:
+        excerpt_path = self.excerpt_path(video_id, frame, xywh, resize_dims)
+        try:
+            return excerpt_path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def write(
+        self, video_id: UUID, frame: int, xywh, resize_dims, content: bytes
+    ) -> None:
+        excerpt_path = self.excerpt_path(video_id, frame, xywh, resize_dims)
+        excerpt_path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(excerpt_path, content)
+
+    def make_excerpt(self, video_id: UUID, frame: int, xywh, resize_dims=None):
+        """
+        Get the excerpt from the on-disk cache, or else from the cached frame JPEG
+        without a full decode, if we can
+        """
+        content = self.read(video_id, frame, xywh, resize_dims)
+        if content is not None:
+            return content
+
+        frame_image = self.frames.cached_frame_path(video_id, frame)
+        if self.frames.frames.get((video_id, frame)) is None and frame_image.exists():
+            content = excerpt_from_jpeg(frame_image.read_bytes(), xywh, resize_dims)
+            if content is not None:
+                self.write(video_id, frame, xywh, resize_dims, content)
+        return content
+
+    def make_excerpt_from_image(
+        self, video_id: UUID, frame: int, img, xywh, resize_dims=None
+    ) -> bytes:
+        content = excerpt_from_image(img, xywh, resize_dims)
+        self.write(video_id, frame, xywh, resize_dims, content)
+        return content
+
+    async def get_excerpt(
+        self, video_id: UUID, frame: int, xywh, resize_dims=None
+    ) -> bytes:
+        content = await self.frames.run(
+            self.make_excerpt, video_id, frame, xywh, resize_dims
+        )
+        if content is None:
+            img = await self.frames.get_frame_image(video_id, frame)
+            content = await self.frames.run(
+                self.make_excerpt_from_image, video_id, frame, img, xywh, resize_dims
+            )
+        return content
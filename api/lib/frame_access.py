@@ -0,0 +1,313 @@
+"""Frame access layer for the API's frame image endpoints.
+
+Keeps a bounded pool of open PyAV containers per video (so that requests for
+nearby frames can decode forward from where the last request left off instead of
+re-opening and re-seeking the video), an in-memory LRU cache of recently decoded
+frames with a byte budget, and an in-process cache of video metadata records (kept
+for a short time only, so that a video that's removed or re-ingested by another
+process is soon noticed).
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from uuid import UUID
+
+import av
+import imageio.v3 as iio
+import numpy as np
+
+from lib.metrics import FRAME_REQUESTS
+from lib.work_pool import WorkPool
+
+# Defaults; all can be overridden when instantiating FrameAccess
+FRAME_CACHE_BYTES = 512 * 1024 * 1024
+MAX_READERS_PER_VIDEO = 2
+MAX_OPEN_CONTAINERS = 16
+# Seconds for which a video's metadata record is reused before it's re-read
+VIDEO_METADATA_TTL = 60
+# If a requested frame is this many frames or fewer after a reader's current
+# position, decode forward rather than seeking
+MAX_FORWARD_DECODE = 150
+
+
+class FrameLRUCache:
+    """Thread-safe LRU cache of decoded frame arrays, bounded by total bytes."""
+
+    def __init__(self, max_bytes=FRAME_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._frames: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> np.ndarray | None:
+        with self._lock:
+            img = self._frames.get(key)
+            if img is not None:
+                self._frames.move_to_end(key)
+            return img
+
+    def put(self, key, img: np.ndarray) -> None:
+        if img.nbytes > self.max_bytes:
+            return
+        # Cached frames are shared between requests, so must not be modified
+        img.flags.writeable = False
+        with self._lock:
+            if key in self._frames:
+                self.current_bytes -= self._frames.pop(key).nbytes
+            self._frames[key] = img
+            self.current_bytes += img.nbytes
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.current_bytes -= evicted.nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+            self.current_bytes = 0
+
+    def discard_video(self, video_id) -> None:
+        """Drop the cached frames of one video (keys are (video_id, frame) pairs)"""
+        with self._lock:
+            for key in [key for key in self._frames if key[0] == video_id]:
+                self.current_bytes -= self._frames.pop(key).nbytes
+
+
+class VideoFrameReader:
+    """
+    An open PyAV container for a single video that remembers the index of the last
+    frame it decoded, so that subsequent requests for later frames can continue
+    decoding from there.
+    Frame indices here are 0-based (i.e., MIME frame number - 1).
+    """
+
+    def __init__(self, video_path: Path | str):
+        self.video_path = str(video_path)
+        self.container = av.open(self.video_path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.fps = float(self.stream.average_rate)
+        self.start_time = float((self.stream.start_time or 0) * self.stream.time_base)
+        self.position = -1
+        self._frames = None
+
+    def _frame_index(self, frame: av.VideoFrame) -> int:
+        if frame.time is None:
+            return self.position + 1
+        return round((frame.time - self.start_time) * self.fps)
+
+    def _seek(self, index: int) -> None:
+        target = self.start_time + index / self.fps
+        self.container.seek(
+            int(target / self.stream.time_base), stream=self.stream, backward=True
+        )
+        self._frames = self.container.decode(self.stream)
+        self.position = -1
+
+    def read(self, index: int) -> np.ndarray:
+        if (
+            self._frames is None
+            or index <= self.position
+            or index - self.position > MAX_FORWARD_DECODE
+        ):
+            self._seek(index)
+
+        for frame in self._frames:
+            frame_index = self._frame_index(frame)
+            self.position = frame_index
+            if frame_index >= index:
+                if frame_index != index:
+                    # E.g., a variable frame rate video, or a timestamp gap
+                    logging.warning(
+                        f"Frame {index} of '{self.video_path}' not found; "
+                        f"using frame {frame_index}"
+                    )
+                return frame.to_ndarray(format="rgb24")
+
+        self._frames = None
+        raise IndexError(f"Frame {index} is beyond the end of '{self.video_path}'")
+
+    def close(self) -> None:
+        self._frames = None
+        self.container.close()
+
+
+class ContainerPool:
+    """
+    Bounded pool of idle VideoFrameReaders, at most `max_per_video` for each video and
+    `max_open` overall (the least recently used idle reader is closed when needed).
+    Readers are checked out for exclusive use and returned when done.
+    """
+
+    def __init__(
+        self, max_per_video=MAX_READERS_PER_VIDEO, max_open=MAX_OPEN_CONTAINERS
+    ):
+        self.max_per_video = max_per_video
+        self.max_open = max_open
+        self._idle: OrderedDict = OrderedDict()  # (video_path, id(reader)) -> reader
+        self._lock = threading.Lock()
+
+    def acquire(self, video_path: str, index: int) -> VideoFrameReader:
+        """
+        Check out the idle reader for the video that is best placed to decode the
+        requested frame (the one positioned closest before it), or open a new one.
+        """
+        with self._lock:
+            best_key = None
+            best_distance = None
+            for key, reader in self._idle.items():
+                if key[0] != video_path:
+                    continue
+                distance = index - reader.position
+                if distance <= 0 or distance > MAX_FORWARD_DECODE:
+                    # Reader would have to seek anyway
+                    distance = MAX_FORWARD_DECODE + 1
+                if best_distance is None or distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is not None:
+                return self._idle.pop(best_key)
+
+        return VideoFrameReader(video_path)
+
+    def release(self, reader: VideoFrameReader) -> None:
+        to_close = []
+        with self._lock:
+            same_video = [key for key in self._idle if key[0] == reader.video_path]
+            if len(same_video) >= self.max_per_video:
+                to_close.append(self._idle.pop(same_video[0]))
+            self._idle[(reader.video_path, id(reader))] = reader
+            while len(self._idle) > self.max_open:
+                to_close.append(self._idle.popitem(last=False)[1])
+
+        for idle_reader in to_close:
+            idle_reader.close()
+
+    def discard(self, reader: VideoFrameReader) -> None:
+        try:
+            reader.close()
+        except Exception:
+            logging.debug(f"Error closing reader for '{reader.video_path}'")
+
+    def close_all(self) -> None:
+        with self._lock:
+            readers = list(self._idle.values())
+            self._idle.clear()
+        for reader in readers:
+            self.discard(reader)
+
+
+class VideoNotFound(LookupError):
+    def __init__(self, video_id: UUID):
+        super().__init__(f"No video with ID {video_id}")
+        self.video_id = video_id
+
+
+class FrameAccess:
+    """Serves decoded frame images, from cached JPEGs if present or from the video."""
+
+    def __init__(
+        self,
+        db,
+        video_src_folder: str,
+        cache_folder: str,
+        frame_cache_bytes=FRAME_CACHE_BYTES,
+        max_readers_per_video=MAX_READERS_PER_VIDEO,
+        max_open_containers=MAX_OPEN_CONTAINERS,
+        video_metadata_ttl=VIDEO_METADATA_TTL,
+        pool: WorkPool | None = None,
+    ):
+        self.db = db
+        self.pool = pool
+        self.video_src_folder = video_src_folder
+        self.cache_folder = cache_folder
+        self.frames = FrameLRUCache(frame_cache_bytes)
+        self.containers = ContainerPool(max_readers_per_video, max_open_containers)
+        self.video_metadata_ttl = video_metadata_ttl
+        # video_id -> (time fetched, metadata record)
+        self._videos: dict = {}
+
+    async def get_video(self, video_id: UUID):
+        """
+        Video metadata records, cached in-process for up to video_metadata_ttl
+        seconds. Raises VideoNotFound if there's no such video.
+        """
+        cached = self._videos.get(video_id)
+        if cached is not None and time.monotonic() - cached[0] < self.video_metadata_ttl:
+            return cached[1]
+
+        video = await self.db.get_video_by_id(video_id)
+        if video is None:
+            self.forget_video(video_id)
+            raise VideoNotFound(video_id)
+        if cached is not None and cached[1] != video:
+            # Re-ingested, so its decoded frames may be out of date too
+            self.frames.discard_video(video_id)
+        self._videos[video_id] = (time.monotonic(), video)
+        return video
+
+    def forget_video(self, video_id: UUID) -> None:
+        """Drop everything cached in memory about a video (removed or re-ingested)"""
+        self._videos.pop(video_id, None)
+        self.frames.discard_video(video_id)
+
+    def cached_frame_path(self, video_id: UUID, frame: int) -> Path:
+        return Path(self.cache_folder, str(video_id), "frames", f"{frame}.jpeg")
+
+    def decode_frame(self, video_path: str, frame: int) -> tuple[np.ndarray, bool]:
+        """
+        Decode a frame (1-based frame number) from the video file. If there's no such
+        frame, the next one is returned instead; also returns whether it's the frame.
+        """
+        reader = self.containers.acquire(video_path, frame - 1)
+        try:
+            img = reader.read(frame - 1)
+        except Exception:
+            self.containers.discard(reader)
+            raise
+        exact = reader.position == frame - 1
+        self.containers.release(reader)
+        return img, exact
+
+    def read_frame(self, video_id: UUID, video_name: str, frame: int) -> np.ndarray:
+        key = (video_id, frame)
+        img = self.frames.get(key)
+        if img is not None:
+            FRAME_REQUESTS.labels("memory").inc()
+            return img
+
+        frame_image = self.cached_frame_path(video_id, frame)
+        if frame_image.exists():
+            FRAME_REQUESTS.labels("cache_file").inc()
+            img = iio.imread(frame_image)
+        else:
+            FRAME_REQUESTS.labels("decode").inc()
+            img, exact = self.decode_frame(
+                f"{self.video_src_folder}/{video_name}", frame
+            )
+            if not exact:
+                # Not cached as this frame's image
+                return img
+
+        self.frames.put(key, img)
+        return img
+
+    async def get_frame_image(self, video_id: UUID, frame: int) -> np.ndarray:
+        # Checked first (it's usually cached), so a removed video's frames aren't served
+        video = await self.get_video(video_id)
+        img = self.frames.get((video_id, frame))
+        if img is not None:
+            FRAME_REQUESTS.labels("memory").inc()
+            return img
+        return await self.run(self.read_frame, video_id, video["video_name"], frame)
+
+    async def run(self, func, *args):
+        """Run blocking work in the worker pool (if one was provided)"""
+        if self.pool is None:
+            return func(*args)
+        return await self.pool.run(func, *args)
+
+    def close(self) -> None:
+        self.containers.close_all()
+        self.frames.clear()
@@ -0,0 +1,101 @@
+"""Prometheus metrics for the API server, exposed at /metrics."""
+
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from starlette.routing import Match
+
+# Frame images are served quickly from the in-memory or on-disk cache, or slowly by
+# decoding them from the video
+FRAME_SOURCES = ("memory", "cache_file", "decode")
+
+REQUEST_LATENCY = Histogram(
+    "mime_api_request_duration_seconds",
+    "Time to handle a request, by route",
+    ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "mime_api_requests_in_flight",
+    "Requests currently being handled, by route",
+    ["method", "route"],
+)
+FRAME_REQUESTS = Counter(
+    "mime_api_frame_images_total",
+    "Frame images fetched, by where they came from",
+    ["source"],
+)
+DB_CALL_LATENCY = Histogram(
+    "mime_db_call_duration_seconds",
+    "Time taken by MimeDb method calls, by method",
+    ["method"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 60),
+)
+DB_CALLS_IN_FLIGHT = Gauge(
+    "mime_db_calls_in_flight",
+    "MimeDb method calls currently running, by method",
+    ["method"],
+)
+# Only recorded with DB_INSTRUMENTATION enabled (see mime_db._instrumentation)
+DB_CALL_ROWS = Counter(
+    "mime_db_call_rows_total",
+    "Rows returned by MimeDb method calls, by method",
+    ["method"],
+)
+DB_CALL_BYTES = Counter(
+    "mime_db_call_bytes_total",
+    "Approximate size of the data returned by MimeDb method calls, by method",
+    ["method"],
+)
+DB_SLOW_QUERIES = Counter(
+    "mime_db_slow_queries_total",
+    "Statements slower than SLOW_QUERY_MS, by the MimeDb method that ran them",
+    ["method"],
+)
+
+
+def route_template(app, scope) -> str:
+    """The path template of the route matching a request (to keep label values few)"""
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = (scope["method"], route_template(scope["app"], scope))
+        in_flight = REQUESTS_IN_FLIGHT.labels(*labels)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - start)
+            in_flight.dec()
+
+
+class PoolCollector:
+    """Collects a DB connection pool's stats when metrics are scraped"""
+
+    def __init__(self, get_stats):
+        self.get_stats = get_stats
+
+    def collect(self):
+        for name, value in self.get_stats().items():
+            gauge = GaugeMetricFamily(
+                f"mime_db_pool_{name}", f"Database connection pool {name}"
+            )
+            gauge.add_metric([], value)
+            yield gauge
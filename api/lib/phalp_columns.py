@@ -0,0 +1,218 @@
+"""Columnar sidecar caches of PHALP (4D Humans) and LART output pickles.
+
+Loading a .phalp.pkl or .lart.pkl file materializes a dict of per-frame dicts of
+lists (and SMPL parameters) for the whole recording, often many GB, of which only a
+few fields are used. The first time one is loaded, the fields MIME uses are written
+out, one row per tracked pose, into a folder next to the pickle
+(<pickle>.columns/), with one .npy file per field:
+
+    manifest.json   the source pickle's size and mtime, and the row and frame counts
+    frames.npy      the frame numbers that have rows, in order
+    offsets.npy     the index of the first row of each of those frames (plus the
+                    total number of rows), so that rows[offsets[i]:offsets[i + 1]]
+                    are those of frames[i]
+    <field>.npy     one array per field, its first dimension the row
+
+After that, loaders memory-map the sidecar and read it in chunks of whole frames, so
+re-ingesting a video is fast and its peak memory is bounded by the chunk size. The
+sidecar is rebuilt whenever the pickle changes.
+"""
+
+import json
+import logging
+import shutil
+from pathlib import Path
+from uuid import uuid4
+
+import joblib
+import numpy as np
+
+from lib.precompressed import write_atomic
+
+# Bump to rebuild existing sidecars when their contents change
+SIDECAR_VERSION = 1
+
+# Field: (shape of one row's value, dtype when there are no rows to infer it from)
+PHALP_FIELDS = {
+    "frame": ((), np.int32),
+    "pose_idx": ((), np.int32),
+    "track_id": ((), np.int64),
+    "joints_2d": ((90,), np.float32),
+    "joints_3d": ((45, 3), np.float32),
+    "global_orient": ((3, 3), np.float32),
+    "bbox": ((4,), np.float32),
+    "camera": ((3,), np.float32),
+    "conf": ((), np.float32),
+    "size": ((2,), np.int64),
+    "class_name": ((), np.int64),
+}
+
+LART_FIELDS = {
+    "frame": ((), np.int32),
+    "track_id": ((), np.int64),
+    "ava_action": ((60,), np.float32),
+    # JSON-encoded lists of label strings (fixed-width strings can be memory-mapped,
+    # unlike lists)
+    "labels": ((), np.str_),
+}
+
+
+def phalp_rows(frames):
+    """The PHALP fields of each tracked pose, with its frame's number"""
+    for _, frame in frames.items():
+        if len(frame["2d_joints"]) == 0:
+            continue
+
+        # We only want the pose data about the tracked poses in each frame; the raw
+        # output also contains data about previously tracked poses ("ghosts") that we
+        # really don't want to include. The 2d and 3d joints data  includes these
+        # "ghosts", so need to filter those entries out. This can be done by only using
+        # the indices of the "tracked_ids" in the larger "tid" list to get the joints
+        # and conf data.
+
+        for tracked_id in frame["tracked_ids"]:
+            if tracked_id in frame["tid"]:
+                pose_idx = frame["tid"].index(tracked_id)
+            else:
+                logging.info(
+                    f"Frame {frame['time']+1}: couldn't find tracked ID {tracked_id} "
+                    f"in list of full IDs {frame['tid']}"
+                )
+                continue
+
+            yield {
+                "frame": frame["time"] + 1,
+                "pose_idx": pose_idx,
+                "track_id": tracked_id,
+                "joints_2d": frame["2d_joints"][pose_idx],
+                "joints_3d": frame["3d_joints"][pose_idx],
+                "global_orient": np.reshape(
+                    frame["smpl"][pose_idx]["global_orient"], (3, 3)
+                ),
+                "bbox": frame["bbox"][pose_idx],
+                "camera": frame["camera"][pose_idx],
+                "conf": frame["conf"][pose_idx],
+                "size": frame["size"][pose_idx],
+                "class_name": frame["class_name"][pose_idx],
+            }
+
+
+def lart_rows(frames):
+    """The LART action predictions of each tracked pose, with its frame's number"""
+    for _, frame in frames.items():
+        if len(frame["tracked_ids"]) == 0 or "ava_action" not in frame:
+            continue
+
+        for tracked_id in frame["tracked_ids"]:
+            yield {
+                "frame": frame["time"] + 1,
+                "track_id": tracked_id,
+                "ava_action": frame["ava_action"][tracked_id][0],
+                "labels": json.dumps(list(frame["label"][tracked_id])),
+            }
+
+
+class Columns:
+    """A memory-mapped sidecar, read in chunks of whole frames"""
+
+    def __init__(self, folder: Path, fields: dict):
+        def load(name):
+            return np.load(folder / f"{name}.npy", mmap_mode="r")
+
+        self.frames = load("frames")
+        self.offsets = load("offsets")
+        self.fields = {name: load(name) for name in fields}
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def chunks(self, max_rows: int):
+        """
+        Dicts of the fields' values for consecutive ranges of frames, of up to
+        max_rows rows each (unless a single frame has more)
+        """
+        start = 0
+        while start < len(self.frames):
+            end = np.searchsorted(
+                self.offsets, self.offsets[start] + max_rows, side="right"
+            )
+            # offsets has one more entry than frames
+            end = min(max(int(end) - 1, start + 1), len(self.frames))
+            rows = slice(int(self.offsets[start]), int(self.offsets[end]))
+            yield {name: array[rows] for name, array in self.fields.items()}
+            start = end
+
+
+def _source_stat(pkl_path: Path) -> dict:
+    stat = pkl_path.stat()
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _is_current(folder: Path, pkl_path: Path) -> bool:
+    try:
+        manifest = json.loads((folder / "manifest.json").read_text())
+    except (OSError, ValueError):
+        return False
+    return manifest.get("version") == SIDECAR_VERSION and all(
+        manifest.get(key) == value for key, value in _source_stat(pkl_path).items()
+    )
+
+
+def _array(values: list, shape: tuple, dtype) -> np.ndarray:
+    if not values:
+        return np.zeros((0,) + shape, dtype=dtype)
+    return np.stack([np.asarray(value) for value in values])
+
+
+def write_columns(folder: Path, pkl_path: Path, rows, fields: dict) -> None:
+    source = _source_stat(pkl_path)
+    values = {name: [] for name in fields}
+    for row in rows:
+        for name in fields:
+            values[name].append(row[name])
+
+    # Written to a new folder that then replaces any existing sidecar
+    building = folder.with_name(f"{folder.name}.{uuid4().hex}.tmp")
+    building.mkdir()
+    try:
+        for name, (shape, dtype) in fields.items():
+            np.save(building / f"{name}.npy", _array(values[name], shape, dtype))
+
+        frame_numbers = np.asarray(values["frame"], dtype=np.int64)
+        starts = np.flatnonzero(np.diff(frame_numbers, prepend=-1) != 0)
+        np.save(building / "frames.npy", frame_numbers[starts])
+        np.save(building / "offsets.npy", np.append(starts, len(frame_numbers)))
+
+        manifest = {
+            "version": SIDECAR_VERSION,
+            **source,
+            "rows": len(frame_numbers),
+            "frames": len(starts),
+        }
+        write_atomic(building / "manifest.json", json.dumps(manifest).encode("utf-8"))
+
+        shutil.rmtree(folder, ignore_errors=True)
+        building.rename(folder)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+
+
+def _columns(pkl_path: Path, to_rows, fields: dict) -> Columns:
+    folder = Path(f"{pkl_path}.columns")
+    if not _is_current(folder, pkl_path):
+        logging.info(f"Converting '{pkl_path}' into a columnar sidecar (one-time)...")
+        frames = joblib.load(pkl_path)
+        write_columns(folder, pkl_path, to_rows(frames), fields)
+        del frames
+    return Columns(folder, fields)
+
+
+def phalp_columns(pkl_path: Path) -> Columns:
+    """The PHALP output pickle's columnar sidecar, built first if need be"""
+    return _columns(pkl_path, phalp_rows, PHALP_FIELDS)
+
+
+def lart_columns(pkl_path: Path) -> Columns:
+    """The LART output pickle's columnar sidecar, built first if need be"""
+    return _columns(pkl_path, lart_rows, LART_FIELDS)
@@ -0,0 +1,245 @@
+"""In-process Pr-VIPE (POEM) view-invariant pose embedding service.
+
+The Pr-VIPE graph and checkpoint are loaded once, and query-time embedding
+requests are batched together so that concurrent requests share a single
+`sess.run` call.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# The vendored POEM code uses absolute `poem.core` imports (and is normally run
+# via `python -m poem.pr_vipe.infer` from within lib/), so lib/ needs to be on
+# the module search path before any of it can be imported in-process.
+POEM_LIB_PATH = Path(__file__).parent
+POEM_CHECKPOINT_PATH = (
+    POEM_LIB_PATH / "poem/checkpoints/checkpoint_Pr-VIPE_2M/model.ckpt-02013963"
+)
+
+# Model settings, matching the defaults used by poem.pr_vipe.infer
+POEM_KEYPOINT_PROFILE_2D = "LEGACY_2DCOCO13"
+POEM_MODEL_SETTINGS = {
+    "base_model_type": "SIMPLE",
+    "embedding_type": "GAUSSIAN",
+    "num_embedding_components": 1,
+    "embedding_size": 16,
+    "num_embedding_samples": 20,
+    "num_fc_blocks": 2,
+    "num_fcs_per_block": 2,
+    "num_hidden_nodes": 1024,
+    "num_bottleneck_nodes": 0,
+    "weight_max_norm": 0.0,
+}
+
+# Fake image dimensions for query poses -- it shouldn't make a difference
+# (hopefully), as the model input keypoints are normalized anyway
+QUERY_IMAGE_WIDTH = 1024
+QUERY_IMAGE_HEIGHT = 768
+
+
+def norm_to_poem_input(pose_coords) -> np.ndarray:
+    """
+    Convert a normalized COCO 13-keypoint pose (a flat list of 26 x,y values in a
+    POSE_MAX_DIM extent) into the (13, 2) array of image-size-normalized keypoints
+    expected by the Pr-VIPE model. This is the same conversion applied when writing
+    the input CSV in make_poem_input.py.
+    """
+    return np.round(np.array(pose_coords, dtype=np.float64) / 100, 2).reshape(-1, 2)
+
+
+class PoemEmbedder:
+    """Holds a loaded Pr-VIPE model and batches embedding requests against it."""
+
+    def __init__(
+        self,
+        checkpoint_path=POEM_CHECKPOINT_PATH,
+        max_batch_size=64,
+        batch_window=0.005,
+    ):
+        self.checkpoint_path = Path(checkpoint_path)
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+
+        self._session = None
+        self._keypoints_2d = None
+        self._image_sizes = None
+        self._embeddings = None
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._session is not None
+
+    def load(self) -> None:
+        """Build the inference graph and restore the checkpoint (once)."""
+        with self._load_lock:
+            if self.is_loaded:
+                return
+
+            if str(POEM_LIB_PATH) not in sys.path:
+                sys.path.append(str(POEM_LIB_PATH))
+
+            import tensorflow.compat.v1 as tf
+            from poem.core import (
+                common,
+                input_generator,
+                keypoint_profiles,
+                keypoint_utils,
+                models,
+                pipeline_utils,
+            )
+
+            tf.disable_v2_behavior()
+
+            logging.info(f"Loading Pr-VIPE model from '{self.checkpoint_path}'...")
+
+            keypoint_profile_2d = keypoint_profiles.create_keypoint_profile_or_die(
+                POEM_KEYPOINT_PROFILE_2D
+            )
+
+            graph = tf.Graph()
+            with graph.as_default():
+                keypoints_2d = tf.placeholder(
+                    tf.float32,
+                    shape=[
+                        None,
+                        keypoint_profile_2d.keypoint_num,
+                        keypoint_profile_2d.keypoint_dim,
+                    ],
+                )
+                image_sizes = tf.placeholder(tf.float32, shape=[None, 2])
+
+                model_inputs, _ = input_generator.create_model_input(
+                    keypoint_utils.denormalize_points_by_image_size(
+                        keypoints_2d, image_sizes=image_sizes
+                    ),
+                    keypoint_masks_2d=tf.ones_like(keypoints_2d[..., 0]),
+                    keypoints_3d=None,
+                    model_input_keypoint_type=common.MODEL_INPUT_KEYPOINT_TYPE_2D_INPUT,
+                    model_input_keypoint_mask_type=(
+                        common.MODEL_INPUT_KEYPOINT_MASK_TYPE_NO_USE
+                    ),
+                    keypoint_profile_2d=keypoint_profile_2d,
+                    # Fix seed for determinism.
+                    seed=1,
+                )
+
+                embedder_fn = models.get_embedder(
+                    is_training=False, **POEM_MODEL_SETTINGS
+                )
+                outputs, _ = embedder_fn(model_inputs)
+
+                saver = tf.train.Saver(
+                    pipeline_utils.get_moving_average_variables_to_restore()
+                )
+                session = tf.Session(graph=graph)
+                session.run(tf.global_variables_initializer())
+                saver.restore(session, str(self.checkpoint_path))
+                graph.finalize()
+
+            self._keypoints_2d = keypoints_2d
+            self._image_sizes = image_sizes
+            self._embeddings = outputs[common.KEY_EMBEDDING_MEANS]
+            self._session = session
+
+            logging.info("Pr-VIPE model loaded")
+
+    def embed_batch(self, poses: np.ndarray, image_sizes: np.ndarray | None = None):
+        """
+        Compute (unnormalized) embeddings for a batch of poses, given as an (N, 13, 2)
+        array of image-size-normalized keypoints. `image_sizes` is an (N, 2) array of
+        (height, width) pairs, defaulting to the fake query image size.
+        Returns an (N, 16) array.
+        """
+        self.load()
+
+        poses = np.asarray(poses, dtype=np.float32)
+        if image_sizes is None:
+            image_sizes = np.tile(
+                [QUERY_IMAGE_HEIGHT, QUERY_IMAGE_WIDTH], (poses.shape[0], 1)
+            )
+
+        with self._run_lock:
+            embeddings = self._session.run(
+                self._embeddings,
+                feed_dict={
+                    self._keypoints_2d: poses,
+                    self._image_sizes: np.asarray(image_sizes, dtype=np.float32),
+                },
+            )
+        return embeddings.reshape(poses.shape[0], -1)
+
+    async def start(self) -> None:
+        """Load the model (off the event loop) and start the batching worker."""
+        await asyncio.get_running_loop().run_in_executor(None, self.load)
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run_batches())
+
+    async def stop(self) -> None:
+        """Stop the batching worker, failing any requests still waiting on it."""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.wait([self._worker])
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                _fail_requests([self._queue.get_nowait()], EmbedderStopped())
+
+    async def embed(self, pose_coords) -> list:
+        """
+        Get the embedding for a single normalized COCO 13-keypoint pose. Requests that
+        arrive within `batch_window` seconds of each other are run as one batch.
+        """
+        if self._worker is None:
+            await self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((norm_to_poem_input(pose_coords), future))
+        return (await future).tolist()
+
+    async def _run_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            try:
+                await asyncio.sleep(self.batch_window)
+                while len(batch) < self.max_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+
+                embeddings = await loop.run_in_executor(
+                    None, self.embed_batch, np.stack([pose for pose, _ in batch])
+                )
+            except asyncio.CancelledError:
+                _fail_requests(batch, EmbedderStopped())
+                raise
+            except Exception as err:
+                _fail_requests(batch, err)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings, strict=True):
+                if not future.done():
+                    future.set_result(embedding)
+
+
+class EmbedderStopped(RuntimeError):
+    def __init__(self):
+        super().__init__("The POEM embedder was stopped")
+
+
+def _fail_requests(requests, err: BaseException) -> None:
+    for _, future in requests:
+        if not future.done():
+            future.set_exception(err)
+
+
+poem_embedder = PoemEmbedder()
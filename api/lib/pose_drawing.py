@@ -228,3 +228,13 @@ def pad_and_excerpt_image(img, x, y, w, h):
     img_region = img[y : y + h, x : x + w]
 
     return img_region
+
+
+def excerpt_extent(img_w, img_h, x, y, w, h):
+    """Get the extent, in frame coordinates, of the image region that
+    pad_and_excerpt_image() returns for the given frame size and cutout.
+    Returns (x0, y0, x1, y1); output pixels that fall outside of the frame
+    (0, 0, img_w, img_h) are blank padding."""
+    x1 = min(max(x, 0) + w, max(img_w, x + w))
+    y1 = min(max(y, 0) + h, max(img_h, y + h))
+    return x, y, x1, y1
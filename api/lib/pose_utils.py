@@ -1,54 +1,8 @@
-import csv
-import os
-import subprocess
+import functools
+import warnings
 
 import numpy as np
 
-# Duplicated in api/make_poem_input.py
-CSV_HEADERS = [
-    "image/width",
-    "image/height",
-    "image/object/part/NOSE_TIP/center/x",
-    "image/object/part/NOSE_TIP/center/y",
-    "image/object/part/NOSE_TIP/score",
-    "image/object/part/LEFT_SHOULDER/center/x",
-    "image/object/part/LEFT_SHOULDER/center/y",
-    "image/object/part/LEFT_SHOULDER/score",
-    "image/object/part/RIGHT_SHOULDER/center/x",
-    "image/object/part/RIGHT_SHOULDER/center/y",
-    "image/object/part/RIGHT_SHOULDER/score",
-    "image/object/part/LEFT_ELBOW/center/x",
-    "image/object/part/LEFT_ELBOW/center/y",
-    "image/object/part/LEFT_ELBOW/score",
-    "image/object/part/RIGHT_ELBOW/center/x",
-    "image/object/part/RIGHT_ELBOW/center/y",
-    "image/object/part/RIGHT_ELBOW/score",
-    "image/object/part/LEFT_WRIST/center/x",
-    "image/object/part/LEFT_WRIST/center/y",
-    "image/object/part/LEFT_WRIST/score",
-    "image/object/part/RIGHT_WRIST/center/x",
-    "image/object/part/RIGHT_WRIST/center/y",
-    "image/object/part/RIGHT_WRIST/score",
-    "image/object/part/LEFT_HIP/center/x",
-    "image/object/part/LEFT_HIP/center/y",
-    "image/object/part/LEFT_HIP/score",
-    "image/object/part/RIGHT_HIP/center/x",
-    "image/object/part/RIGHT_HIP/center/y",
-    "image/object/part/RIGHT_HIP/score",
-    "image/object/part/LEFT_KNEE/center/x",
-    "image/object/part/LEFT_KNEE/center/y",
-    "image/object/part/LEFT_KNEE/score",
-    "image/object/part/RIGHT_KNEE/center/x",
-    "image/object/part/RIGHT_KNEE/center/y",
-    "image/object/part/RIGHT_KNEE/score",
-    "image/object/part/LEFT_ANKLE/center/x",
-    "image/object/part/LEFT_ANKLE/center/y",
-    "image/object/part/LEFT_ANKLE/score",
-    "image/object/part/RIGHT_ANKLE/center/x",
-    "image/object/part/RIGHT_ANKLE/center/y",
-    "image/object/part/RIGHT_ANKLE/score",
-]
-
 # Default dimension (length, width, maybe depth, eventually) of single pose viz
 POSE_MAX_DIM = 100
 
@@ -136,80 +90,97 @@ openpifpaf_to_coco_13 = [
 ]
 
 
-def merge_coords(all_coords, guide_to_merge, has_confidence=False, is_3d=False):
-    new_coords = []
-    for to_merge in guide_to_merge:
-        x_avg = sum(all_coords[i][0] for i in to_merge) / len(to_merge)
-        y_avg = sum(all_coords[i][1] for i in to_merge) / len(to_merge)
-        conf = 1.0
-        # 3D pose keypoints don't have confidence values (for now)
-        if is_3d:
-            z_avg = sum(all_coords[i][2] for i in to_merge) / len(to_merge)
-            new_coords.append([x_avg, y_avg, z_avg])
-        else:
-            if has_confidence:
-                conf = sum(all_coords[i][2] for i in to_merge) / len(to_merge)
-            new_coords.append([x_avg, y_avg, conf])
-
-    return np.array(new_coords)
-
-
-def get_poem_embedding(pose_coords):
-    # Write the coords to a CSV on the server
-
-    if not os.path.isdir("poem_files/camera_pose"):
-        os.makedirs("poem_files/camera_pose")
-
-    # Input file to Pr_VIPE code
-    with open(
-        "poem_files/camera_pose/input.csv", "w", newline="", encoding="utf-8"
-    ) as poem_file:
-        poemwriter = csv.writer(poem_file)
-        poemwriter.writerow(CSV_HEADERS)
-
-        posenorm = np.array(pose_coords)
-
-        # Fake these values - it shouldn't make a difference (hopefully)
-        video_width = 1024
-        video_height = 768
-
-        posenorm = np.round(posenorm / 100, 2)
-        pose_data = (
-            np.array(
-                [[posenorm[x], posenorm[x + 1], 1] for x in range(0, len(posenorm), 2)]
-            )
-            .flatten()
-            .tolist()
-        )
-        rowdata = [video_width] + [video_height] + pose_data
-
-        poemwriter.writerow(rowdata)
-
-    # Run the POEM embedding generator on the CSV, producing a new CSV
-    subprocess.run(
-        [
-            "/usr/local/bin/python3",
-            "-m",
-            "poem.pr_vipe.infer",
-            "--input_csv=/app/poem_files/camera_pose/input.csv",
-            "--output_dir=/app/poem_files/camera_pose/",
-            "--checkpoint_path=/app/lib/poem/checkpoints/checkpoint_Pr-VIPE_2M/model.ckpt-02013963",
-        ],
-        cwd="/app/lib",
+@functools.lru_cache(maxsize=None)
+def _merge_plan(guide_to_merge: tuple) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The source coordinate indices of each merged coordinate, padded to the size of
+    the largest group (padding is masked out), and the group sizes
+    """
+    width = max(len(to_merge) for to_merge in guide_to_merge)
+    indices = np.zeros((len(guide_to_merge), width), dtype=np.intp)
+    mask = np.zeros((len(guide_to_merge), width), dtype=bool)
+    for i, to_merge in enumerate(guide_to_merge):
+        indices[i, : len(to_merge)] = to_merge
+        mask[i, : len(to_merge)] = True
+    return indices, mask
+
+
+def merge_coords_batch(all_coords, guide_to_merge, has_confidence=False, is_3d=False):
+    """
+    merge_coords() for an (N, K, 2 or 3) array of N poses' coordinates, returning an
+    (N, len(guide_to_merge), 3) array. Each merged coordinate is summed in the same
+    order, and in the same precision, as merge_coords() does it, so the results are
+    identical.
+    """
+    all_coords = np.asarray(all_coords)
+    if not np.issubdtype(all_coords.dtype, np.floating):
+        all_coords = all_coords.astype(np.float64)
+    indices, mask = _merge_plan(tuple(tuple(to_merge) for to_merge in guide_to_merge))
+
+    averaged = 3 if is_3d or has_confidence else 2
+    gathered = all_coords[:, indices, :averaged]  # (N, M, width, averaged)
+    sums = gathered[:, :, 0]
+    for i in range(1, indices.shape[1]):
+        sums = sums + np.where(mask[:, i, None], gathered[:, :, i], 0)
+    # (Dividing by counts of the sums' type, as dividing by an int would)
+    averages = sums / mask.sum(axis=1).astype(sums.dtype)[:, None]
+
+    if averaged == 3:
+        return averages
+    # Without confidence values, merged coordinates have a confidence of 1.0
+    merged = np.ones(
+        averages.shape[:2] + (3,), dtype=np.promote_types(averages.dtype, np.float64)
     )
+    merged[..., :2] = averages
+    return merged
 
-    # Read the new CSV with the embedding and return the contents
 
-    with open(
-        "poem_files/camera_pose/unnormalized_embeddings.csv",
-        "r",
-        newline="",
-        encoding="utf-8",
-    ) as poem_file:
-        poem_line = poem_file.readline().strip().split(",")
-        poem_embed = [float(c) for c in poem_line]
+def merge_coords(all_coords, guide_to_merge, has_confidence=False, is_3d=False):
+    return merge_coords_batch(
+        np.asarray(all_coords)[None], guide_to_merge, has_confidence, is_3d
+    )[0]
 
-        return poem_embed
+
+def phalp_keypoints_batch(joints_2d, image_sizes, joints_3d, global_orients) -> dict:
+    """
+    The keypoint columns of N PHALP poses (c.f. MimeDb.load_4dh_predictions()), from
+    their (N, 90) normalized 2D joints, (N, 2) [height, width] image sizes, (N, 45, 3)
+    3D joints and (N, 3, 3) "global orientation" rotation matrices, each as an
+    (N, -1) array of flattened keypoints.
+    """
+    count = len(joints_2d)
+    joints_2d = np.array(joints_2d).reshape(count, -1, 2)
+    joints_3d = np.asarray(joints_3d)
+    image_sizes = np.asarray(image_sizes)
+    long_sides = image_sizes.max(axis=1)
+    short_sides = image_sizes.min(axis=1)
+
+    # The 2D joints are normalized to the long side of the image, which was padded
+    # to a square
+    padding = (long_sides - short_sides) / 2
+    joints_2d *= long_sides.astype(joints_2d.dtype)[:, None, None]
+    joints_2d[:, :, 1] -= padding.astype(joints_2d.dtype)[:, None]
+
+    keypoints4dh = np.ones((count, joints_2d.shape[1], 3), dtype=np.float64)
+    keypoints4dh[..., :2] = joints_2d
+
+    # De-rotate/normalize 3D keypoints by multiplying them by the "global
+    # orientation" rotation matrix
+    global_orients = np.asarray(global_orients).reshape(count, 3, 3)
+    global3d_phalp = np.matmul(joints_3d, global_orients)
+
+    keypoints = {
+        "keypoints": merge_coords_batch(joints_2d, phalp_to_coco_13),
+        "keypointsopp": merge_coords_batch(joints_2d, phalp_to_coco_17),
+        "keypoints4dh": keypoints4dh,
+        "keypoints3d": merge_coords_batch(joints_3d, phalp_to_coco_13, is_3d=True),
+        "global3d_phalp": global3d_phalp,
+        # Merged from the single-precision values stored in the db
+        "global3d_coco13": merge_coords_batch(
+            global3d_phalp.astype(np.float32), phalp_to_coco_13, is_3d=True
+        ),
+    }
+    return {name: array.reshape(count, -1) for name, array in keypoints.items()}
 
 
 def unflatten_pose_data(prediction, key="keypoints"):
@@ -220,6 +191,83 @@ def unflatten_pose_data(prediction, key="keypoints"):
     return np.array_split(prediction[key], len(prediction[key]) / 3)
 
 
+def _as_batch(prediction, key="keypoints") -> np.ndarray:
+    return np.asarray(prediction[key], dtype=np.float64).reshape(1, -1, 3)
+
+
+def _from_batch(poses: np.ndarray) -> dict:
+    return {"keypoints": poses[0].flatten()}
+
+
+# Batch versions of the pose normalization functions below, operating on an (N, K, 3)
+# array of N poses' K [x, y, confidence] keypoints. Keypoints with a confidence of 0
+# are untrustworthy: they're left out of a pose's extent and are not modified.
+
+
+def get_pose_extent_batch(poses: np.ndarray) -> np.ndarray:
+    """(N, 4) array of the poses' [min_x, min_y, max_x, max_y]"""
+    coords = np.where(poses[..., 2:3] != 0, poses[..., :2], np.nan)
+    with warnings.catch_warnings():
+        # Poses without any trustworthy keypoints have NaN extents
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.concatenate(
+            (np.nanmin(coords, axis=1), np.nanmax(coords, axis=1)), axis=1
+        )
+
+
+def shift_pose_to_origin_batch(poses: np.ndarray) -> np.ndarray:
+    poses = np.array(poses, dtype=np.float64)
+    extents = get_pose_extent_batch(poses)
+    trustworthy = poses[..., 2:3] != 0
+    poses[..., :2] = np.where(
+        trustworthy, poses[..., :2] - extents[:, None, :2], poses[..., :2]
+    )
+    return poses
+
+
+def rescale_pose_coords_batch(poses: np.ndarray) -> np.ndarray:
+    poses = np.array(poses, dtype=np.float64)
+    extents = get_pose_extent_batch(poses)
+    mins, maxes = extents[:, :2], extents[:, 2:]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale_factors = POSE_MAX_DIM / np.max(maxes, axis=1)
+        sizes = maxes - mins
+        # Center the short axis; the long one needs no recentering
+        recenter = np.round((POSE_MAX_DIM - (scale_factors[:, None] * sizes)) / 2)
+        x_is_long = sizes[:, 0] >= sizes[:, 1]
+        recenter[x_is_long, 0] = 0
+        recenter[~x_is_long, 1] = 0
+
+        rescaled = np.round(
+            poses[..., :2] * scale_factors[:, None, None] + recenter[:, None, :]
+        )
+
+    trustworthy = poses[..., 2:3] != 0
+    poses[..., :2] = np.where(trustworthy, rescaled, poses[..., :2])
+    return poses
+
+
+def shift_normalize_rescale_pose_coords_batch(poses: np.ndarray) -> np.ndarray:
+    return rescale_pose_coords_batch(shift_pose_to_origin_batch(poses))
+
+
+def extract_trustworthy_coords_batch(poses: np.ndarray) -> np.ndarray:
+    """(N, K * 2) array of the poses' x, y coordinates, NaN where untrustworthy"""
+    coords = np.where(poses[..., 2:3] != 0, poses[..., :2], np.nan)
+    return coords.reshape(len(poses), -1)
+
+
+def normalize_poses_batch(poses: np.ndarray) -> np.ndarray:
+    """
+    extract_trustworthy_coords(shift_normalize_rescale_pose_coords()) for a batch of
+    poses: the normalized coordinates that are compared in pose searches
+    """
+    return extract_trustworthy_coords_batch(
+        shift_normalize_rescale_pose_coords_batch(poses)
+    )
+
+
 def extract_trustworthy_coords(prediction, key="keypoints"):
     """
     Convert an Open PifPaf pose prediction from a 1D vector of coordinates and confidence
@@ -227,34 +275,12 @@ def extract_trustworthy_coords(prediction, key="keypoints"):
     coordinate values set to NaN,NaN for any coordinate with a confidence value of 0.
     Returns the 17x2 array and a separate list of the original confidence values.
     """
-    unflattened_pose = unflatten_pose_data(prediction, key)
-    trustworthy_coords = np.array(
-        [
-            [coords[0], coords[1]] if coords[2] != 0 else [np.NaN, np.NaN]
-            for coords in unflattened_pose
-        ]
-    ).flatten()
-    # confidences = [coords[3] for coords in unflattened_pose]
-    return trustworthy_coords
+    return extract_trustworthy_coords_batch(_as_batch(prediction, key))[0]
 
 
 def get_pose_extent(prediction, key="keypoints"):
     """Get the min and max x and y coordinates of an Open PifPaf pose prediction"""
-    pose_coords = unflatten_pose_data(prediction, key)
-    min_x = np.NaN
-    min_y = np.NaN
-    max_x = np.NaN
-    max_y = np.NaN
-    for coords in pose_coords:
-        # Coordinates with confidence values of 0 are not considered
-        if coords[2] == 0:
-            continue
-        min_x = np.nanmin([min_x, coords[0]])
-        min_y = np.nanmin([min_y, coords[1]])
-        max_x = np.nanmax([max_x, coords[0]])
-        max_y = np.nanmax([max_y, coords[1]])
-
-    return [min_x, min_y, max_x, max_y]
+    return get_pose_extent_batch(_as_batch(prediction, key))[0].tolist()
 
 
 def shift_pose_to_origin(prediction, key):
@@ -263,18 +289,7 @@ def shift_pose_to_origin(prediction, key):
     min x and y coordinates of its extent are at the 0,0 origin.
     NOTE: This only returns the modified 'keypoints' portion of the prediction.
     """
-    pose_coords = unflatten_pose_data(prediction, key)
-    min_x, min_y, _, _ = get_pose_extent(prediction, key)
-
-    for i, coords in enumerate(pose_coords):
-        # Coordinates with confidence values of 0 are not modified; these should not
-        # be used in any pose representations or calculations, and often (but not
-        # always) already have 0,0 coordinates.
-        if coords[2] == 0:
-            continue
-        pose_coords[i] = [coords[0] - min_x, coords[1] - min_y, coords[2]]
-
-    return {"keypoints": np.concatenate(pose_coords, axis=None)}
+    return _from_batch(shift_pose_to_origin_batch(_as_batch(prediction, key)))
 
 
 def rescale_pose_coords(prediction, key="keypoints"):
@@ -285,34 +300,7 @@ def rescale_pose_coords(prediction, key="keypoints"):
     shifted so that the short axis is centered within the POSE_MAX_DIM extent.
     NOTE: This only returns the modified 'keypoints' portion of the prediction.
     """
-    pose_coords = unflatten_pose_data(prediction, key)
-    min_x, min_y, max_x, max_y = get_pose_extent(prediction, key)
-
-    scale_factor = POSE_MAX_DIM / np.max([max_x, max_y])
-
-    x_extent = max_x - min_x
-    y_extent = max_y - min_y
-
-    if x_extent >= y_extent:
-        x_recenter = 0
-        y_recenter = round((POSE_MAX_DIM - (scale_factor * y_extent)) / 2)
-    else:
-        x_recenter = round((POSE_MAX_DIM - (scale_factor * x_extent)) / 2)
-        y_recenter = 0
-
-    for i, coords in enumerate(pose_coords):
-        # Coordinates with confidence values of 0 are not modified; these should not
-        # be used in any pose representations or calculations, and often (but not
-        # always) already have 0,0 coordinates.
-        if coords[2] == 0:
-            continue
-        pose_coords[i] = [
-            round(coords[0] * scale_factor + x_recenter),
-            round(coords[1] * scale_factor + y_recenter),
-            coords[2],
-        ]
-
-    return {"keypoints": np.concatenate(pose_coords, axis=None)}
+    return _from_batch(rescale_pose_coords_batch(_as_batch(prediction, key)))
 
 
 def shift_normalize_rescale_pose_coords(prediction, key="keypoints"):
@@ -322,4 +310,6 @@ def shift_normalize_rescale_pose_coords(prediction, key="keypoints"):
     POSE_MAX_DIM * POSE_MAX_DIM extent.
     NOTE: This only returns the modified 'keypoints' portion of the prediction.
     """
-    return rescale_pose_coords(shift_pose_to_origin(prediction, key))
+    return _from_batch(
+        shift_normalize_rescale_pose_coords_batch(_as_batch(prediction, key))
+    )
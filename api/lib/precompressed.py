@@ -0,0 +1,73 @@
+"""Write and serve precompressed (gzip and brotli) variants of cached files."""
+
+import gzip
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    logging.info("brotli not available; only gzip variants will be written")
+    brotli = None
+
+# Preferred first, when the client accepts more than one
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def write_atomic(path: Path, content: bytes) -> None:
+    """Write to a temporary file and rename, so readers never see partial files"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as _fh:
+            _fh.write(content)
+        os.replace(tmp_path, path)
+    except OSError:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def write_precompressed(path: Path, content: bytes) -> None:
+    """Write `content` to `path`, along with .gz and (if possible) .br variants"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_atomic(Path(f"{path}.gz"), gzip.compress(content, compresslevel=9))
+    if brotli is not None:
+        write_atomic(Path(f"{path}.br"), brotli.compress(content, quality=11))
+    # The uncompressed file is written last, as its presence marks the cache as done
+    write_atomic(path, content)
+
+
+def ensure_precompressed(path: Path) -> None:
+    """Add any missing compressed variants for an existing cached file"""
+    missing = [
+        encoding
+        for encoding, suffix in ENCODING_SUFFIXES.items()
+        if not Path(f"{path}{suffix}").exists()
+        and (encoding != "br" or brotli is not None)
+    ]
+    if missing:
+        write_precompressed(path, path.read_bytes())
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for entry in accept_encoding.split(","):
+        encoding, _, params = entry.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def select_variant(path: Path, accept_encoding: str) -> tuple[Path, str | None]:
+    """
+    Pick the best precompressed variant of `path` given the request's Accept-Encoding
+    header. Returns the file to serve and its Content-Encoding (None if uncompressed).
+    """
+    accepted = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        variant = Path(f"{path}{suffix}")
+        if (encoding in accepted or "*" in accepted) and variant.exists():
+            return variant, encoding
+    return path, None
@@ -0,0 +1,106 @@
+"""Opaque cursor tokens for paging through similarity search results.
+
+A cursor holds the sort position — (distance, video_id, frame, pose_idx) — of the
+last result of a page, so the next page's query continues after it instead of
+recomputing the results before it, plus any other state the search needs to carry
+between pages. Tokens are URL-safe base64-encoded JSON.
+
+As tokens come from clients, the state they decode to is checked against the types
+of STATE_TYPES; any other state is rejected.
+"""
+
+import base64
+import binascii
+import json
+from uuid import UUID
+
+
+def _is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_list_of(value, check) -> bool:
+    return isinstance(value, list) and all(check(item) for item in value)
+
+
+def _is_window(value) -> bool:
+    """[video_id, pose_idx, starts, ends] (c.f. TemporalSuppressor.state())"""
+    return (
+        isinstance(value, list)
+        and len(value) == 4
+        and isinstance(value[0], str)
+        and _is_count(value[1])
+        and _is_list_of(value[2], _is_int)
+        and _is_list_of(value[3], _is_int)
+        and len(value[2]) == len(value[3])
+    )
+
+
+def _is_tied(value) -> bool:
+    """[video_id, pose_idx, frame]"""
+    return (
+        isinstance(value, list)
+        and len(value) == 3
+        and isinstance(value[0], str)
+        and _is_count(value[1])
+        and _is_int(value[2])
+    )
+
+
+# The state that searches carry between pages, and checks of its values
+STATE_TYPES = {
+    # How far down its results a search got
+    "depth": _is_count,
+    "candidates": _is_count,
+    # The rank and distance of the last candidate, and the suppression state of a
+    # pose search
+    "rank": lambda value: value is None or _is_count(value),
+    "distance": lambda value: value is None or _is_number(value),
+    "windows": lambda value: _is_list_of(value, _is_window),
+    "tied": lambda value: _is_list_of(value, _is_tied),
+}
+
+
+def encode_cursor(position: tuple, **state) -> str:
+    distance, video_id, frame, pose_idx = position
+    content = {"after": [float(distance), str(video_id), int(frame), int(pose_idx)]}
+    content.update(state)
+    return base64.urlsafe_b64encode(json.dumps(content).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token: str) -> tuple[tuple, dict]:
+    """
+    Returns the position to continue after and any other state; raises ValueError
+    if the token is malformed.
+    """
+    try:
+        content = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        if not isinstance(content, dict):
+            raise ValueError("Not an object")
+        distance, video_id, frame, pose_idx = content.pop("after")
+        position = (float(distance), UUID(video_id), int(frame), int(pose_idx))
+    except (binascii.Error, UnicodeError, TypeError, KeyError, ValueError) as e:
+        raise ValueError("Invalid search cursor") from e
+
+    for name, value in content.items():
+        if name not in STATE_TYPES or not STATE_TYPES[name](value):
+            raise ValueError(f"Invalid search cursor state '{name}'")
+    return position, content
+
+
+def next_cursor(results: list, limit: int, **state) -> str | None:
+    """Cursor for the page after `results`, or None if this was the last page"""
+    if len(results) < limit or not results:
+        return None
+    last = results[-1]
+    return encode_cursor(
+        (last["distance"], last["video_id"], last["frame"], last["pose_idx"]), **state
+    )
@@ -0,0 +1,314 @@
+"""In-process, memory-mapped exact vector search over a single video's poses.
+
+An alternative to running single-video similarity searches through pgvector: each
+video's searchable embeddings are exported once (after ingest) into float32 .npy
+matrices, with row-aligned side arrays of the pose, frame and face attributes the
+searches filter on and return. Searches memory-map these files, so several server
+worker processes share one copy through the page cache, and are answered with a
+matrix-vector product and a vectorized top-k, without a DB round trip.
+
+Results match those of the pgvector searches in MimeDb.search_by_pose() and
+MimeDb.get_nearest_poses() for a single video (including which poses are eligible
+to be matched, i.e., those with frame and face records and a known shot).
+
+Layout, under <cache_folder>/<video_id>/vectors/:
+
+    manifest.json           the current export's ID, row count and embeddings
+    <export_id>/<name>.npy  one file per embedding or side array
+"""
+
+import json
+import logging
+import shutil
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import numpy as np
+
+from lib.precompressed import write_atomic
+
+SIDE_ARRAYS = {
+    "frame": np.int32,
+    "pose_idx": np.int32,
+    "track_id": np.int32,
+    "shot": np.int32,
+    "face_cluster_id": np.int32,
+    "searchable": np.bool_,
+}
+# Stands in for NULL in the integer side arrays
+MISSING = -1
+
+
+def _column(poses, key: str, dtype) -> np.ndarray:
+    return np.fromiter(
+        (MISSING if pose[key] is None else pose[key] for pose in poses),
+        dtype=dtype,
+        count=len(poses),
+    )
+
+
+def _matrix(poses, key: str) -> np.ndarray:
+    """Stack a vector column into a float32 matrix, with NaN rows for NULLs"""
+    dim = next((len(pose[key]) for pose in poses if pose[key] is not None), 0)
+    matrix = np.full((len(poses), dim), np.nan, dtype=np.float32)
+    for i, pose in enumerate(poses):
+        if pose[key] is not None:
+            matrix[i] = pose[key]
+    return matrix
+
+
+def _vector(row: np.ndarray) -> np.ndarray | None:
+    return None if np.isnan(row).any() else np.array(row)
+
+
+class VideoVectors:
+    """The memory-mapped search data of one exported video"""
+
+    def __init__(self, folder: Path, manifest: dict):
+        self.video_id = manifest["video_id"]
+        self.video_name = manifest["video_name"]
+        self.export_id = manifest["export_id"]
+        export_folder = folder / self.export_id
+
+        def load(name):
+            return np.load(export_folder / f"{name}.npy", mmap_mode="r")
+
+        self.side = {name: load(name) for name in SIDE_ARRAYS}
+        self.keypoints = load("keypoints")
+        self.embeddings = {name: load(name) for name in manifest["embeddings"]}
+        self.row_norms = {
+            name: load(f"{name}.norms") for name in manifest["embeddings"]
+        }
+
+    def find(self, frame: int, pose_idx: int) -> int | None:
+        frames = self.side["frame"]
+        start = np.searchsorted(frames, frame, side="left")
+        end = np.searchsorted(frames, frame, side="right")
+        matches = np.flatnonzero(self.side["pose_idx"][start:end] == pose_idx)
+        return int(start + matches[0]) if len(matches) else None
+
+    def distances(self, embedding: str, query: np.ndarray, metric: str) -> np.ndarray:
+        """
+        Distances from every pose to `query`, as pgvector would compute them (so
+        that they sort nearest first; c.f. mime_db._search_sql.distance_sql())
+        """
+        matrix = self.embeddings[embedding]
+        dots = matrix @ query
+        if metric == "cosine":
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return 1 - dots / (self.row_norms[embedding] * np.linalg.norm(query))
+        if metric == "euclidean":
+            squared = self.row_norms[embedding] ** 2 - 2 * dots + query @ query
+            return np.sqrt(np.maximum(squared, 0))
+        if metric == "innerproduct":
+            # Like <#>, the negative inner product
+            return -dots
+        raise ValueError(f"Unsupported distance metric '{metric}'")
+
+    def top_k(
+        self, distances: np.ndarray, mask: np.ndarray, limit: int, metric: str
+    ) -> list:
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > limit:
+            # Keep any ties with the limit-th distance, so the tie-break below decides
+            kth = np.partition(distances[candidates], limit - 1)[limit - 1]
+            candidates = candidates[distances[candidates] <= kth]
+        # Same order as the DB searches: by distance, then frame and pose_idx
+        order = np.lexsort(
+            (
+                self.side["pose_idx"][candidates],
+                self.side["frame"][candidates],
+                distances[candidates],
+            )
+        )
+        candidates = candidates[order][:limit]
+        # c.f. mime_db._search_sql.reported_distance_sql()
+        sign = -1 if metric == "innerproduct" else 1
+
+        return [
+            {
+                "video_id": self.video_id,
+                "video_name": self.video_name,
+                "frame": int(self.side["frame"][i]),
+                "pose_idx": int(self.side["pose_idx"][i]),
+                "norm": _vector(self.embeddings["norm"][i]),
+                "keypoints": _vector(self.keypoints[i]),
+                "distance": sign * float(distances[i]),
+                "shot": int(self.side["shot"][i]),
+                "face_cluster_id": (
+                    None
+                    if self.side["face_cluster_id"][i] == MISSING
+                    else int(self.side["face_cluster_id"][i])
+                ),
+            }
+            for i in candidates
+        ]
+
+    def search(
+        self,
+        query: np.ndarray,
+        metric: str,
+        embedding: str,
+        max_distance: float,
+        limit: int,
+        exclude: np.ndarray | None = None,
+        after: tuple | None = None,
+    ) -> list:
+        distances = self.distances(embedding, query, metric)
+        # NaN distances (NULL or zero-length embeddings) fail the comparison
+        mask = self.side["searchable"] & (distances < max_distance)
+        if exclude is not None:
+            mask &= ~exclude
+        if after is not None:
+            # Only this video's poses are searched, so its ID isn't part of the key
+            (distance, _, frame, pose_idx) = after
+            if metric == "innerproduct":
+                distance = -distance
+            frames = self.side["frame"]
+            mask &= (distances > distance) | (
+                (distances == distance)
+                & (
+                    (frames > frame)
+                    | ((frames == frame) & (self.side["pose_idx"] > pose_idx))
+                )
+            )
+        return self.top_k(distances, mask, limit, metric)
+
+
+class VectorStore:
+    """Exports and searches the per-video memory-mapped vector files"""
+
+    def __init__(self, cache_folder: str):
+        self.cache_folder = cache_folder
+        self._videos: dict[UUID, tuple[int, VideoVectors]] = {}
+
+    def folder(self, video_id: UUID) -> Path:
+        return Path(self.cache_folder, str(video_id), "vectors")
+
+    async def export(self, db, video_id: UUID) -> None:
+        video = await db.get_video_by_id(video_id)
+        embeddings, poses = await db.get_pose_search_data(video_id)
+        self.write(video_id, video["video_name"], embeddings, poses)
+
+    def write(self, video_id: UUID, video_name: str, embeddings: list, poses) -> None:
+        folder = self.folder(video_id)
+        export_id = uuid4().hex
+        export_folder = folder / export_id
+        export_folder.mkdir(parents=True)
+
+        side = {
+            name: _column(poses, name, dtype)
+            for name, dtype in SIDE_ARRAYS.items()
+            if name != "searchable"
+        }
+        side["searchable"] = np.fromiter(
+            (pose["joined"] and pose["shot"] is not None for pose in poses),
+            dtype=np.bool_,
+            count=len(poses),
+        )
+        for name, array in side.items():
+            np.save(export_folder / f"{name}.npy", array)
+        np.save(export_folder / "keypoints.npy", _matrix(poses, "keypoints"))
+        exported = []
+        for name in embeddings:
+            matrix = _matrix(poses, name)
+            if matrix.shape[1] == 0:
+                # No poses of this video have this embedding
+                continue
+            np.save(export_folder / f"{name}.npy", matrix)
+            np.save(export_folder / f"{name}.norms.npy", np.linalg.norm(matrix, axis=1))
+            exported.append(name)
+
+        manifest = {
+            "video_id": str(video_id),
+            "video_name": video_name,
+            "export_id": export_id,
+            "rows": len(poses),
+            "embeddings": exported,
+        }
+        write_atomic(folder / "manifest.json", json.dumps(manifest).encode("utf-8"))
+        logging.info(f"Exported {len(poses)} pose vectors for video {video_id}")
+
+        # Processes that still have the old files mapped keep their data until they
+        # notice the new manifest
+        for previous in folder.iterdir():
+            if previous.is_dir() and previous.name != export_id:
+                shutil.rmtree(previous, ignore_errors=True)
+
+    def remove(self, video_id: UUID) -> None:
+        """Delete the video's exported vectors, if any"""
+        folder = self.folder(video_id)
+        # Servers stop using the files as soon as the manifest is gone
+        (folder / "manifest.json").unlink(missing_ok=True)
+        shutil.rmtree(folder, ignore_errors=True)
+        self._videos.pop(video_id, None)
+
+    def get(self, video_id: UUID) -> VideoVectors | None:
+        """The video's (current) vectors, or None if they haven't been exported"""
+        manifest_path = self.folder(video_id) / "manifest.json"
+        try:
+            mtime = manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._videos.pop(video_id, None)
+            return None
+
+        loaded = self._videos.get(video_id)
+        if loaded is None or loaded[0] != mtime:
+            manifest = json.loads(manifest_path.read_text())
+            loaded = (mtime, VideoVectors(manifest_path.parent, manifest))
+            self._videos[video_id] = loaded
+        return loaded[1]
+
+    def search_by_pose(
+        self,
+        video_id: UUID,
+        query: list,
+        metric="cosine",
+        embedding="norm",
+        max_distance=float("inf"),
+        limit=500,
+        after: tuple | None = None,
+    ) -> list | None:
+        """c.f. MimeDb.search_by_pose(); None if the video hasn't been exported"""
+        vectors = self.get(video_id)
+        if vectors is None or embedding not in vectors.embeddings:
+            return None
+        return vectors.search(
+            np.asarray(query, dtype=np.float32),
+            metric,
+            embedding,
+            max_distance,
+            limit,
+            after=after,
+        )
+
+    def get_nearest_poses(
+        self,
+        video_id: UUID,
+        frame: int,
+        pose_idx: int,
+        metric="cosine",
+        embedding="norm",
+        max_distance=float("inf"),
+        avoid_shot=-1,
+        limit=500,
+        after: tuple | None = None,
+    ) -> list | None:
+        """c.f. MimeDb.get_nearest_poses(); None if the video hasn't been exported"""
+        vectors = self.get(video_id)
+        if vectors is None or embedding not in vectors.embeddings:
+            return None
+
+        reference = vectors.find(frame, pose_idx)
+        if reference is None:
+            return []
+        query = np.array(vectors.embeddings[embedding][reference])
+        if np.isnan(query).any():
+            return []
+
+        exclude = (
+            (vectors.side["frame"] == frame) & (vectors.side["pose_idx"] == pose_idx)
+        ) | (vectors.side["shot"] == avoid_shot)
+        return vectors.search(
+            query, metric, embedding, max_distance, limit, exclude, after
+        )
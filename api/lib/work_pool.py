@@ -0,0 +1,66 @@
+"""Bounded worker pools and per-route concurrency limits for the API server.
+
+CPU-bound image work (decoding, cropping, resizing, encoding) and blocking file
+I/O are run in bounded thread pools rather than on the asyncio event loop, so a
+slow frame decode can't hold up every other request. The image libraries used
+(PyAV, OpenCV, libjpeg-turbo, Pillow) release the GIL while they work, so
+threads are sufficient here.
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import Depends
+
+
+class WorkPool:
+    """A thread pool that also caps how much work can be waiting on it."""
+
+    def __init__(self, name: str, max_workers: int, max_pending: int | None = None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending or max_workers * 4
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f"mime-{name}"
+        )
+        self._semaphore: asyncio.Semaphore | None = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily, so that it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        return self._semaphore
+
+    async def run(self, func, *args, **kwargs):
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RouteLimit:
+    """
+    Caps the number of requests to a group of routes that are handled at once; use
+    as a route dependency, e.g. `@app.get(..., dependencies=[frame_routes.depends])`.
+    """
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self._semaphore: asyncio.Semaphore | None = None
+        self.depends = Depends(self._limit)
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    async def _limit(self):
+        async with self.semaphore:
+            yield
@@ -69,39 +69,43 @@ async def main() -> None:
 
     logging.info("Loading face detection results from JSON file into the DB")
 
-    with jsonlines.open(input_path) as reader:
-        faces_to_add = []
-        for face in reader:
-            if len(faces_to_add) >= BATCH_SIZE:
-                await db.add_video_faces(video_id, faces_to_add)
-                faces_to_add = []
-            # Don't bother
-            if face["confidence"] == 0 or not face["landmarks"]:
-                continue
-            landmarks_vector = [
-                coord for pair in face["landmarks"].values() for coord in pair
-            ]
-            # Previously, we padded all embeddings to 4096 elements because we
-            # might use DeepFace, which produces that many. But the 512
-            # elements (from ArcFace) are sufficient and use less storage.
-            embedding = face["embedding"]
-            if len(face["embedding"]) != FACE_FEATURES:
-                logging.error(
-                    f"Only face embeddings with {FACE_FEATURES} dimensions are supported."
-                )
-                return
-
-            faces_to_add.append(
-                [
-                    face["frame"],
-                    face["bbox"],
-                    face["confidence"],
-                    landmarks_vector,
-                    embedding,
+    # Replaces the video's faces that aren't matched to poses, and builds the index
+    # on their embeddings once they're all loaded
+    async with db.replacing_faces(video_id, matched=False) as add_faces:
+        with jsonlines.open(input_path) as reader:
+            faces_to_add = []
+            for face in reader:
+                if len(faces_to_add) >= BATCH_SIZE:
+                    await add_faces(faces_to_add)
+                    faces_to_add = []
+                # Don't bother
+                if face["confidence"] == 0 or not face["landmarks"]:
+                    continue
+                landmarks_vector = [
+                    coord for pair in face["landmarks"].values() for coord in pair
                 ]
-            )
-        if len(faces_to_add) > 0:
-            await db.add_video_faces(video_id, faces_to_add)
+                # Previously, we padded all embeddings to 4096 elements because we
+                # might use DeepFace, which produces that many. But the 512
+                # elements (from ArcFace) are sufficient and use less storage.
+                embedding = face["embedding"]
+                if len(face["embedding"]) != FACE_FEATURES:
+                    # Raised so that the video's faces aren't replaced after all
+                    raise SystemExit(
+                        f"Only face embeddings with {FACE_FEATURES} dimensions are "
+                        "supported."
+                    )
+
+                faces_to_add.append(
+                    [
+                        face["frame"],
+                        face["bbox"],
+                        face["confidence"],
+                        landmarks_vector,
+                        embedding,
+                    ]
+                )
+            if len(faces_to_add) > 0:
+                await add_faces(faces_to_add)
 
 
 if __name__ == "__main__":
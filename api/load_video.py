@@ -29,11 +29,11 @@ def get_video_metadata(video_file):
     }
 
 
-def normalize_pose_data(pose):
-    normalized_coords = pose_utils.extract_trustworthy_coords(
-        pose_utils.shift_normalize_rescale_pose_coords(pose)
-    )
-    return normalized_coords
+def normalize_poses(poses, key="keypoints"):
+    """Normalized coordinates of all of the poses, with -1 for untrustworthy ones"""
+    keypoints = np.array([pose[key] for pose in poses]).reshape(len(poses), -1, 3)
+    normalized = np.nan_to_num(pose_utils.normalize_poses_batch(keypoints), nan=-1)
+    return [tuple(coords) for coords in normalized.tolist()]
 
 
 async def main() -> None:
@@ -86,9 +86,9 @@ async def main() -> None:
     logging.info("Normalizing pose data, and annotating db records...")
     await db.annotate_pose(
         "norm",
-        "vector(26)",
         video_id,
-        lambda pose: tuple(np.nan_to_num(normalize_pose_data(pose), nan=-1).tolist()),
+        normalize_poses,
+        batch=True,
     )
 
 
@@ -9,10 +9,8 @@ import os
 from pathlib import Path
 
 import cv2
-import numpy as np
 from rich.logging import RichHandler
 
-import lib.pose_utils as pose_utils
 from mime_db import MimeDb
 
 
@@ -29,13 +27,6 @@ def get_video_metadata(video_file):
     }
 
 
-def normalize_pose_data(pose, key="keypoints"):
-    normalized_coords = pose_utils.extract_trustworthy_coords(
-        pose_utils.shift_normalize_rescale_pose_coords(pose, key)
-    )
-    return normalized_coords
-
-
 async def main() -> None:
     """Command-line entry-point."""
 
@@ -81,44 +72,16 @@ async def main() -> None:
 
     logging.info("Loading pose data into DB")
 
-    # Load pose data into database
+    # Load pose data into database, along with the normalized and 3D COCO 13
+    # keypoints that are computed from it
     await db.load_4dh_predictions(video_id, pkl_path)
 
-    # Normalize pose data and annotate database records
-    logging.info("Normalizing pose data, and annotating db records...")
-    await db.annotate_pose(
-        "norm",
-        "vector(26)",
-        video_id,
-        lambda pose: tuple(
-            np.nan_to_num(normalize_pose_data(pose, "keypoints"), nan=-1).tolist()
-        ),
-    )
-
-    # Normalize 3D pose data and annotate database records
-    logging.info("Normalizing 3D pose data, and annotating db records...")
-    await db.annotate_pose(
-        "global3d_coco13",
-        "vector(39)",
-        video_id,
-        lambda pose: tuple(
-            pose_utils.merge_coords(
-                np.array(pose["global3d_phalp"]).reshape(-1, 3),
-                pose_utils.phalp_to_coco_13,
-                is_3d=True,
-            )
-            .flatten()
-            .tolist()
-        ),
-    )
-
     # This is for when we want to merge the full 45-point PHALP set into a set of
     # normalized COCO points for pose similarity and clustering calculations
     # Normalize pose data and annotate database records
     # logging.info("Normalizing pose data, and annotating db records...")
     # await db.annotate_pose(
     #     "norm",
-    #     "vector(34)",
     #     video_id,
     #     lambda pose: tuple(np.nan_to_num(normalize_pose_data({"keypoints": merge_phalp_coords(pose['keypoints'].reshape(-1, 2), phalp_to_coco).flatten()}), nan=-1).tolist()),
     #     pose_tbl="pose4dh"
@@ -127,7 +90,6 @@ async def main() -> None:
     # We're not using this at present, either
     # await db.annotate_pose(
     #     "norm4dh",
-    #     "vector(90)",
     #     video_id,
     #     lambda pose: tuple(np.nan_to_num(normalize_pose_data(pose, "keypoints4dh"), nan=-1).tolist()),
     # )
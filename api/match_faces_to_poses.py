@@ -46,7 +46,9 @@ def get_bbox_overlap(box1, box2):
     return 0
 
 
-async def match_faces_in_frames(video_id, faces_to_match, min_frameno, max_frameno, db):
+async def match_faces_in_frames(
+    video_id, faces_to_match, min_frameno, max_frameno, db, add_faces
+):
     logging.info(
         f"Running match_faces_in_frames with start frame {min_frameno} end {max_frameno}"
     )
@@ -122,7 +124,7 @@ async def match_faces_in_frames(video_id, faces_to_match, min_frameno, max_frame
                 )
 
     if len(matches_to_assign) > 0:
-        await db.add_pose_faces(matches_to_assign)
+        await add_faces(matches_to_assign)
 
 
 async def main() -> None:
@@ -175,42 +177,45 @@ async def main() -> None:
 
     logging.info("Matching tracked poses to faces detected in video")
 
-    with jsonlines.open(faces_file) as reader:
-        for face in reader:
-            if (
-                face["confidence"] == 0
-                or not face["landmarks"]
-                or face["frame"] not in track_frame_ids
-            ):
-                continue
-
-            if face["frame"] in faces_to_match:
-                faces_to_match[face["frame"]].append(face)
-            else:
-                faces_to_match[face["frame"]] = [face]
-
-            if min_frameno is None:
-                min_frameno = face["frame"]
-            else:
-                min_frameno = min(min_frameno, face["frame"])
-
-            if max_frameno is None:
-                max_frameno = face["frame"]
-            else:
-                max_frameno = max(max_frameno, face["frame"])
+    # Replaces any faces matched to the video's poses before, and builds the index on
+    # their embeddings once they're all loaded
+    async with db.replacing_faces(video_id, matched=True) as add_faces:
+        with jsonlines.open(faces_file) as reader:
+            for face in reader:
+                if (
+                    face["confidence"] == 0
+                    or not face["landmarks"]
+                    or face["frame"] not in track_frame_ids
+                ):
+                    continue
+
+                if face["frame"] in faces_to_match:
+                    faces_to_match[face["frame"]].append(face)
+                else:
+                    faces_to_match[face["frame"]] = [face]
+
+                if min_frameno is None:
+                    min_frameno = face["frame"]
+                else:
+                    min_frameno = min(min_frameno, face["frame"])
+
+                if max_frameno is None:
+                    max_frameno = face["frame"]
+                else:
+                    max_frameno = max(max_frameno, face["frame"])
+
+                if len(faces_to_match) >= BATCH_SIZE:
+                    await match_faces_in_frames(
+                        video_id, faces_to_match, min_frameno, max_frameno, db, add_faces
+                    )
+                    faces_to_match = {}
+                    min_frameno = None
+                    max_frameno = None
 
-            if len(faces_to_match) >= BATCH_SIZE:
+            if len(faces_to_match) > 0:
                 await match_faces_in_frames(
-                    video_id, faces_to_match, min_frameno, max_frameno, db
+                    video_id, faces_to_match, min_frameno, max_frameno, db, add_faces
                 )
-                faces_to_match = {}
-                min_frameno = None
-                max_frameno = None
-
-        if len(faces_to_match) > 0:
-            await match_faces_in_frames(
-                video_id, faces_to_match, min_frameno, max_frameno, db
-            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+"""CLI to create the database schema, or apply any pending schema migrations."""
+
+import asyncio
+import logging
+import os
+
+from rich.logging import RichHandler
+
+from mime_db import MimeDb
+
+
+async def main() -> None:
+    """Command-line entry-point."""
+
+    logging.basicConfig(
+        level=(os.getenv("LOG_LEVEL") or "INFO").upper(),
+        format="%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[RichHandler(rich_tracebacks=True)],
+    )
+
+    await MimeDb.prepare_schema(migrate=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,6 +7,10 @@ import asyncpg
 from dotenv import load_dotenv
 from pgvector.asyncpg import register_vector
 
+from mime_db._compact import register_halfvec
+from mime_db._initialization import check_schema_version, migrate_schema
+from mime_db._instrumentation import DB_INSTRUMENTATION, SlowQueryLogger, instrument
+
 logging.getLogger("dotenv.main").setLevel(logging.FATAL)
 load_dotenv()
 
@@ -24,9 +28,11 @@ except AssertionError:
     ) from None
 
 
+@instrument
 class MimeDb:
     """Class to interact with the database."""
 
+    from mime_db._compact import compact_vectors
     from mime_db._data_loading import (
         add_frame_movement,
         add_pose_faces,
@@ -46,9 +52,15 @@ class MimeDb:
         load_4dh_predictions,
         load_lart_predictions,
         load_openpifpaf_predictions,
+        replacing_faces,
+    )
+    from mime_db._indexes import ensure_vector_indexes, search_connection
+    from mime_db._initialization import remove_video
+    from mime_db._pose_search import (
+        get_nearest_poses_batch,
+        search_poses,
+        search_poses_batch,
     )
-    from mime_db._initialization import initialize_db, remove_video
-    from mime_db._pose_search import search_poses
     from mime_db._read_only import (
         get_available_videos,
         get_clustered_face_data_from_video,
@@ -65,6 +77,7 @@ class MimeDb:
         get_pose_by_frame_and_track,
         get_pose_data_by_frame,
         get_pose_data_from_video,
+        get_pose_search_data,
         get_poses_with_faces,
         get_track_frames,
         get_video_by_id,
@@ -74,52 +87,91 @@ class MimeDb:
         get_video_shots,
         search_by_pose,
     )
+    from mime_db._summaries import refresh_all_video_summaries, refresh_video_summary
 
     _pool: asyncpg.Pool
+    # Whether pgvector has iterative index scans (checked on the first search)
+    _iterative_scans: bool | None
 
     def __init__(self, pool: asyncpg.Pool) -> None:
         self._pool = pool
+        self._iterative_scans = None
+
+    def pool_stats(self) -> dict:
+        """Connection pool size, idle connections, and tasks waiting for one"""
+        return {
+            "size": self._pool.get_size(),
+            "max_size": self._pool.get_max_size(),
+            "idle": self._pool.get_idle_size(),
+            # asyncpg has no public API for this; its pool hands out connections
+            # from an asyncio.Queue
+            "waiters": len(getattr(self._pool._queue, "_getters", ())),
+        }
 
     @classmethod
-    async def create(cls, drop=False) -> "MimeDb":
+    async def create(cls, drop=False, migrate=False) -> "MimeDb":
         """Factory method to create a new MimeDb instance.
         Used because __init__ doesn't work well with async/await.
+        Only checks that the schema is up to date, unless asked to (re)build it.
         """
+        await MimeDb.prepare_schema(drop=drop, migrate=migrate or drop)
         pool = await MimeDb.get_pool()
-
-        async with pool.acquire() as conn:
-            await MimeDb.initialize_db(conn, drop)
-
         return cls(pool)
 
+    @staticmethod
+    async def prepare_schema(drop=False, migrate=False) -> None:
+        """Apply any pending schema migrations, or check that there are none"""
+        # Not a pooled connection, as its codecs need the extensions migrations add
+        conn = await MimeDb.connect()
+        try:
+            if migrate:
+                await migrate_schema(conn, drop)
+            await check_schema_version(conn)
+        finally:
+            await conn.close()
+
     @staticmethod
     async def get_pool() -> asyncpg.Pool:
+        slow_queries = SlowQueryLogger() if DB_INSTRUMENTATION else None
+
+        async def init_connection(conn: asyncpg.Connection):
+            await MimeDb.setup_connection(conn)
+            if slow_queries:
+                await slow_queries.init_connection(conn)
+
         pool = await asyncpg.create_pool(
             user=DB_USER,
             password=DB_PASSWORD,
             database=DB_NAME,
             host=DB_HOST,
             port=DB_PORT,
-            setup=MimeDb.setup_connection,
+            # Run once per new connection (`setup` would run on every acquire)
+            init=init_connection,
         )
         if not pool:
             raise RuntimeError("Database connection could not be established")
+        if slow_queries:
+            slow_queries.pool = pool
         return pool
 
     @staticmethod
-    async def get_connection() -> asyncpg.Connection:
-        conn = await asyncpg.connect(
+    async def connect() -> asyncpg.Connection:
+        return await asyncpg.connect(
             user=DB_USER,
             password=DB_PASSWORD,
             database=DB_NAME,
             host=DB_HOST,
             port=DB_PORT,
         )
+
+    @staticmethod
+    async def get_connection() -> asyncpg.Connection:
+        conn = await MimeDb.connect()
         await MimeDb.setup_connection(conn)
         return conn
 
     @staticmethod
     async def setup_connection(conn: asyncpg.Connection):
-        await conn.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";')
-        await conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        """Register the codecs for pgvector types (the schema must be up to date)"""
         await register_vector(conn)
+        await register_halfvec(conn)
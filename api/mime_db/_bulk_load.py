@@ -0,0 +1,212 @@
+"""Bulk loading and updating of rows with COPY.
+
+Rows are sent with asyncpg's binary COPY (vector columns in pgvector's binary
+format), in chunks of BULK_LOAD_CHUNK_SIZE rows. The rows can be given as a lazy
+iterable (e.g., a generator computing them from the input data), in which case the
+next chunk is computed in a worker thread while the current one is being copied.
+Bulk updates are copied into a temporary staging table, then applied with a single
+UPDATE ... FROM per video.
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Iterable, Sequence
+from uuid import UUID
+
+import asyncpg
+
+from mime_db._indexes import create_partition_vector_indexes
+from mime_db._partitions import detach_partition, partition_name
+
+BULK_LOAD_CHUNK_SIZE = int(os.getenv("BULK_LOAD_CHUNK_SIZE") or 10000)
+
+
+async def copy_rows(
+    conn: asyncpg.Connection,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[tuple],
+    chunk_size: int = BULK_LOAD_CHUNK_SIZE,
+) -> int:
+    """
+    Copy rows (tuples of values for `columns`) into a table, in one transaction;
+    returns the number of rows copied.
+    """
+    rows = iter(rows)
+
+    def next_chunk():
+        return list(itertools.islice(rows, chunk_size))
+
+    copied = 0
+    async with conn.transaction():
+        chunk = await asyncio.to_thread(next_chunk)
+        while chunk:
+            following = asyncio.ensure_future(asyncio.to_thread(next_chunk))
+            try:
+                await conn.copy_records_to_table(table, columns=columns, records=chunk)
+            except BaseException:
+                # Let the worker thread finish with the generator before it's discarded
+                await asyncio.wait([following])
+                raise
+            copied += len(chunk)
+            chunk = await following
+    return copied
+
+
+@asynccontextmanager
+async def replacing_partition(
+    conn: asyncpg.Connection, table: str, video_id: UUID, keep: str | None = None
+):
+    """
+    Replace all of a video's rows in a (partitioned) table, but for any matching the
+    SQL condition `keep`, which are carried over: yields the name of a new table
+    without any indexes, to copy the rows into (e.g., with copy_rows(), in as many
+    batches as need be). When the context exits, the table's indexes are built over
+    all of the rows at once (HNSW ones included), instead of being updated row by
+    row. Then, in one transaction, the video's old partition is detached and the new
+    table attached in its place, so queries see either all of the old rows or all
+    of the new ones, and only then is the old one dropped. (The plain DETACH
+    PARTITION briefly blocks queries on the whole table, but only for the renames
+    and the ATTACH, as the indexes are already built.) Not to be run in a
+    transaction.
+    """
+    partition = partition_name(table, video_id)
+    loading = f"{partition}_loading"
+    replaced = f"{partition}_replaced"
+
+    await conn.execute(
+        f"""
+        DROP TABLE IF EXISTS {loading}, {replaced};
+        CREATE TABLE {loading} (
+            LIKE {table} INCLUDING DEFAULTS,
+            -- Spares ATTACH PARTITION from scanning the rows to check they belong
+            CHECK (video_id = '{video_id}')
+        )
+        ;
+        """
+    )
+    try:
+        if keep is not None:
+            await conn.execute(
+                f"""
+                INSERT INTO {loading}
+                    SELECT * FROM {table} WHERE video_id = '{video_id}' AND ({keep})
+                ;
+                """
+            )
+
+        yield loading
+
+        logging.info(f"Indexing the rows to replace {partition} with...")
+        primary_key = await conn.fetchval(
+            """
+            SELECT pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = to_regclass($1) AND contype = 'p'
+            ;
+            """,
+            table,
+        )
+        if primary_key is not None:
+            await conn.execute(f"ALTER TABLE {loading} ADD {primary_key};")
+        await create_partition_vector_indexes(conn, table, loading)
+    except BaseException:
+        await conn.execute(f"DROP TABLE IF EXISTS {loading};")
+        raise
+
+    detach_pending = await conn.fetchval(
+        "SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass($1);",
+        partition,
+    )
+    if detach_pending:
+        # An interrupted detach can only be finished outside of a transaction
+        await detach_partition(conn, table, video_id)
+    try:
+        async with conn.transaction():
+            attached = await conn.fetchval(
+                "SELECT count(*) > 0 FROM pg_inherits WHERE inhrelid = to_regclass($1);",
+                partition,
+            )
+            if attached:
+                await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {partition};")
+            await conn.execute(
+                f"""
+                ALTER TABLE IF EXISTS {partition} RENAME TO {replaced};
+                ALTER TABLE {loading} RENAME TO {partition};
+                ALTER TABLE {table}
+                    ATTACH PARTITION {partition} FOR VALUES IN ('{video_id}');
+                """
+            )
+    except BaseException:
+        # The old partition (if any) is still attached, as it was
+        await conn.execute(f"DROP TABLE IF EXISTS {loading};")
+        raise
+
+    await conn.execute(f"DROP TABLE IF EXISTS {replaced};")
+
+
+async def replace_partition(
+    conn: asyncpg.Connection,
+    table: str,
+    video_id: UUID,
+    columns: Sequence[str],
+    rows: Iterable[tuple],
+) -> int:
+    """
+    Replace all of a video's rows in a (partitioned) table with `rows` (c.f.
+    replacing_partition()); returns the number of rows copied
+    """
+    async with replacing_partition(conn, table, video_id) as loading:
+        return await copy_rows(conn, loading, columns, rows)
+
+
+async def update_rows(
+    conn: asyncpg.Connection,
+    table: str,
+    columns: Sequence[str],
+    rows: Iterable[tuple],
+    keys: Sequence[str],
+) -> int:
+    """
+    Update a table's rows from tuples of values for `columns`: rows are matched on
+    the `keys` columns (which must include video_id, and should identify each tuple
+    uniquely), and the other columns are set to the tuples' values. Returns the
+    number of rows updated.
+    """
+    assert "video_id" in keys, "Updates are applied one video (partition) at a time"
+    staging = f"{table}_updates"
+    column_list = ", ".join(columns)
+    updated = [column for column in columns if column not in keys]
+    assignments = ", ".join(f"{column} = staging.{column}" for column in updated)
+    matches = " AND ".join(f"{table}.{key} = staging.{key}" for key in keys)
+
+    count = 0
+    async with conn.transaction():
+        # Same column types (e.g., vector or halfvec) as the table
+        await conn.execute(
+            f"""
+            CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS
+                SELECT {column_list} FROM {table} WITH NO DATA
+            ;
+            """
+        )
+        await copy_rows(conn, staging, columns, rows)
+        await conn.execute(f"ANALYZE {staging};")
+
+        # Scoping each UPDATE to one video lets the planner prune the other partitions
+        video_ids = await conn.fetch(f"SELECT DISTINCT video_id FROM {staging};")
+        for row in video_ids:
+            status = await conn.execute(
+                f"""
+                UPDATE {table} SET {assignments}
+                FROM {staging} AS staging
+                WHERE {table}.video_id = $1 AND staging.video_id = $1 AND {matches}
+                ;
+                """,
+                row["video_id"],
+            )
+            count += int(status.split()[-1])
+    return count
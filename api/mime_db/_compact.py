@@ -0,0 +1,91 @@
+"""Optional compact (half-precision) storage of the large face and action vectors.
+
+Face embeddings (512 floats per face) and action vectors (60 per pose) dominate the
+size of their tables and of the indexes on them. Converting their columns to
+pgvector's halfvec type halves both; the values are decoded back into float32 numpy
+arrays, just as vector columns are, so code that reads and writes these columns
+works the same either way.
+"""
+
+import logging
+import struct
+
+import asyncpg
+import numpy as np
+
+from mime_db._indexes import VECTOR_INDEXES, create_vector_index, get_column_type
+
+# (table, column): dimensions
+COMPACTABLE_COLUMNS = {
+    ("face", "embedding"): 512,
+    ("pose", "ava_action"): 60,
+}
+
+
+def encode_halfvec(value) -> bytes:
+    array = np.asarray(value, dtype=">f2")
+    return struct.pack(">HH", len(array), 0) + array.tobytes()
+
+
+def decode_halfvec(data: bytes) -> np.ndarray:
+    (dim, _) = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=">f2", count=dim, offset=4).astype(np.float32)
+
+
+async def register_halfvec(conn: asyncpg.Connection) -> None:
+    """Decode halfvec values to float32 arrays (pgvector's codec returns objects)"""
+    try:
+        await conn.set_type_codec(
+            "halfvec",
+            encoder=encode_halfvec,
+            decoder=decode_halfvec,
+            format="binary",
+        )
+    except ValueError as e:
+        # pgvector < 0.7 has no halfvec type
+        if not str(e).startswith("unknown type:"):
+            raise
+
+
+async def compact_vectors(self, compact=True) -> None:
+    """
+    Convert the face embedding and action vector columns to halfvec (or back to
+    vector, with compact=False), rebuilding their approximate indexes.
+    """
+    vector_type = "halfvec" if compact else "vector"
+
+    async with self._pool.acquire() as conn:
+        for (table, column), dimensions in COMPACTABLE_COLUMNS.items():
+            column_type = await get_column_type(conn, table, column)
+            if column_type is None or column_type.startswith(f"{vector_type}("):
+                continue
+
+            # Indexes on the column have operator classes for its current type
+            column_indexes = await conn.fetch(
+                """
+                SELECT DISTINCT i.indexrelid::regclass::text AS name
+                FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid
+                    AND a.attnum = ANY(i.indkey)
+                WHERE i.indrelid = to_regclass($1) AND a.attname = $2
+                ;
+                """,
+                table,
+                column,
+            )
+            logging.info(f"Converting {table}.{column} to {vector_type}...")
+            async with conn.transaction():
+                for index in column_indexes:
+                    await conn.execute(f"DROP INDEX IF EXISTS {index['name']};")
+                await conn.execute(
+                    f"""
+                    ALTER TABLE {table}
+                    ALTER COLUMN {column} TYPE {vector_type}({dimensions})
+                    USING {column}::{vector_type}({dimensions})
+                    ;
+                    """
+                )
+
+            for index in VECTOR_INDEXES:
+                if (index.table, index.column) == (table, column):
+                    await create_vector_index(conn, index)
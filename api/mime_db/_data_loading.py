@@ -1,42 +1,55 @@
-import copy
 import json
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Callable
 from uuid import UUID
 
-import joblib
 import numpy as np
 
 from lib import pose_utils
+from lib.phalp_columns import lart_columns, phalp_columns
+from mime_db._bulk_load import (
+    BULK_LOAD_CHUNK_SIZE,
+    copy_rows,
+    replace_partition,
+    replacing_partition,
+    update_rows,
+)
+from mime_db._indexes import VectorIndex, create_vector_index, get_column_type
+from mime_db._partitions import create_partitions, truncate_partition
 
 CONF_THRESH_4DH = 0.85  # This is .8 in the PHALP software
 
 
 async def add_video(self, video_name: str, video_metadata: dict) -> UUID:
-    video_id = await self._pool.fetchval(
-        """
-        INSERT
-            INTO video (video_name, frame_count, fps, width, height)
-            VALUES($1, $2, $3, $4, $5)
-            ON CONFLICT (video_name) DO UPDATE
-            SET frame_count = $2, fps = $3, width = $4, height = $5
-            RETURNING id
-        ;
-        """,
-        video_name,
-        *video_metadata.values(),
-    )
-    logging.debug(f"'{video_name}' has ID {video_id}")
+    async with self._pool.acquire() as conn, conn.transaction():
+        video_id = await conn.fetchval(
+            """
+            INSERT
+                INTO video (video_name, frame_count, fps, width, height)
+                VALUES($1, $2, $3, $4, $5)
+                ON CONFLICT (video_name) DO UPDATE
+                SET frame_count = $2, fps = $3, width = $4, height = $5
+                RETURNING id
+            ;
+            """,
+            video_name,
+            *video_metadata.values(),
+        )
+        logging.debug(f"'{video_name}' has ID {video_id}")
 
-    if not isinstance(video_id, UUID):
-        raise ValueError(f"Unable to add video '{video_name}'")
+        if not isinstance(video_id, UUID):
+            raise ValueError(f"Unable to add video '{video_name}'")
+
+        await create_partitions(conn, video_id)
 
     return video_id
 
 
 async def clear_poses(self, video_id: UUID) -> None:
-    await self._pool.execute("DELETE FROM pose WHERE video_id = $1;", video_id)
+    async with self._pool.acquire() as conn:
+        await truncate_partition(conn, "pose", video_id)
 
 
 async def clear_actions(self, video_id: UUID) -> None:
@@ -46,6 +59,45 @@ async def clear_actions(self, video_id: UUID) -> None:
     )
 
 
+POSE_COLUMNS_OPENPIFPAF = (
+    "video_id",
+    "frame",
+    "pose_idx",
+    "keypoints",
+    "keypointsopp",
+    "bbox",
+    "score",
+    "category",
+)
+
+POSE_COLUMNS_4DH = (
+    "video_id",
+    "frame",
+    "pose_idx",
+    "keypoints",
+    "keypointsopp",
+    "keypoints4dh",
+    "keypoints3d",
+    "global3d_phalp",
+    "global3d_coco13",
+    "norm",
+    "bbox",
+    "camera",
+    "score",
+    "category",
+    "track_id",
+)
+
+
+async def load_poses(pool, video_id: UUID, columns, rows, clear: bool) -> int:
+    """Bulk load a video's poses, replacing its existing poses if clear=True"""
+    async with pool.acquire() as conn:
+        if clear:
+            logging.debug(f"Replacing poses for video {video_id}")
+            return await replace_partition(conn, "pose", video_id, columns, rows)
+        return await copy_rows(conn, "pose", columns, rows)
+
+
 async def load_openpifpaf_predictions(
     self, video_id: UUID, json_path: Path, clear=True
 ) -> None:
@@ -54,167 +106,115 @@ async def load_openpifpaf_predictions(
         for line in _fh:
             frames.append(json.loads(line))
 
-    if clear:
-        logging.debug(f"Clearing poses for video {video_id}")
-        await self.clear_poses(video_id)
-
     logging.info(f"Loading data for {len(frames)} frames from '{json_path}'...")
 
-    poses = []
-    for frame in frames:
-        assert frame.keys() == {"frame", "predictions"}
+    def pose_rows():
+        for frame in frames:
+            assert frame.keys() == {"frame", "predictions"}
 
-        if len(frame["predictions"]) == 0:
-            continue
+            if len(frame["predictions"]) == 0:
+                continue
 
-        for pose_id, pose in enumerate(frame["predictions"]):
-            joints = np.array(pose["keypoints"])
-            coco13_joints = pose_utils.merge_coords(
-                joints, pose_utils.openpifpaf_to_coco_13, has_confidence=True
-            ).flatten()
-
-            poses.append(
-                {
-                    "video_id": video_id,
-                    "frame": frame["frame"],
-                    "pose_id": pose_id,
-                    "keypoints": coco13_joints,
-                    "keypointsopp": joints,
-                    "bbox": np.array(pose["bbox"]),
-                    "score": pose["score"],
-                    "category": pose["category_id"],
-                }
-            )
+            for pose_id, pose in enumerate(frame["predictions"]):
+                joints = np.array(pose["keypoints"])
+                coco13_joints = pose_utils.merge_coords(
+                    joints, pose_utils.openpifpaf_to_coco_13, has_confidence=True
+                ).flatten()
 
-    data = [tuple(pose.values()) for pose in poses]
+                yield (
+                    video_id,
+                    frame["frame"],
+                    pose_id,
+                    coco13_joints,
+                    joints,
+                    np.array(pose["bbox"]),
+                    pose["score"],
+                    pose["category_id"],
+                )
 
-    await self._pool.executemany(
-        """
-        INSERT INTO pose (
-            video_id, frame, pose_idx, keypoints, keypointsopp, bbox, score, category)
-            VALUES($1, $2, $3, $4, $5, $6, $7, $8)
-        ;
-        """,
-        data,
+    loaded = await load_poses(
+        self._pool, video_id, POSE_COLUMNS_OPENPIFPAF, pose_rows(), clear
     )
 
-    logging.info(f"Loaded {len(poses)} predictions!")
+    logging.info(f"Loaded {loaded} predictions!")
 
 
-async def load_4dh_predictions(self, video_id: UUID, pkl_path: Path, clear=True) -> None:
-    frames = {}
-
-    if clear:
-        logging.debug(f"Clearing poses for video {video_id}")
-        await self.clear_poses(video_id)
-
-    logging.info(f"Importing data from '{pkl_path}'...")
-
-    frames = joblib.load(pkl_path)
-
-    logging.info(f"Loading data for {len(frames)} frames from '{pkl_path}'...")
-
-    poses = []
-    for _, frame in frames.items():
-        if len(frame["2d_joints"]) == 0:
+def phalp_pose_rows(video_id: UUID, columns, chunk_size=BULK_LOAD_CHUNK_SIZE):
+    """
+    Complete pose rows (with all of the derived keypoint columns) for the PHALP poses
+    in a columnar sidecar (see lib.phalp_columns), computed a chunk at a time
+    """
+    for chunk in columns.chunks(chunk_size):
+        confident = ~(chunk["conf"] < CONF_THRESH_4DH)
+        chunk = {name: values[confident] for name, values in chunk.items()}
+        count = len(chunk["frame"])
+        if count == 0:
             continue
 
-        # We only want the pose data about the tracked poses in each frame; the raw
-        # output also contains data about previously tracked poses ("ghosts") that we
-        # really don't want to include. The 2d and 3d joints data  includes these
-        # "ghosts", so need to filter those entries out. This can be done by only using
-        # the indices of the "tracked_ids" in the larger "tid" list to get the joints
-        # and conf data.
+        keypoints = pose_utils.phalp_keypoints_batch(
+            chunk["joints_2d"], chunk["size"], chunk["joints_3d"], chunk["global_orient"]
+        )
+        # Normalized from the single-precision keypoints stored in the db
+        norms = pose_utils.normalize_poses_batch(
+            keypoints["keypoints"].astype(np.float32).reshape(count, -1, 3)
+        )
+        norms = np.nan_to_num(norms, nan=-1)
 
-        for tracked_id in frame["tracked_ids"]:
-            if tracked_id in frame["tid"]:
-                pose_idx = frame["tid"].index(tracked_id)
-            else:
-                logging.info(
-                    f"Frame {frame['time']+1}: couldn't find tracked ID {tracked_id} in list of full IDs {frame['tid']}"
-                )
-                continue
+        for j in range(count):
+            yield (
+                video_id,
+                int(chunk["frame"][j]),
+                int(chunk["pose_idx"][j]),
+                keypoints["keypoints"][j],
+                keypoints["keypointsopp"][j],
+                keypoints["keypoints4dh"][j],
+                keypoints["keypoints3d"][j],
+                keypoints["global3d_phalp"][j],
+                keypoints["global3d_coco13"][j],
+                norms[j],
+                chunk["bbox"][j],
+                chunk["camera"][j],
+                float(chunk["conf"][j]),
+                int(chunk["class_name"][j]),
+                int(chunk["track_id"][j]),
+            )
 
-            if frame["conf"][pose_idx] < CONF_THRESH_4DH:
-                continue
 
-            img_height, img_width = frame["size"][pose_idx]
-            img_size = max(img_width, img_height)
-            pose = frame["2d_joints"][pose_idx]
-            joints_2d = copy.deepcopy(pose)
-            joints_2d = joints_2d.reshape(-1, 2)
-            joints_2d *= img_size
-            joints_2d[:, 1] -= (
-                max(img_width, img_height) - min(img_width, img_height)
-            ) / 2
-
-            coco17_joints = pose_utils.merge_coords(
-                joints_2d, pose_utils.phalp_to_coco_17
-            ).flatten()
-
-            coco13_joints = pose_utils.merge_coords(
-                joints_2d, pose_utils.phalp_to_coco_13
-            ).flatten()
-
-            keypoints3d = pose_utils.merge_coords(
-                frame["3d_joints"][pose_idx], pose_utils.phalp_to_coco_13, is_3d=True
-            ).flatten()
-
-            all_phalp_keypoints = np.array(
-                [[coord[0], coord[1], 1.0] for coord in joints_2d]
-            ).flatten()
-
-            # De-rotate/ormalize 3D keypoints by multiplying them by the
-            # "global orientation" rotation matrix
-            global3d_phalp = np.matmul(
-                frame["3d_joints"][pose_idx], frame["smpl"][pose_idx]["global_orient"]
-            ).flatten()
-
-            poses.append(
-                {
-                    "video_id": video_id,
-                    "frame": frame["time"] + 1,
-                    "pose_idx": pose_idx,
-                    "keypoints": coco13_joints,
-                    "keypointsopp": coco17_joints,
-                    "keypoints4dh": all_phalp_keypoints,
-                    "keypoints3d": keypoints3d,
-                    "global3d_phalp": global3d_phalp,
-                    "bbox": np.array(frame["bbox"][pose_idx]),
-                    "camera": np.array(frame["camera"][pose_idx]),
-                    "score": frame["conf"][pose_idx],
-                    "category": frame["class_name"][pose_idx],
-                    "track_id": tracked_id,
-                }
-            )
+async def load_4dh_predictions(self, video_id: UUID, pkl_path: Path, clear=True) -> None:
+    """
+    Load the tracked poses from PHALP output, computing all of their keypoint columns
+    (including the normalized and 3D COCO 13 ones) before they are written
+    """
+    logging.info(f"Importing data from '{pkl_path}'...")
 
-    data = [tuple(pose.values()) for pose in poses]
+    columns = phalp_columns(pkl_path)
 
-    await self._pool.executemany(
-        """
-        INSERT INTO pose (
-            video_id, frame, pose_idx, keypoints, keypointsopp, keypoints4dh, keypoints3d, global3d_phalp, bbox, camera, score, category, track_id)
-            VALUES($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
-        ;
-        """,
-        data,
+    logging.info(f"Loading data for {len(columns.frames)} frames from '{pkl_path}'...")
+
+    loaded = await load_poses(
+        self._pool, video_id, POSE_COLUMNS_4DH, phalp_pose_rows(video_id, columns), clear
     )
 
-    logging.info(f"Loaded {len(poses)} predictions!")
+    logging.info(f"Loaded {loaded} predictions!")
 
 
 async def add_shot_boundaries(self, video_id: UUID | None, frames_data) -> None:
     data = [(video_id,) + tuple(frame) for frame in frames_data]
 
-    await self._pool.executemany(
-        """
-        INSERT INTO frame (
-            video_id, frame, local_shot_prob, global_shot_prob, is_shot_boundary, shot)
-            VALUES($1, $2, $3, $4, $5, $6)
-        ;
-        """,
-        data,
-    )
+    async with self._pool.acquire() as conn:
+        await copy_rows(
+            conn,
+            "frame",
+            (
+                "video_id",
+                "frame",
+                "local_shot_prob",
+                "global_shot_prob",
+                "is_shot_boundary",
+                "shot",
+            ),
+            data,
+        )
 
 
 async def add_frame_movement(
@@ -225,61 +225,44 @@ async def add_frame_movement(
     max_movement_3d,
     movement_data_3d,
 ) -> None:
-    async with self._pool.acquire() as conn:
-        await conn.execute(
-            """
-            ALTER TABLE frame ADD COLUMN IF NOT EXISTS total_movement FLOAT DEFAULT 0.0
-            ;
-            """
-        )
-        await conn.execute(
-            """
-            ALTER TABLE frame ADD COLUMN IF NOT EXISTS total_movement3d FLOAT DEFAULT 0.0
-            ;
-            """
+    safe_max = max(1, max_movement)  # Just in case a 0 sneaks in...
+    safe_max_3d = max(1, max_movement_3d)
+
+    data = [
+        (
+            video_id,
+            frame,
+            movement_data[frame] / safe_max,
+            movement_data_3d[frame] / safe_max_3d,
         )
+        for frame in movement_data
+    ]
 
-        safe_max = max(1, max_movement)  # Just in case a 0 sneaks in...
-        safe_max_3d = max(1, max_movement_3d)
-
-        for frame in movement_data:
-            await conn.execute(
-                """
-                UPDATE frame
-                SET total_movement = $1, total_movement3d = $2
-                WHERE video_id = $3 AND frame = $4
-                ;
-                """,
-                movement_data[frame] / safe_max,
-                movement_data_3d[frame] / safe_max_3d,
-                video_id,
-                frame,
-            )
+    async with self._pool.acquire() as conn:
+        await update_rows(
+            conn,
+            "frame",
+            ("video_id", "frame", "total_movement", "total_movement3d"),
+            data,
+            keys=("video_id", "frame"),
+        )
 
 
 async def add_video_tracks(self, video_id: UUID | None, track_data) -> None:
+    data = [
+        (video_id, track["frame"], track["pose_idx"], track["track_id"])
+        for track in track_data
+    ]
+
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            """
-            ALTER TABLE pose ADD COLUMN IF NOT EXISTS track_id INTEGER DEFAULT NULL
-            ;
-            """
+        await update_rows(
+            conn,
+            "pose",
+            ("video_id", "frame", "pose_idx", "track_id"),
+            data,
+            keys=("video_id", "frame", "pose_idx"),
         )
 
-        for track in track_data:
-            await conn.execute(
-                """
-                UPDATE pose
-                SET track_id = $1
-                WHERE video_id = $2 AND frame = $3 AND pose_idx = $4
-                ;
-                """,
-                track["track_id"],
-                video_id,
-                track["frame"],
-                track["pose_idx"],
-            )
-
 
 async def load_lart_predictions(
     self, video_id: UUID, pkl_path: Path, clear=True, reindex=False
@@ -290,62 +273,75 @@ async def load_lart_predictions(
 
     logging.info(f"Importing data from '{pkl_path}'...")
 
-    frames = joblib.load(pkl_path)
-
-    logging.info(f"Loading data for {len(frames)} frames from '{pkl_path}'...")
-
-    action_updates = []
+    columns = lart_columns(pkl_path)
 
-    for _, frame in frames.items():
-        if len(frame["tracked_ids"]) == 0 or "ava_action" not in frame:
-            continue
-
-        for tracked_id in frame["tracked_ids"]:
-            action_updates.append(
-                {
-                    "video_id": video_id,
-                    "frame": frame["time"] + 1,
-                    "track_id": tracked_id,
-                    "ava_action": frame["ava_action"][tracked_id][0],
-                    "action_labels": frame["label"][tracked_id],
-                }
-            )
+    logging.info(f"Loading data for {len(columns.frames)} frames from '{pkl_path}'...")
 
-    data = [tuple(pose_action.values()) for pose_action in action_updates]
+    def action_rows():
+        for chunk in columns.chunks(BULK_LOAD_CHUNK_SIZE):
+            for frame, track_id, ava_action, labels in zip(
+                chunk["frame"],
+                chunk["track_id"],
+                chunk["ava_action"],
+                chunk["labels"],
+                strict=True,
+            ):
+                labels = json.loads(labels)
+                yield (video_id, int(frame), int(track_id), ava_action, labels)
 
-    await self._pool.executemany(
-        """
-        UPDATE pose SET ava_action = $4, action_labels = $5 WHERE video_id = $1 AND frame = $2 AND track_id = $3
-        ;
-        """,
-        data,
-    )
+    async with self._pool.acquire() as conn:
+        await update_rows(
+            conn,
+            "pose",
+            ("video_id", "frame", "track_id", "ava_action", "action_labels"),
+            action_rows(),
+            keys=("video_id", "frame", "track_id"),
+        )
 
-    logging.info(f"Loaded {len(data)} action predictions!")
+    logging.info(f"Loaded {len(columns)} action predictions!")
 
     if reindex:
-        logging.info("Building action search index")
-        await self._pool.execute(
-            """
-            CREATE INDEX ON pose
-            USING ivfflat (ava_action vector_cosine_ops)
-            ;
-            """,
-        )
+        await self.ensure_vector_indexes("pose", ["ava_action"])
+
+
+FACE_COLUMNS = (
+    "video_id",
+    "frame",
+    "pose_idx",
+    "bbox",
+    "confidence",
+    "landmarks",
+    "embedding",
+    "track_id",
+)
+
+MOVELET_COLUMNS = (
+    "video_id",
+    "track_id",
+    "tick",
+    "start_frame",
+    "end_frame",
+    "pose_idx",
+    "prev_norm",
+    "norm",
+    "motion",
+    "movement",
+    "movement3d",
+    "poem_embedding",
+)
+
+
+def video_face_rows(video_id: UUID | None, faces_data):
+    # Faces that haven't been matched to poses: (frame, bbox, confidence, landmarks,
+    # embedding)
+    return ((video_id, face[0], None, *face[1:], None) for face in faces_data)
 
 
 async def add_video_faces(self, video_id: UUID | None, faces_data) -> None:
-    data = [(video_id,) + tuple(face) for face in faces_data]
-
-    await self._pool.executemany(
-        """
-        INSERT INTO face (
-            video_id, frame, bbox, confidence, landmarks, embedding)
-            VALUES($1, $2, $3, $4, $5, $6)
-        ;
-        """,
-        data,
-    )
+    async with self._pool.acquire() as conn:
+        await copy_rows(
+            conn, "face", FACE_COLUMNS, video_face_rows(video_id, faces_data)
+        )
 
     logging.info(f"Loaded {len(faces_data)} faces!")
 
@@ -354,91 +350,65 @@ async def add_pose_faces(self, faces_data) -> None:
     data = [tuple(face) for face in faces_data]
 
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            """
-            ALTER TABLE face ADD COLUMN IF NOT EXISTS track_id INTEGER DEFAULT NULL
-            ;
-            """
-        )
-
-        await conn.executemany(
-            """
-            INSERT INTO face (
-                video_id, frame, pose_idx, bbox, confidence, landmarks, embedding, track_id)
-                VALUES($1, $2, $3, $4, $5, $6, $7, $8)
-            ;
-            """,
-            data,
-        )
+        await copy_rows(conn, "face", FACE_COLUMNS, data)
 
     logging.info(f"Loaded {len(faces_data)} matched faces!")
 
 
-async def add_video_movelets(self, movelets_data, reindex=False) -> None:
+@asynccontextmanager
+async def replacing_faces(self, video_id: UUID, matched: bool):
+    """
+    Replace a video's faces that are matched to its poses (or, if not `matched`, the
+    ones that aren't), keeping its others: yields a function that adds batches of
+    them, as add_pose_faces() (or add_video_faces()) takes them. The faces are only
+    indexed and swapped in once the context exits (c.f. replacing_partition()), so
+    the HNSW index on their embeddings is built once, not updated face by face.
+    """
+    keep = "pose_idx IS NULL" if matched else "pose_idx IS NOT NULL"
+    async with (
+        self._pool.acquire() as conn,
+        replacing_partition(conn, "face", video_id, keep) as loading,
+    ):
+
+        async def add_faces(faces_data) -> None:
+            if matched:
+                rows = [tuple(face) for face in faces_data]
+            else:
+                rows = video_face_rows(video_id, faces_data)
+            await copy_rows(conn, loading, FACE_COLUMNS, rows)
+            logging.info(f"Loaded {len(faces_data)} faces to replace the video's with")
+
+        yield add_faces
+
+
+async def add_video_movelets(self, video_id: UUID, movelets_data, reindex=False) -> None:
+    """
+    Replace the video's movelets (building the partition's indexes after loading
+    them, c.f. replace_partition())
+    """
     data = [tuple(movelet) for movelet in movelets_data]
-    await self._pool.executemany(
-        """
-        INSERT INTO movelet (
-            video_id,
-            track_id,
-            tick,
-            start_frame,
-            end_frame,
-            pose_idx,
-            prev_norm,
-            norm,
-            motion,
-            movement,
-            movement3d,
-            poem_embedding )
-            VALUES($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
-        ;
-        """,
-        data,
-    )
+
+    async with self._pool.acquire() as conn:
+        await replace_partition(conn, "movelet", video_id, MOVELET_COLUMNS, data)
 
     logging.info(f"Loaded {len(movelets_data)} movelets!")
 
     if reindex:
-        logging.info("Creating approximate distance index for movelets...")
-        async with self._pool.acquire() as conn:
-            await conn.execute(
-                """
-                CREATE INDEX ON movelet
-                USING ivfflat (motion vector_cosine_ops)
-                ;
-                """,
-            )
+        await self.ensure_vector_indexes("movelet", ["motion"])
 
 
 async def assign_poem_embeddings(self, poem_data, reindex=False) -> None:
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            "ALTER TABLE pose ADD COLUMN IF NOT EXISTS poem_embedding vector(16) DEFAULT NULL;"
-        )
-        await conn.executemany(
-            """
-                UPDATE pose
-                SET poem_embedding = $4
-                WHERE video_id = $1 AND frame = $2 AND pose_idx = $3
-                ;
-            """,
+        await update_rows(
+            conn,
+            "pose",
+            ("video_id", "frame", "pose_idx", "poem_embedding"),
             poem_data,
+            keys=("video_id", "frame", "pose_idx"),
         )
 
-        if reindex:
-            logging.info(
-                "Creating approximate index for cosine distance of viewpoint-invariant pose embeddings..."
-            )
-            await conn.execute(
-                """
-                CREATE INDEX ON pose
-                USING ivfflat (poem_embedding vector_cosine_ops)
-                ;
-                """,
-            )
-
-        return
+    if reindex:
+        await self.ensure_vector_indexes("pose", ["poem_embedding"])
 
 
 async def assign_pose_interest(self, pose_interest, metric="pose") -> None:
@@ -446,132 +416,92 @@ async def assign_pose_interest(self, pose_interest, metric="pose") -> None:
     if metric == "action":
         colname = "action_interest"
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            f"ALTER TABLE pose ADD COLUMN IF NOT EXISTS {colname} FLOAT DEFAULT 0.0;"
-        )
-        await conn.executemany(
-            f"""
-                UPDATE pose
-                SET {colname} = $4
-                WHERE video_id = $1 AND frame = $2 AND pose_idx = $3
-                ;
-            """,
+        await update_rows(
+            conn,
+            "pose",
+            ("video_id", "frame", "pose_idx", colname),
             pose_interest,
+            keys=("video_id", "frame", "pose_idx"),
         )
 
-        return
-
 
 async def assign_frame_interest(self, frame_interest, metric="pose") -> None:
     colname = "pose_interest"
     if metric == "action":
         colname = "action_interest"
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            f"ALTER TABLE frame ADD COLUMN IF NOT EXISTS {colname} FLOAT DEFAULT 0.0;"
-        )
-        await conn.executemany(
-            f"""
-                UPDATE frame
-                SET {colname} = $3
-                WHERE video_id = $1 AND frame = $2
-                ;
-            """,
+        await update_rows(
+            conn,
+            "frame",
+            ("video_id", "frame", colname),
             frame_interest,
+            keys=("video_id", "frame"),
         )
 
-        return
-
 
 async def assign_face_clusters_by_track(self, face_clusters) -> None:
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            "ALTER TABLE face ADD COLUMN IF NOT EXISTS cluster_id INTEGER DEFAULT NULL;"
-        )
-        await conn.executemany(
-            """
-                UPDATE face
-                SET cluster_id = $2
-                WHERE video_id = $1 AND track_id = $3
-                ;
-            """,
+        await update_rows(
+            conn,
+            "face",
+            ("video_id", "cluster_id", "track_id"),
             face_clusters,
+            keys=("video_id", "track_id"),
         )
 
-        return
-
 
 async def assign_movelet_clusters(self, movelet_clusters) -> None:
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            """
-            ALTER TABLE movelet
-                ADD COLUMN IF NOT EXISTS cluster_id INTEGER DEFAULT NULL;
-            """
-        )
-
-        await conn.executemany(
-            """
-            UPDATE movelet
-            SET cluster_id = $5
-            WHERE video_id = $1 AND
-                  pose_idx = $4 AND
-                  start_frame = $2 AND
-                  end_frame = $3;
-            """,
+        await update_rows(
+            conn,
+            "movelet",
+            ("video_id", "start_frame", "end_frame", "pose_idx", "cluster_id"),
             movelet_clusters,
+            keys=("video_id", "start_frame", "end_frame", "pose_idx"),
         )
 
-        return
-
 
 async def annotate_pose(
     self,
     column: str,
-    col_type: str,
     video_id: UUID | None,
     annotation_func: Callable,
     reindex=False,
     pose_tbl="pose",
+    batch=False,
 ) -> None:
+    """
+    Set a column of a video's poses to annotation_func(pose) for each pose, or, with
+    batch=True, to the values annotation_func(poses) returns for all of them at once.
+    The column has to be in the schema already (i.e., added by a migration).
+    """
     async with self._pool.acquire() as conn:
-        await conn.execute(
-            f"ALTER TABLE {pose_tbl} ADD COLUMN IF NOT EXISTS {column} {col_type};"
-        )
+        if await get_column_type(conn, pose_tbl, column) is None:
+            raise ValueError(f"There is no column {pose_tbl}.{column} to annotate")
 
         poses = await conn.fetch(
             f"SELECT * FROM {pose_tbl} WHERE video_id = $1;", video_id
         )
-        async with conn.transaction():
-            for i, pose in enumerate(poses):
-                if i % (len(poses) // 10) == 0:
-                    logging.info(
-                        f"Annotating pose {i:7}/{len(poses)} "
-                        f"({10 * (i // (len(poses) // 10)):3}%)..."
-                    )
-                annotation_value = annotation_func(pose)
-                await conn.execute(
-                    f"""
-                    UPDATE {pose_tbl}
-                    SET {column} = $1
-                    WHERE video_id = $2 AND frame = $3 AND pose_idx = $4
-                    ;
-                    """,
-                    annotation_value,
-                    video_id,
-                    pose["frame"],
-                    pose["pose_idx"],
-                )
+        logging.info(f"Annotating {len(poses)} poses...")
+        if batch:
+            values = annotation_func(poses) if poses else []
+        else:
+            values = [annotation_func(pose) for pose in poses]
+        data = [
+            (video_id, pose["frame"], pose["pose_idx"], value)
+            for pose, value in zip(poses, values, strict=True)
+        ]
+        await update_rows(
+            conn,
+            pose_tbl,
+            ("video_id", "frame", "pose_idx", column),
+            data,
+            keys=("video_id", "frame", "pose_idx"),
+        )
 
-        if reindex:
-            logging.info("Creating approximate index for cosine distance...")
-            await conn.execute(
-                f"""
-                CREATE INDEX ON {pose_tbl}
-                USING ivfflat ({column} vector_cosine_ops)
-                ;
-                """,
-            )
+    if reindex:
+        async with self._pool.acquire() as conn:
+            await create_vector_index(conn, VectorIndex(pose_tbl, column, "cosine"))
     return
 
 
@@ -0,0 +1,199 @@
+"""Managed set of approximate-nearest-neighbor (HNSW) indexes on vector columns."""
+
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import NamedTuple
+
+import asyncpg
+
+from mime_db._instrumentation import apply_settings, current_settings
+from mime_db._pose_search import MAX_CANDIDATES
+
+
+class VectorIndex(NamedTuple):
+    table: str
+    column: str
+    metric: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.table}_{self.column}_{self.metric}_hnsw"
+
+    def opclass(self, column_type: str) -> str:
+        """Operator class for the index, given the column's (pgvector) type"""
+        vector_type = column_type.split("(")[0]
+        return f"{vector_type}_{VECTOR_OPCLASSES[self.metric]}_ops"
+
+
+# Distance metric -> pgvector operator class suffix (e.g., vector_cosine_ops,
+# halfvec_cosine_ops)
+VECTOR_OPCLASSES = {
+    "cosine": "cosine",
+    "euclidean": "l2",
+    "innerproduct": "ip",
+}
+
+# One index per (column, distance operator) that is searched on
+VECTOR_INDEXES = [
+    VectorIndex("pose", "norm", "cosine"),
+    VectorIndex("pose", "norm", "euclidean"),
+    VectorIndex("pose", "poem_embedding", "cosine"),
+    VectorIndex("pose", "global3d_coco13", "cosine"),
+    VectorIndex("pose", "ava_action", "cosine"),
+    VectorIndex("movelet", "motion", "cosine"),
+    VectorIndex("face", "embedding", "cosine"),
+]
+
+# HNSW build parameters (these are pgvector's defaults)
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+
+# Range of the HNSW ef_search used for searches (pgvector's default and maximum)
+HNSW_EF_SEARCH_MIN = 40
+HNSW_EF_SEARCH_MAX = 1000
+# Most index entries an iterative scan visits before giving up (pgvector's default)
+HNSW_MAX_SCAN_TUPLES = int(os.getenv("HNSW_MAX_SCAN_TUPLES") or 20000)
+
+
+async def ensure_vector_indexes(
+    self, table: str | None = None, columns: list[str] | None = None
+) -> None:
+    """
+    Create any of the managed HNSW indexes that don't already exist, optionally only
+    those for a given table and/or columns. Best run after bulk loads, as building
+    the index over existing rows is much faster than maintaining it row by row.
+    """
+    indexes = [
+        index
+        for index in VECTOR_INDEXES
+        if (table is None or index.table == table)
+        and (columns is None or index.column in columns)
+    ]
+
+    async with self._pool.acquire() as conn:
+        for index in indexes:
+            await create_vector_index(conn, index)
+
+
+async def get_column_type(
+    conn: asyncpg.Connection, table: str, column: str
+) -> str | None:
+    """The column's type, e.g. "vector(26)", or None if there's no such column"""
+    return await conn.fetchval(
+        """
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass($1) AND attname = $2 AND NOT attisdropped
+        ;
+        """,
+        table,
+        column,
+    )
+
+
+async def create_vector_index(conn: asyncpg.Connection, index: VectorIndex) -> None:
+    exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL;", index.name)
+    if exists:
+        return
+
+    # Some columns (e.g., poem_embedding) are only added once there's data for them
+    column_type = await get_column_type(conn, index.table, index.column)
+    if column_type is None:
+        return
+
+    logging.info(
+        f"Building HNSW index on {index.table}.{index.column} ({index.metric})..."
+    )
+    await conn.execute(
+        f"""
+        CREATE INDEX IF NOT EXISTS {index.name} ON {index.table}
+        USING hnsw ({index.column} {index.opclass(column_type)})
+        WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})
+        ;
+        """
+    )
+
+
+async def create_partition_vector_indexes(
+    conn: asyncpg.Connection, table: str, partition: str
+) -> None:
+    """
+    Build a table's HNSW indexes on a table that is to be attached as its partition,
+    so that ATTACH PARTITION adopts them instead of building them itself
+    """
+    for index in VECTOR_INDEXES:
+        if index.table != table:
+            continue
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL;", index.name)
+        if not exists:
+            continue
+        column_type = await get_column_type(conn, index.table, index.column)
+        await conn.execute(
+            f"""
+            CREATE INDEX ON {partition}
+            USING hnsw ({index.column} {index.opclass(column_type)})
+            WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})
+            ;
+            """
+        )
+
+
+async def supports_iterative_scans(conn: asyncpg.Connection) -> bool:
+    """Whether the installed pgvector (0.8.0 or later) has iterative index scans"""
+    version = await conn.fetchval(
+        "SELECT extversion FROM pg_extension WHERE extname = 'vector';"
+    )
+    return version is not None and tuple(map(int, version.split(".")[:2])) >= (0, 8)
+
+
+@asynccontextmanager
+async def search_connection(
+    self,
+    ef_search: int | None = None,
+    limit: int | None = None,
+    max_scan_tuples: int | None = None,
+    depth: int = 0,
+):
+    """
+    Acquire a connection to run a vector search on, with its HNSW scan settings.
+
+    An HNSW index scan only yields ef_search candidates (the size of its candidate
+    list), and filters (e.g., on video, shot or face) are applied after that, so
+    ef_search defaults to the search's `limit` (within HNSW_EF_SEARCH_MIN to
+    HNSW_EF_SEARCH_MAX); a higher ef_search is more accurate, but slower. Where
+    pgvector supports them, iterative scans are enabled too, so that a scan whose
+    candidates are filtered out (or that a cursor or later page keeps reading)
+    continues, in strict order of distance, until the query has its rows or
+    `max_scan_tuples` index entries have been visited. That costs more only for
+    searches with selective filters, which would otherwise come back short.
+
+    A later page of results re-runs the scan from the nearest neighbor, with a
+    keyset filter that drops the `depth` rows of the earlier pages, so these count
+    toward both ef_search and max_scan_tuples (up to MAX_CANDIDATES of them, as
+    `depth` comes from a client's cursor).
+    """
+    depth = min(depth, MAX_CANDIDATES)
+    if ef_search is None:
+        ef_search = depth + (limit or HNSW_EF_SEARCH_MIN)
+    ef_search = min(max(ef_search, HNSW_EF_SEARCH_MIN), HNSW_EF_SEARCH_MAX)
+    if max_scan_tuples is None:
+        max_scan_tuples = HNSW_MAX_SCAN_TUPLES + depth
+
+    async with self._pool.acquire() as conn:
+        if self._iterative_scans is None:
+            self._iterative_scans = await supports_iterative_scans(conn)
+
+        settings = {"hnsw.ef_search": str(ef_search)}
+        if self._iterative_scans:
+            settings["hnsw.iterative_scan"] = "strict_order"
+            settings["hnsw.max_scan_tuples"] = str(max_scan_tuples)
+
+        async with conn.transaction():
+            await apply_settings(conn, settings)
+            # So that slow statements are EXPLAINed with the same settings
+            token = current_settings.set(settings)
+            try:
+                yield conn
+            finally:
+                current_settings.reset(token)
@@ -0,0 +1,193 @@
+"""Instrumentation of MimeDb method calls and the statements they run.
+
+Every public async MimeDb method is timed (as Prometheus metrics; see lib.metrics).
+With DB_INSTRUMENTATION enabled, the rows each method returns and the approximate
+size of that data are also counted, and any statement taking longer than
+SLOW_QUERY_MS is re-run under EXPLAIN (ANALYZE, BUFFERS), in a transaction that is
+rolled back and with the same transaction-local settings (e.g., HNSW scan settings)
+as the statement was run with, and the plan is written to the slow-query log (the
+"mime_db.slow_queries" logger, and the file at SLOW_QUERY_LOG if set). Statements
+that modify data are only EXPLAINed, not run again, and only one EXPLAIN is run at a
+time: slow statements meanwhile are logged without a plan.
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import time
+from contextvars import ContextVar
+
+import asyncpg
+import numpy as np
+
+from lib.metrics import (
+    DB_CALL_BYTES,
+    DB_CALL_LATENCY,
+    DB_CALL_ROWS,
+    DB_CALLS_IN_FLIGHT,
+    DB_SLOW_QUERIES,
+)
+
+DB_INSTRUMENTATION = (os.getenv("DB_INSTRUMENTATION") or "off").lower() in (
+    "1",
+    "on",
+    "true",
+    "yes",
+)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 500)
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG")
+
+# Only statements like these can be EXPLAINed
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+# Statements that (may) modify data, which EXPLAIN ANALYZE would run again
+MODIFYING = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+
+slow_query_logger = logging.getLogger("mime_db.slow_queries")
+if DB_INSTRUMENTATION and SLOW_QUERY_LOG:
+    slow_query_logger.addHandler(logging.FileHandler(SLOW_QUERY_LOG))
+
+# The MimeDb method a statement is run on behalf of
+current_method: ContextVar[str | None] = ContextVar("current_method", default=None)
+# The transaction-local settings a statement is run with (c.f. apply_settings())
+current_settings: ContextVar[dict | None] = ContextVar("current_settings", default=None)
+
+
+async def apply_settings(conn: asyncpg.Connection, settings: dict) -> None:
+    """Set settings (name -> value) for the rest of the connection's transaction"""
+    await conn.execute(
+        """
+        SELECT set_config(name, value, true)
+        FROM unnest($1::text[], $2::text[]) AS settings(name, value)
+        ;
+        """,
+        list(settings),
+        list(settings.values()),
+    )
+
+
+def result_size(result) -> tuple[int, int]:
+    """Number of rows in a method's result, and (approximately) their size in bytes"""
+    if isinstance(result, asyncpg.Record):
+        rows = [result]
+    elif isinstance(result, list):
+        rows = result
+    else:
+        return 0, 0
+
+    size = 0
+    for row in rows:
+        values = row.values() if isinstance(row, (asyncpg.Record, dict)) else [row]
+        for value in values:
+            if isinstance(value, np.ndarray):
+                size += value.nbytes
+            elif isinstance(value, (str, bytes)):
+                size += len(value)
+            elif isinstance(value, (list, tuple)):
+                size += 8 * len(value)
+            else:
+                size += 8
+    return len(rows), size
+
+
+def timed(name: str, method):
+    latency = DB_CALL_LATENCY.labels(name)
+    in_flight = DB_CALLS_IN_FLIGHT.labels(name)
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        token = current_method.set(name)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            result = await method(*args, **kwargs)
+        finally:
+            latency.observe(time.perf_counter() - start)
+            in_flight.dec()
+            current_method.reset(token)
+
+        if DB_INSTRUMENTATION:
+            rows, size = result_size(result)
+            DB_CALL_ROWS.labels(name).inc(rows)
+            DB_CALL_BYTES.labels(name).inc(size)
+        return result
+
+    return wrapper
+
+
+def instrument(cls):
+    """Class decorator that times all of a class's public async methods"""
+    for name, member in list(vars(cls).items()):
+        if not name.startswith("_") and inspect.iscoroutinefunction(member):
+            setattr(cls, name, timed(name, member))
+    return cls
+
+
+class SlowQueryLogger:
+    """asyncpg query logger that captures the plans of slow statements"""
+
+    def __init__(self):
+        # The pool to run EXPLAINs on (they're run after the statement's connection
+        # may have been released)
+        self.pool: asyncpg.Pool | None = None
+        # The EXPLAIN being run, if any (so they don't pile up on the pool)
+        self._explaining: asyncio.Task | None = None
+
+    async def init_connection(self, conn: asyncpg.Connection) -> None:
+        conn.add_query_logger(self)
+
+    def __call__(self, record) -> None:
+        if record.exception is not None or record.elapsed * 1000 < SLOW_QUERY_MS:
+            return
+        if record.query.lstrip().upper().startswith("EXPLAIN"):
+            # Including our own EXPLAIN ANALYZEs, which take as long as the original
+            return
+        method = current_method.get()
+        DB_SLOW_QUERIES.labels(method or "unknown").inc()
+        if self._explaining is not None and not self._explaining.done():
+            self.log(record, method, "(Not EXPLAINed, as another EXPLAIN was running)")
+            return
+        self._explaining = asyncio.get_running_loop().create_task(
+            self.explain(record, method, current_settings.get())
+        )
+
+    async def explain(self, record, method: str | None, settings: dict | None) -> None:
+        query = record.query.strip()
+        args = record.args
+        # executemany() logs all of its argument tuples at once; EXPLAIN the first
+        if isinstance(args, list):
+            args = args[0] if args else ()
+
+        plan = None
+        if self.pool is not None and query.upper().startswith(EXPLAINABLE):
+            options = "(BUFFERS)" if MODIFYING.search(query) else "(ANALYZE, BUFFERS)"
+            try:
+                async with self.pool.acquire() as conn:
+                    transaction = conn.transaction()
+                    await transaction.start()
+                    try:
+                        if settings:
+                            await apply_settings(conn, settings)
+                        rows = await conn.fetch(f"EXPLAIN {options} {query}", *args)
+                        plan = "\n".join(row[0] for row in rows)
+                    finally:
+                        await transaction.rollback()
+            except (asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                plan = f"(EXPLAIN failed: {e})"
+
+        self.log(record, method, plan)
+
+    def log(self, record, method: str | None, plan: str | None) -> None:
+        slow_query_logger.warning(
+            json.dumps(
+                {
+                    "method": method,
+                    "elapsed_ms": round(record.elapsed * 1000, 1),
+                    "query": record.query.strip(),
+                    "plan": plan,
+                }
+            )
+        )
@@ -0,0 +1,465 @@
+"""Versioned schema migrations, applied in order by _initialization.migrate_schema().
+
+Each migration is an async function taking a connection, run in a transaction of
+its own. Append new migrations to MIGRATIONS; never edit or reorder applied ones.
+"""
+
+# A migration runs the SQL of its own time, so rather than calling the (evolving)
+# helpers of the other modules, the ones below carry copies of what they need
+
+# The primary keys of the tables to partition (the face table has none)
+PARTITIONED_PRIMARY_KEYS = {
+    "frame": "video_id, frame",
+    "pose": "video_id, frame, pose_idx",
+    "face": None,
+    "movelet": "video_id, track_id, tick",
+}
+
+# The HNSW indexes there were when the tables were partitioned, as (table, column,
+# distance metric, operator class suffix)
+PARTITIONED_VECTOR_INDEXES = [
+    ("pose", "norm", "cosine", "cosine"),
+    ("pose", "norm", "euclidean", "l2"),
+    ("pose", "poem_embedding", "cosine", "cosine"),
+    ("pose", "global3d_coco13", "cosine", "cosine"),
+    ("pose", "ava_action", "cosine", "cosine"),
+    ("movelet", "motion", "cosine", "cosine"),
+    ("face", "embedding", "cosine", "cosine"),
+]
+
+
+async def create_schema(conn) -> None:
+    # Statements are idempotent, so this also adopts databases created before
+    # schema versioning
+    await conn.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp";')
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS video (
+            id uuid DEFAULT uuid_generate_v1mc() PRIMARY KEY,
+            video_name VARCHAR(150) UNIQUE NOT NULL,
+            frame_count INTEGER NOT NULL,
+            fps FLOAT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            created_on TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+        ;
+        """
+    )
+
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS frame (
+            video_id uuid NOT NULL REFERENCES video(id) ON DELETE CASCADE,
+            frame INTEGER NOT NULL,
+            local_shot_prob FLOAT NOT NULL,
+            global_shot_prob FLOAT NOT NULL,
+            is_shot_boundary BOOLEAN DEFAULT FALSE,
+            shot INTEGER DEFAULT 0,
+            total_movement FLOAT DEFAULT 0.0,
+            total_movement3d FLOAT DEFAULT 0.0,
+            pose_interest FLOAT DEFAULT 0.0,
+            action_interest FLOAT DEFAULT 0.0,
+            PRIMARY KEY(video_id, frame)
+        )
+        ;
+        """
+    )
+
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pose (
+            video_id uuid NOT NULL REFERENCES video(id) ON DELETE CASCADE,
+            frame INTEGER NOT NULL,
+            pose_idx INTEGER NOT NULL,
+            keypoints vector(39) NOT NULL,
+            norm vector(26) DEFAULT NULL,
+            keypointsopp vector(51) DEFAULT NULL,
+            keypoints4dh vector(135) DEFAULT NULL,
+            keypoints3d vector(39) DEFAULT NULL,
+            global3d_phalp vector(135) DEFAULT NULL,
+            global3d_coco13 vector(39) DEFAULT NULL,
+            ava_action vector(60) DEFAULT NULL,
+            action_labels text[3] DEFAULT NULL,
+            bbox FLOAT[4] NOT NULL,
+            camera FLOAT[3] NOT NULL,
+            score FLOAT NOT NULL,
+            category INTEGER,
+            track_id INTEGER DEFAULT NULL,
+            pose_interest FLOAT DEFAULT 0.0,
+            action_interest FLOAT DEFAULT 0.0,
+            poem_embedding vector(16) DEFAULT NULL,
+            PRIMARY KEY(video_id, frame, pose_idx)
+        )
+        ;
+        """
+    )
+
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS face (
+            video_id uuid NOT NULL REFERENCES video(id) ON DELETE CASCADE,
+            frame INTEGER NOT NULL,
+            pose_idx INTEGER,
+            bbox FLOAT[4] NOT NULL,
+            confidence FLOAT NOT NULL,
+            landmarks vector(10) NOT NULL,
+            embedding vector(512) NOT NULL,
+            track_id INTEGER DEFAULT NULL,
+            cluster_id INTEGER DEFAULT NULL
+        )
+        ;
+        """
+    )
+
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS movelet (
+            video_id uuid NOT NULL REFERENCES video(id) ON DELETE CASCADE,
+            track_id INTEGER NOT NULL,
+            tick INTEGER NOT NULL,
+            start_frame INTEGER NOT NULL,
+            end_frame INTEGER NOT NULL,
+            pose_idx INTEGER NOT NULL,
+            prev_norm vector(26) NOT NULL,
+            norm vector(26) NOT NULL,
+            motion vector(52) NOT NULL,
+            movement FLOAT DEFAULT 0,
+            movement3d FLOAT DEFAULT 0,
+            poem_embedding vector(16) DEFAULT NULL,
+            cluster_id INTEGER DEFAULT NULL,
+            PRIMARY KEY(video_id, track_id, tick)
+        )
+        ;
+        """
+    )
+
+    await conn.execute(
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS video_meta AS
+            SELECT video.*, pose_ct, track_ct, shot_ct, poses_per_frame, face_ct
+            FROM video
+            LEFT JOIN (
+                SELECT video.id, COUNT(*) AS face_ct
+                FROM video
+                INNER JOIN face ON video.id = face.video_id
+                GROUP BY video.id
+            ) AS f ON video.id = f.id
+            LEFT JOIN (
+                SELECT video.id,
+                    COUNT(*) filter (where frame.is_shot_boundary) as shot_ct
+                FROM video
+                INNER JOIN frame ON video.id = frame.video_id
+                GROUP BY video.id
+            ) as s on video.id = s.id
+            LEFT JOIN (
+                SELECT video.id,
+                    COUNT(*) AS pose_ct,
+                    COUNT(DISTINCT pose.track_id) AS track_ct,
+                    TRUNC(COUNT(*)::decimal / video.frame_count, 2) AS poses_per_frame
+                FROM video
+                INNER JOIN pose ON video.id = pose.video_id
+                GROUP BY video.id
+                ) AS p ON video.id = p.id
+            ORDER BY video_name
+        WITH DATA;
+
+        CREATE UNIQUE INDEX IF NOT EXISTS video_meta_id_idx ON video_meta (id);
+        """
+    )
+
+    await conn.execute(
+        """
+        CREATE MATERIALIZED VIEW if not exists video_frame_meta as
+        SELECT  pose_faces.video_id,
+                pose_faces.frame,
+                pose_faces.track_ct,
+                pose_faces.face_ct,
+                pose_faces.avg_score,
+                CAST(frame.is_shot_boundary AS INT) AS is_shot,
+                frame.pose_interest,
+                frame.action_interest,
+                CASE
+                  WHEN frame.total_movement = 'NaN'
+                  THEN 0.0
+                  ELSE ROUND(frame.total_movement::numeric, 2)
+                END AS "movement",
+                CASE
+                  WHEN frame.total_movement3d = 'NaN'
+                  THEN 0.0
+                  ELSE ROUND(frame.total_movement3d::numeric, 2)
+                END AS "movement3d"
+        FROM (
+            SELECT pose.video_id,
+                   pose.frame,
+                   count(NULLIF(pose.track_id,0)) AS track_ct,
+                   count(face.pose_idx) AS face_ct,
+                   ROUND(AVG(pose.score)::numeric, 2) AS avg_score
+            FROM pose
+            LEFT JOIN face ON
+                pose.video_id = face.video_id AND
+                pose.frame = face.frame AND
+                pose.pose_idx = face.pose_idx
+            GROUP BY pose.video_id, pose.frame
+            ORDER BY pose.frame
+        ) AS pose_faces
+        LEFT JOIN frame ON
+            pose_faces.video_id = frame.video_id AND
+            pose_faces.frame = frame.frame
+        ORDER BY pose_faces.frame
+        WITH DATA;
+
+        CREATE INDEX IF NOT EXISTS video_frame_meta_video_id_idx
+            ON video_frame_meta (video_id);
+        """
+    )
+
+
+async def add_lazily_created_columns(conn) -> None:
+    """
+    Columns that used to be added by the ingest methods when first needed, so that
+    databases created before they were in the schema have them too
+    """
+    await conn.execute(
+        """
+        ALTER TABLE frame
+            ADD COLUMN IF NOT EXISTS total_movement FLOAT DEFAULT 0.0,
+            ADD COLUMN IF NOT EXISTS total_movement3d FLOAT DEFAULT 0.0,
+            ADD COLUMN IF NOT EXISTS pose_interest FLOAT DEFAULT 0.0,
+            ADD COLUMN IF NOT EXISTS action_interest FLOAT DEFAULT 0.0
+        ;
+        ALTER TABLE pose
+            ADD COLUMN IF NOT EXISTS track_id INTEGER DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS pose_interest FLOAT DEFAULT 0.0,
+            ADD COLUMN IF NOT EXISTS action_interest FLOAT DEFAULT 0.0,
+            ADD COLUMN IF NOT EXISTS poem_embedding vector(16) DEFAULT NULL
+        ;
+        ALTER TABLE face
+            ADD COLUMN IF NOT EXISTS track_id INTEGER DEFAULT NULL,
+            ADD COLUMN IF NOT EXISTS cluster_id INTEGER DEFAULT NULL
+        ;
+        ALTER TABLE movelet
+            ADD COLUMN IF NOT EXISTS cluster_id INTEGER DEFAULT NULL
+        ;
+        """
+    )
+
+
+async def replace_materialized_views(conn) -> None:
+    """
+    Replace the video_meta and video_frame_meta materialized views, which could only
+    be refreshed for all videos at once, with tables refreshed per video (see
+    _summaries.refresh_summaries()); video_meta becomes a plain view over video and
+    its summary row, so it keeps its columns and order
+    """
+    await conn.execute(
+        """
+        DROP MATERIALIZED VIEW IF EXISTS video_meta;
+        DROP MATERIALIZED VIEW IF EXISTS video_frame_meta;
+
+        CREATE TABLE video_summary (
+            video_id uuid PRIMARY KEY REFERENCES video(id) ON DELETE CASCADE,
+            pose_ct BIGINT,
+            track_ct BIGINT,
+            shot_ct BIGINT,
+            poses_per_frame NUMERIC,
+            face_ct BIGINT
+        )
+        ;
+
+        CREATE VIEW video_meta AS
+            SELECT video.*, pose_ct, track_ct, shot_ct, poses_per_frame, face_ct
+            FROM video
+            LEFT JOIN video_summary ON video.id = video_summary.video_id
+            ORDER BY video_name
+        ;
+
+        CREATE TABLE video_frame_meta (
+            video_id uuid NOT NULL REFERENCES video(id) ON DELETE CASCADE,
+            frame INTEGER NOT NULL,
+            track_ct BIGINT NOT NULL,
+            face_ct BIGINT NOT NULL,
+            avg_score NUMERIC,
+            is_shot INTEGER,
+            pose_interest FLOAT,
+            action_interest FLOAT,
+            movement NUMERIC,
+            movement3d NUMERIC,
+            PRIMARY KEY(video_id, frame)
+        )
+        ;
+        """
+    )
+
+    await conn.execute(
+        """
+        INSERT INTO video_frame_meta (
+            video_id, frame, track_ct, face_ct, avg_score, is_shot,
+            pose_interest, action_interest, movement, movement3d
+        )
+        SELECT  pose_faces.video_id,
+                pose_faces.frame,
+                pose_faces.track_ct,
+                pose_faces.face_ct,
+                pose_faces.avg_score,
+                CAST(frame.is_shot_boundary AS INT) AS is_shot,
+                frame.pose_interest,
+                frame.action_interest,
+                CASE
+                  WHEN frame.total_movement = 'NaN'
+                  THEN 0.0
+                  ELSE ROUND(frame.total_movement::numeric, 2)
+                END AS "movement",
+                CASE
+                  WHEN frame.total_movement3d = 'NaN'
+                  THEN 0.0
+                  ELSE ROUND(frame.total_movement3d::numeric, 2)
+                END AS "movement3d"
+        FROM (
+            SELECT pose.video_id,
+                   pose.frame,
+                   count(NULLIF(pose.track_id,0)) AS track_ct,
+                   count(face.pose_idx) AS face_ct,
+                   ROUND(AVG(pose.score)::numeric, 2) AS avg_score
+            FROM pose
+            LEFT JOIN face ON
+                pose.video_id = face.video_id AND
+                pose.frame = face.frame AND
+                pose.pose_idx = face.pose_idx
+            GROUP BY pose.video_id, pose.frame
+        ) AS pose_faces
+        LEFT JOIN frame ON
+            pose_faces.video_id = frame.video_id AND
+            pose_faces.frame = frame.frame
+        ;
+
+        INSERT INTO video_summary (
+            video_id, pose_ct, track_ct, shot_ct, poses_per_frame, face_ct
+        )
+        SELECT video.id,
+               p.pose_ct,
+               p.track_ct,
+               s.shot_ct,
+               TRUNC(p.pose_ct::decimal / video.frame_count, 2),
+               f.face_ct
+        FROM video
+        LEFT JOIN (
+            SELECT video_id,
+                   COUNT(*) AS pose_ct,
+                   COUNT(DISTINCT track_id) AS track_ct
+            FROM pose GROUP BY video_id
+        ) AS p ON p.video_id = video.id
+        LEFT JOIN (
+            SELECT video_id, COUNT(*) FILTER (WHERE is_shot_boundary) AS shot_ct
+            FROM frame GROUP BY video_id
+        ) AS s ON s.video_id = video.id
+        LEFT JOIN (
+            SELECT video_id, COUNT(*) AS face_ct FROM face GROUP BY video_id
+        ) AS f ON f.video_id = video.id
+        ;
+        """
+    )
+
+
+async def partition_by_video(conn) -> None:
+    """
+    Recreate the frame, pose, face and movelet tables list-partitioned by video_id
+    (see _partitions), moving their rows into per-video partitions. The new tables
+    copy the current ones' columns, so columns that have been added or converted
+    (e.g., by compact_vectors()) are kept as they are.
+    """
+    for table in PARTITIONED_PRIMARY_KEYS:
+        await conn.execute(
+            f"""
+            ALTER TABLE {table} RENAME TO {table}_unpartitioned;
+            ALTER TABLE {table}_unpartitioned DROP CONSTRAINT IF EXISTS {table}_pkey;
+            """
+        )
+        primary_key = PARTITIONED_PRIMARY_KEYS[table]
+        primary_key = f"PRIMARY KEY({primary_key})," if primary_key else ""
+        await conn.execute(
+            f"""
+            CREATE TABLE {table} (
+                LIKE {table}_unpartitioned INCLUDING DEFAULTS,
+                {primary_key}
+                FOREIGN KEY (video_id) REFERENCES video(id) ON DELETE CASCADE
+            ) PARTITION BY LIST (video_id)
+            ;
+            """
+        )
+
+    for row in await conn.fetch("SELECT id FROM video;"):
+        for table in PARTITIONED_PRIMARY_KEYS:
+            await conn.execute(
+                f"""
+                CREATE TABLE {table}_{row["id"].hex} PARTITION OF {table}
+                    FOR VALUES IN ('{row["id"]}')
+                ;
+                """
+            )
+
+    for table in PARTITIONED_PRIMARY_KEYS:
+        await conn.execute(
+            f"""
+            INSERT INTO {table} SELECT * FROM {table}_unpartitioned;
+            DROP TABLE {table}_unpartitioned;
+            """
+        )
+
+    # Dropped along with the old tables (the columns may have been compacted to
+    # halfvec, or not added yet)
+    for table, column, metric, opclass in PARTITIONED_VECTOR_INDEXES:
+        column_type = await conn.fetchval(
+            """
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = to_regclass($1) AND attname = $2 AND NOT attisdropped
+            ;
+            """,
+            table,
+            column,
+        )
+        if column_type is None:
+            continue
+        vector_type = column_type.split("(")[0]
+        await conn.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {table}_{column}_{metric}_hnsw ON {table}
+            USING hnsw ({column} {vector_type}_{opclass}_ops)
+            WITH (m = 16, ef_construction = 64)
+            ;
+            """
+        )
+
+
+async def update_vector_extension(conn) -> None:
+    """
+    Bring pgvector's SQL objects up to the version of the installed extension (e.g.,
+    after upgrading the db image), so that its newer features (the halfvec type,
+    iterative index scans) are available
+    """
+    await conn.execute("ALTER EXTENSION vector UPDATE;")
+
+
+async def add_annotation_columns(conn) -> None:
+    """
+    Columns that annotate_pose() used to add when first needed, so that it no
+    longer has to alter the schema during ingest
+    """
+    await conn.execute(
+        "ALTER TABLE pose ADD COLUMN IF NOT EXISTS norm vector(26) DEFAULT NULL;"
+    )
+
+
+# Schema version N is reached by applying the first N of these
+MIGRATIONS = [
+    create_schema,
+    add_lazily_created_columns,
+    replace_materialized_views,
+    partition_by_video,
+    update_vector_extension,
+    add_annotation_columns,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
@@ -0,0 +1,75 @@
+"""Per-video partitions of the large tables.
+
+The frame, pose, face and movelet tables are list-partitioned by video_id, with one
+partition per video, attached when the video is added and detached and dropped when
+it is removed. Queries filtering on a video_id only touch that video's partition
+(and its own HNSW indexes), removing or re-ingesting a video doesn't leave dead rows
+in pages shared with other videos, and removing one is a DROP instead of a cascading
+DELETE.
+"""
+
+from uuid import UUID
+
+import asyncpg
+
+PARTITIONED_TABLES = ("frame", "pose", "face", "movelet")
+
+
+def partition_name(table: str, video_id: UUID) -> str:
+    return f"{table}_{video_id.hex}"
+
+
+async def create_partitions(conn: asyncpg.Connection, video_id: UUID) -> None:
+    """
+    Create and attach the video's partitions, if they don't already exist. (Attaching
+    a new, empty table takes a weaker lock on the parent than CREATE TABLE ...
+    PARTITION OF, so this doesn't block queries on other videos.)
+    """
+    for table in PARTITIONED_TABLES:
+        partition = partition_name(table, video_id)
+        exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL;", partition)
+        if exists:
+            continue
+        await conn.execute(
+            f"""
+            CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS);
+            ALTER TABLE {table}
+                ATTACH PARTITION {partition} FOR VALUES IN ('{video_id}');
+            """
+        )
+
+
+async def drop_partition(conn: asyncpg.Connection, table: str, video_id: UUID) -> None:
+    """Detach and drop one of the video's partitions (c.f. detach_partition())"""
+    await detach_partition(conn, table, video_id)
+    await conn.execute(f"DROP TABLE IF EXISTS {partition_name(table, video_id)};")
+
+
+async def detach_partition(conn: asyncpg.Connection, table: str, video_id: UUID) -> None:
+    """
+    Detach one of the video's partitions, if it's attached. Must not be run in a
+    transaction, as it's detached concurrently, so as not to block queries on other
+    videos. (This leaves it with a CHECK constraint on its video_id, so it can be
+    attached again without scanning its rows.)
+    """
+    partition = partition_name(table, video_id)
+    detach_pending = await conn.fetchval(
+        "SELECT inhdetachpending FROM pg_inherits WHERE inhrelid = to_regclass($1);",
+        partition,
+    )
+    if detach_pending is not None:
+        # A pending detach is one that was interrupted
+        mode = "FINALIZE" if detach_pending else "CONCURRENTLY"
+        await conn.execute(f"ALTER TABLE {table} DETACH PARTITION {partition} {mode};")
+
+
+async def drop_partitions(conn: asyncpg.Connection, video_id: UUID) -> None:
+    for table in PARTITIONED_TABLES:
+        await drop_partition(conn, table, video_id)
+
+
+async def truncate_partition(
+    conn: asyncpg.Connection, table: str, video_id: UUID
+) -> None:
+    """Delete all of a video's rows from a table, without leaving any dead rows"""
+    await conn.execute(f"TRUNCATE {partition_name(table, video_id)};")
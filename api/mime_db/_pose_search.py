@@ -1,89 +1,307 @@
-from typing import List, Literal, Set
+import asyncio
+from bisect import bisect_left, bisect_right
+from contextlib import aclosing
+from typing import List, Literal, Sequence, Set, Tuple
 from uuid import UUID
 
-from lib.pose_utils import get_poem_embedding
+import numpy as np
+
+from lib.poem_embedder import poem_embedder
+from mime_db._search_sql import (
+    batch_nearest_poses_sql,
+    batch_search_poses_sql,
+    search_poses_sql,
+)
+
+SearchType = Literal["cosine", "euclidean", "view_invariant", "3d"]
+
+# Distance metric and embedding column for each search type
+SEARCH_TYPES = {
+    "cosine": ("cosine", "norm"),
+    "euclidean": ("euclidean", "norm"),
+    "view_invariant": ("cosine", "poem_embedding"),
+    "3d": ("cosine", "global3d_coco13"),
+}
+
+# Most candidates (in order of distance) considered before giving up on `limit`
+MAX_CANDIDATES = 50000
+# Candidate rows fetched from the cursor at a time
+CANDIDATE_BATCH_SIZE = 500
+# Most ranges of suppressed frames carried over to a later page of results (in its
+# cursor, which is sent back in a query string)
+MAX_CURSOR_WINDOWS = 64
+
+
+class TemporalSuppressor:
+    """
+    Temporal non-maximum suppression for candidates arriving in order of distance:
+    a candidate is suppressed if one of a strictly lower rank (i.e., distance) of the
+    same video and pose_idx lies within `exclude_within_frames` frames of it, so
+    candidates tied on distance don't suppress each other.
+
+    Rather than every candidate seen, it keeps the merged ranges of frames that they
+    suppress. Its state(), which a later page of results starts from, only keeps the
+    MAX_CURSOR_WINDOWS most recently extended of those, so a near-duplicate of a
+    result from many pages before can reappear (though as candidates come in order
+    of distance, those of a result's near-duplicates that are to come mostly come
+    soon after it).
+    """
+
+    def __init__(self, exclude_within_frames: int, state: dict | None = None):
+        state = state or {}
+        self.exclude_within_frames = exclude_within_frames
+        # Sorted, disjoint (inclusive) ranges of suppressed frames, as parallel lists
+        # of their starts and ends, per (video_id, pose_idx), least recently
+        # extended first
+        self.windows: dict[tuple, tuple[list[int], list[int]]] = {
+            (video_id, pose_idx): (starts, ends)
+            for video_id, pose_idx, starts, ends in state.get("windows", ())
+        }
+        # The candidates of the current rank, which only suppress later ranks
+        self.rank = state.get("rank")
+        self.tied: list[tuple] = [
+            ((video_id, pose_idx), frame)
+            for video_id, pose_idx, frame in state.get("tied", ())
+        ]
+
+    def state(self) -> dict:
+        windows = []
+        ranges = 0
+        for key, (starts, ends) in reversed(self.windows.items()):
+            ranges += len(starts)
+            if ranges > MAX_CURSOR_WINDOWS:
+                break
+            windows.append([*key, starts, ends])
+        return {
+            "windows": windows[::-1],
+            "rank": self.rank,
+            "tied": [[*key, frame] for key, frame in self.tied],
+        }
+
+    def keep(self, video_id, pose_idx: int, frame: int, rank: int) -> bool:
+        if rank != self.rank:
+            for key, tied_frame in self.tied:
+                self._suppress_around(key, tied_frame)
+            self.rank = rank
+            self.tied = []
+
+        # Otherwise only the candidate itself would be within range
+        if self.exclude_within_frames <= 1:
+            return True
+
+        key = (str(video_id), pose_idx)
+        self.tied.append((key, frame))
+        starts, ends = self.windows.get(key, ([], []))
+        i = bisect_right(starts, frame) - 1
+        return i < 0 or ends[i] < frame
+
+    def _suppress_around(self, key: tuple, frame: int) -> None:
+        start = frame - self.exclude_within_frames + 1
+        end = frame + self.exclude_within_frames - 1
+        starts, ends = self.windows.pop(key, ([], []))
+        self.windows[key] = (starts, ends)
+        # Merge the ranges that overlap or adjoin this one
+        lo = bisect_left(ends, start - 1)
+        hi = bisect_right(starts, end + 1)
+        if lo < hi:
+            start = min(start, starts[lo])
+            end = max(end, ends[hi - 1])
+        starts[lo:hi] = [start]
+        ends[lo:hi] = [end]
 
 
 async def search_poses(
     self,
     pose_coords: List[int] | List[float],
-    search_type: Literal["cosine", "euclidean", "view_invariant", "3d"],
+    search_type: SearchType,
     videos: Set[UUID] | None = None,
     exclude_within_frames: int = 30,
     limit: int = 50,
+    ef_search: int | None = None,
+    after: tuple | None = None,
+    state: dict | None = None,
 ) -> list:
-    """Search for poses in the database"""
+    """
+    Search for poses in the database. To continue from a previous page of results,
+    pass the (distance, video_id, frame, pose_idx) of its last result as `after`,
+    and the `state` dict its search was given: a search updates this in place with
+    how far down the candidates it got, and the frames in which they still suppress
+    later near-duplicates.
+    """
 
-    additional_where = (
-        ""
-        if videos is None
-        else f"""AND pose.video_id IN ({",".join(f"'{v}'" for v in list(videos))})"""
+    (metric, embedding) = SEARCH_TYPES[search_type]
+    query_vector = await _query_vector(pose_coords, search_type)
+
+    if state is None:
+        state = {}
+    candidates = state.get("candidates", 0)
+    rank = state.get("rank", 0)
+    prev_distance = state.get("distance")
+    if candidates >= MAX_CANDIDATES:
+        return []
+
+    query_args = [query_vector, MAX_CANDIDATES - candidates]
+    if videos is not None:
+        query_args.append(list(videos))
+    if after is not None:
+        query_args.append(after[0])
+
+    suppressor = TemporalSuppressor(exclude_within_frames, state)
+    results = []
+
+    async with self.search_connection(
+        ef_search, limit, max_scan_tuples=MAX_CANDIDATES, depth=candidates
+    ) as conn:
+        # Cursors need a transaction (this is a savepoint if there already is one)
+        async with conn.transaction():
+            cursor = conn.cursor(
+                search_poses_sql(
+                    metric, embedding, videos is not None, after is not None
+                ),
+                *query_args,
+                prefetch=min(CANDIDATE_BATCH_SIZE, max(limit * 4, 50)),
+            )
+            streamed = _in_tiebreak_order(cursor, after)
+            async with aclosing(streamed):
+                async for pose in streamed:
+                    candidates += 1
+                    # Same as SQL RANK(): ties share a rank
+                    if pose["distance"] != prev_distance:
+                        rank = candidates
+                        prev_distance = pose["distance"]
+                    if not suppressor.keep(
+                        pose["video_id"], pose["pose_idx"], pose["frame"], rank
+                    ):
+                        continue
+                    results.append({**pose, "rank": rank})
+                    if len(results) >= limit:
+                        break
+
+    state.update(suppressor.state(), candidates=candidates, distance=prev_distance)
+    return results
+
+
+def _position(pose) -> tuple:
+    return (str(pose["video_id"]), pose["frame"], pose["pose_idx"])
+
+
+async def _in_tiebreak_order(candidates, after: tuple | None):
+    """
+    Candidates streamed in order of distance, with those tied on distance put in
+    TIEBREAK_ORDER (c.f. _search_sql), as the index can't order them by it, and
+    without any at or before `after`
+    """
+    if after is not None:
+        after_distance, video_id, frame, pose_idx = after
+        after_position = (str(video_id), frame, pose_idx)
+
+    tied = []
+    async for pose in candidates:
+        if tied and pose["distance"] != tied[0]["distance"]:
+            for tied_pose in sorted(tied, key=_position):
+                yield tied_pose
+            tied = []
+        if (
+            after is not None
+            and pose["distance"] == after_distance
+            and _position(pose) <= after_position
+        ):
+            continue
+        tied.append(pose)
+    for tied_pose in sorted(tied, key=_position):
+        yield tied_pose
+
+
+async def search_poses_batch(
+    self,
+    poses: Sequence[List[int] | List[float]],
+    search_type: SearchType,
+    videos: Set[UUID] | None = None,
+    limit: int = 50,
+    max_distance=float("inf"),
+    ef_search: int | None = None,
+) -> list:
+    """
+    Search for the poses nearest to each of several query poses in one round trip;
+    returns a list of results for each query, in order
+    """
+    (metric, embedding) = SEARCH_TYPES[search_type]
+    if not poses:
+        return []
+
+    query_vectors = np.stack(
+        await asyncio.gather(
+            *(_query_vector(pose_coords, search_type) for pose_coords in poses)
+        )
     )
 
-    (metric, embedding) = {
-        "cosine": ("cosine", "norm"),
-        "euclidean": ("euclidean", "norm"),
-        "view_invariant": ("cosine", "poem_embedding"),
-        "3d": ("cosine", "global3d_coco13"),
-    }[search_type]
+    query_args = [
+        query_vectors.ravel().tolist(),
+        len(query_vectors),
+        query_vectors.shape[1],
+        limit,
+        float(max_distance),
+    ]
+    if videos is not None:
+        query_args.append(list(videos))
 
+    async with self.search_connection(ef_search, limit) as conn:
+        matches = await conn.fetch(
+            batch_search_poses_sql(metric, embedding, videos is not None), *query_args
+        )
+    return _group_by_query(matches, len(poses))
+
+
+async def get_nearest_poses_batch(
+    self,
+    references: Sequence[Tuple[UUID, int, int]],
+    search_type: SearchType,
+    videos: Set[UUID] | None = None,
+    limit: int = 50,
+    max_distance=float("inf"),
+    ef_search: int | None = None,
+) -> list:
+    """
+    Search for the poses nearest to each of several (video_id, frame, pose_idx)
+    poses in the database in one round trip; returns a list of results for each
+    reference pose, in order
+    """
+    (metric, embedding) = SEARCH_TYPES[search_type]
+    if not references:
+        return []
+
+    video_ids, frames, pose_idxs = zip(*references, strict=True)
+    query_args = [
+        list(video_ids),
+        list(frames),
+        list(pose_idxs),
+        limit,
+        float(max_distance),
+    ]
+    if videos is not None:
+        query_args.append(list(videos))
+
+    async with self.search_connection(ef_search, limit) as conn:
+        matches = await conn.fetch(
+            batch_nearest_poses_sql(metric, embedding, videos is not None),
+            *query_args,
+        )
+    return _group_by_query(matches, len(references))
+
+
+async def _query_vector(pose_coords, search_type: SearchType) -> np.ndarray:
     if search_type == "3d":
         pose_coords = list(map(float, pose_coords))
 
     if search_type == "view_invariant":
-        pose_coords = get_poem_embedding(pose_coords)
-
-    distance = {
-        "cosine": f"{embedding} <=> '{pose_coords}'",
-        "euclidean": f"{embedding} <-> '{pose_coords}'",
-        "innerproduct": f"({embedding} <#> '{pose_coords}' * -1",
-    }[metric]
-
-    return await self._pool.fetch(
-        f"""
-        WITH ranked_poses AS (
-
-            SELECT pose.video_id,
-                video.video_name,
-                pose.frame,
-                pose.pose_idx,
-                pose.norm,
-                pose.keypoints,
-                pose.bbox,
-                {distance} AS distance,
-                RANK() OVER (ORDER BY {distance}) AS rank
-
-            FROM pose, video
-
-            WHERE video.id = pose.video_id
-              {additional_where}
-
-            ORDER BY distance
-            LIMIT 50000
-        )
+        pose_coords = await poem_embedder.embed(pose_coords)
 
-        SELECT video_id,
-               video_name,
-               frame,
-               pose_idx,
-               norm,
-               keypoints,
-               bbox,
-               distance,
-               rank
-        FROM ranked_poses
-        WHERE NOT EXISTS (
-            SELECT 1
-            FROM ranked_poses rp2
-            WHERE rp2.rank < ranked_poses.rank
-            and rp2.video_id = ranked_poses.video_id
-            and rp2.pose_idx = ranked_poses.pose_idx
-            and ABS(rp2.frame - ranked_poses.frame) < $2
-        )
-        ORDER BY distance
-        LIMIT $1
-        ;
-    """,
-        limit,
-        exclude_within_frames,
-    )
+    return np.array(pose_coords, dtype=np.float32)
+
+
+def _group_by_query(matches, query_ct: int) -> list:
+    results = [[] for _ in range(query_ct)]
+    for match in matches:
+        match = dict(match)
+        results[match.pop("query_idx")].append(match)
+    return results
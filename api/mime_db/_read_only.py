@@ -3,6 +3,14 @@ from uuid import UUID
 import asyncpg
 import numpy as np
 
+from mime_db._search_sql import (
+    POSE_EMBEDDINGS,
+    nearest_actions_sql,
+    nearest_movelets_sql,
+    nearest_poses_sql,
+    search_by_pose_sql,
+)
+
 
 async def get_available_videos(self) -> list:
     return await self._pool.fetch("""SELECT * FROM video_meta;""")
@@ -18,7 +26,9 @@ async def get_video_by_name(self, video_name: str) -> asyncpg.Record:
     )
 
 
-async def get_pose_data_by_frame(self, video_id: UUID) -> list:
+async def get_pose_data_by_frame(
+    self, video_id: UUID, min_frame: int | None = None, max_frame: int | None = None
+) -> list:
     return await self._pool.fetch(
         """
         SELECT frame,
@@ -31,9 +41,14 @@ async def get_pose_data_by_frame(self, video_id: UUID) -> list:
                pose_interest,
                action_interest
            FROM video_frame_meta
-           WHERE video_id = $1;
+           WHERE video_id = $1
+             AND ($2::INTEGER IS NULL OR frame >= $2)
+             AND ($3::INTEGER IS NULL OR frame <= $3)
+           ORDER BY frame;
         """,
         video_id,
+        min_frame,
+        max_frame,
     )
 
 
@@ -99,6 +114,38 @@ async def get_pose_annotations(self, column: str, video_id: UUID) -> list[np.nda
     return [np.array(_[column]) for _ in annotations]
 
 
+async def get_pose_search_data(self, video_id: UUID) -> tuple[list[str], list]:
+    """
+    Every pose of a video with its searchable embeddings and the frame and face
+    attributes the similarity searches filter on, ordered by frame and pose_idx.
+    Returns the embedding columns present in the DB and the pose records.
+    """
+    present = await self._pool.fetch(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'pose';"
+    )
+    embeddings = sorted(
+        POSE_EMBEDDINGS & {column["column_name"] for column in present}
+    )
+    embedding_columns = "".join(f"pose.{embedding}, " for embedding in embeddings)
+
+    poses = await self._pool.fetch(
+        f"""
+        SELECT pose.frame, pose.pose_idx, pose.track_id, pose.keypoints,
+            {embedding_columns}frame.shot, face.cluster_id AS face_cluster_id,
+            frame.frame IS NOT NULL AND face.frame IS NOT NULL AS joined
+        FROM pose
+        LEFT JOIN frame ON frame.video_id = pose.video_id AND frame.frame = pose.frame
+        LEFT JOIN face ON face.video_id = pose.video_id AND face.frame = pose.frame
+            AND face.pose_idx = pose.pose_idx
+        WHERE pose.video_id = $1
+        ORDER BY pose.frame, pose.pose_idx
+        ;
+        """,
+        video_id,
+    )
+    return embeddings, poses
+
+
 async def get_frame_data(self, video_id: UUID, frame: int) -> list:
     return await self._pool.fetch(
         "SELECT pose.*, frame.shot, frame.pose_interest, frame.action_interest FROM pose, frame WHERE pose.video_id = $1 AND pose.frame = $2 AND frame.video_id = $1 AND frame.frame = $2;",
@@ -156,6 +203,18 @@ async def get_track_frames(self, video_id: UUID) -> list:
     )
 
 
+def parse_video_param(video_param: UUID | str) -> tuple[bool, UUID | str]:
+    """
+    Search routes take either a video ID (to search within that video) or
+    "ALL|<video ID>" (to search all videos, with the ID identifying the video
+    containing the reference pose, if there is one).
+    Returns whether to search all videos, and the video ID.
+    """
+    if isinstance(video_param, str) and video_param.find("ALL|") != -1:
+        return True, video_param.split("|")[1]
+    return False, video_param
+
+
 async def search_by_pose(
     self,
     video_param: UUID | str,
@@ -164,29 +223,31 @@ async def search_by_pose(
     embedding="norm",
     max_distance="Infinity",
     limit=500,
+    ef_search: int | None = None,
+    after: tuple | None = None,
+    depth: int = 0,
 ) -> list:
-    if isinstance(video_param, str) and video_param.find("ALL|") != -1:
-        pose_subquery = "TRUE"
-    else:
-        pose_subquery = f"pose.video_id = '{video_param}'"
-
-    distance = {
-        "cosine": f"{embedding} <=> '{pose_coords}'",
-        "euclidean": f"{embedding} <-> '{pose_coords}'",
-        "innerproduct": f"({embedding} <#> '{pose_coords}' * -1",
-    }[metric]
-
-    return await self._pool.fetch(
-        f"""
-    WITH search_results AS(
-        SELECT pose.video_id, video.video_name, pose.frame, pose.pose_idx, pose.norm, pose.keypoints, {distance} AS distance, frame.shot AS shot, face.cluster_id AS face_cluster_id FROM pose, frame, face, video
-        WHERE {pose_subquery} AND video.id = pose.video_id AND frame.video_id = pose.video_id AND face.video_id = pose.video_id AND face.frame = pose.frame AND face.pose_idx = pose.pose_idx AND pose.frame = frame.frame ORDER BY distance
-        LIMIT $1
-    )
-    SELECT * from search_results where search_results.distance < {max_distance}
-    """,
+    """
+    `after` is the (distance, video_id, frame, pose_idx) of the last result of the
+    previous page of results, if any, and `depth` the number of results on the
+    previous pages (likewise for the other searches)
+    """
+    all_videos, video_id = parse_video_param(video_param)
+    query_args = [
+        np.array(pose_coords, dtype=np.float32),
         limit,
-    )
+        float(max_distance),
+    ]
+    if not all_videos:
+        query_args.append(video_id)
+    if after is not None:
+        query_args.extend(after)
+
+    async with self.search_connection(ef_search, limit, depth=depth) as conn:
+        return await conn.fetch(
+            search_by_pose_sql(metric, embedding, all_videos, after is not None),
+            *query_args,
+        )
 
 
 async def get_nearest_poses(
@@ -199,42 +260,23 @@ async def get_nearest_poses(
     max_distance="Infinity",
     avoid_shot=-1,
     limit=500,
+    ef_search: int | None = None,
+    after: tuple | None = None,
+    depth: int = 0,
 ) -> list:
-    if isinstance(video_param, str) and video_param.find("ALL|") != -1:
-        pose_subquery = "TRUE"
-        distance_subquery = f"""
-            SELECT {embedding}
-            FROM pose
-            WHERE video_id = '{video_param.split("|")[1]}' AND frame = $1 AND pose_idx = $2
-            """
-    else:
-        pose_subquery = f"pose.video_id = '{video_param}'"
-        distance_subquery = f"""
-            SELECT {embedding}
-            FROM pose
-            WHERE video_id = '{video_param}' AND frame = $1 AND pose_idx = $2
-        """
-
-    distance = {
-        "cosine": f"{embedding} <=> ({distance_subquery})",
-        "euclidean": f"{embedding} <-> ({distance_subquery})",
-        "innerproduct": f"({embedding} <#> ({distance_subquery}) * -1",
-    }[metric]
-
-    return await self._pool.fetch(
-        f"""
-        WITH search_results AS(
-            SELECT pose.video_id, video.video_name, pose.frame, pose.pose_idx, pose.norm, pose.keypoints, {distance} AS distance, frame.shot AS shot, face.cluster_id AS face_cluster_id FROM pose, frame, face, video
-            WHERE {pose_subquery} AND video.id = pose.video_id AND frame.video_id = pose.video_id AND face.video_id = pose.video_id AND face.frame = pose.frame AND face.pose_idx = pose.pose_idx AND pose.frame = frame.frame AND NOT ((pose.frame = $1 AND pose.pose_idx = $2) OR frame.shot = $3) ORDER BY distance
-            LIMIT $4
+    all_videos, video_id = parse_video_param(video_param)
+
+    async with self.search_connection(ef_search, limit, depth=depth) as conn:
+        return await conn.fetch(
+            nearest_poses_sql(metric, embedding, all_videos, after is not None),
+            frame,
+            pose_idx,
+            avoid_shot,
+            limit,
+            float(max_distance),
+            video_id,
+            *(after or ()),
         )
-        SELECT * from search_results where search_results.distance < {max_distance}
-        """,
-        frame,
-        pose_idx,
-        avoid_shot,
-        limit,
-    )
 
 
 async def get_nearest_actions(
@@ -245,30 +287,23 @@ async def get_nearest_actions(
     max_distance="Infinity",
     avoid_shot=-1,
     limit=500,
+    ef_search: int | None = None,
+    after: tuple | None = None,
+    depth: int = 0,
 ) -> list:
-    if isinstance(video_param, str) and video_param.find("ALL|") != -1:
-        pose_subquery = "TRUE"
-        distance_subquery = f"""ava_action <=> (SELECT ava_action FROM pose WHERE video_id = '{video_param.split("|")[1]}' AND frame = $1 AND track_id = $2)"""
-    else:
-        pose_subquery = f"pose.video_id = '{video_param}'"
-        distance_subquery = f"""ava_action <=> (SELECT ava_action FROM pose WHERE video_id = '{video_param}' AND frame = $1 AND track_id = $2)"""
-
-    return await self._pool.fetch(
-        f"""
-        WITH search_results AS(
-            SELECT pose.video_id, video.video_name, pose.frame, pose.pose_idx, pose.track_id, pose.norm, pose.keypoints, {distance_subquery} AS distance, pose.ava_action AS ava_action, pose.action_labels AS action_labels, frame.shot AS shot, face.cluster_id AS face_cluster_id FROM pose, frame, face, video
-            WHERE {pose_subquery} AND video.id=pose.video_id AND frame.video_id = pose.video_id AND face.video_id = pose.video_id AND face.frame = pose.frame AND face.pose_idx = pose.pose_idx AND pose.frame = frame.frame AND NOT (frame.shot = $3 OR (pose.frame = $1 AND pose.track_id = $2))
-            ORDER BY distance
-            LIMIT $4
+    all_videos, video_id = parse_video_param(video_param)
+
+    async with self.search_connection(ef_search, limit, depth=depth) as conn:
+        return await conn.fetch(
+            nearest_actions_sql(all_videos, after is not None),
+            frame,
+            track_id,
+            avoid_shot,
+            limit,
+            float(max_distance),
+            video_id,
+            *(after or ()),
         )
-        SELECT * from search_results where search_results.distance < $5
-        """,
-        frame,
-        track_id,
-        avoid_shot,
-        limit,
-        max_distance,
-    )
 
 
 async def get_movelet_from_pose(
@@ -291,33 +326,15 @@ async def get_nearest_movelets(
     max_distance="Infinity",
     avoid_shot=-1,
     limit=500,
+    ef_search: int | None = None,
 ) -> list:
-    sub_query = """
-        SELECT motion
-        FROM movelet
-        WHERE video_id = $1 AND start_frame <= $2 AND end_frame >= $2 AND track_id = $3
-        LIMIT 1
-        """
-
-    distance = {
-        "cosine": f"motion <=> ({sub_query})",
-        "euclidean": f"motion <-> ({sub_query})",
-        "innerproduct": f"motion <#> ({sub_query})",
-    }[metric]
-
-    return await self._pool.fetch(
-        f"""
-        WITH search_results AS(
-            SELECT movelet.video_id, movelet.start_frame, movelet.end_frame, movelet.pose_idx, movelet.track_id, movelet.norm, movelet.prev_norm, {distance} AS distance, frame.shot AS shot, face.cluster_id AS face_cluster_id FROM movelet, frame, face
-            WHERE movelet.video_id = $1 AND frame.video_id = $1 AND face.video_id = $1 AND face.frame = movelet.start_frame AND face.pose_idx = movelet.pose_idx AND movelet.start_frame = frame.frame AND NOT ((movelet.start_frame <= $2 AND movelet.end_frame >= $2) OR frame.shot = $4 OR (movelet.start_frame = $2 AND movelet.track_id = $3))
-            ORDER BY distance
-            LIMIT $5
+    async with self.search_connection(ef_search, limit) as conn:
+        return await conn.fetch(
+            nearest_movelets_sql(metric),
+            video_id,
+            frame,
+            track_id,
+            avoid_shot,
+            limit,
+            float(max_distance),
         )
-        SELECT * from search_results where search_results.distance < {max_distance}
-        """,
-        video_id,
-        frame,
-        track_id,
-        avoid_shot,
-        limit,
-    )
@@ -0,0 +1,375 @@
+"""Pre-built SQL statement variants for the vector similarity searches.
+
+Metric and embedding column names can't be bound as query parameters, so each
+search builds its SQL from a fixed set of choices (cached, so the text of each
+variant is identical every time and asyncpg's prepared-statement cache is hit);
+query vectors, video IDs and distance limits are always bound parameters.
+"""
+
+from functools import cache
+
+DISTANCE_OPERATORS = {
+    "cosine": "<=>",
+    "euclidean": "<->",
+    "innerproduct": "<#>",
+}
+
+POSE_EMBEDDINGS = {"norm", "poem_embedding", "global3d_coco13", "ava_action"}
+
+
+def distance_sql(column: str, metric: str, operand: str) -> str:
+    """
+    SQL for the distance from `column` to `operand` (a parameter or subquery), by
+    which results are ordered, ascending (so that an HNSW index can serve the ORDER
+    BY). For innerproduct, this is pgvector's negative inner product.
+    """
+    if metric not in DISTANCE_OPERATORS:
+        raise ValueError(f"Unsupported distance metric '{metric}'")
+    return f"{column} {DISTANCE_OPERATORS[metric]} {operand}"
+
+
+def reported_distance_sql(distance: str, metric: str) -> str:
+    """The distance reported with results (the inner product itself, for <#>)"""
+    return f"-({distance})" if metric == "innerproduct" else distance
+
+
+def sort_key_sql(reported: str, metric: str) -> str:
+    """
+    The distance_sql() value that a reported distance (e.g., a result column, or a
+    max distance or cursor position) corresponds to
+    """
+    return f"-({reported})" if metric == "innerproduct" else reported
+
+
+# Search results are ordered by these (after distance), so that the order is total
+# and pages of results can continue from the last result of the previous page. An
+# HNSW index can only serve an ORDER BY of the distance alone, though, so the inner
+# queries that scan the index are ordered by distance only (and fetch TIE_PADDING
+# rows more than a page), and the outer queries put those rows in this order and
+# drop the ones of earlier pages. Rows tied on distance at either end of a page are
+# only put in the right order if there are at most TIE_PADDING of them.
+TIEBREAK_ORDER = "video_id, frame, pose_idx"
+TIE_PADDING = 50
+
+
+def after_distance_sql(distance: str, metric: str, param: int, paged: bool) -> str:
+    """
+    Filter (for an inner query) for results at no lesser a distance than that of the
+    position to continue after, bound as parameter $param
+    """
+    if not paged:
+        return ""
+    return f"AND {distance} >= {sort_key_sql(f'${param}::double precision', metric)}"
+
+
+def keyset_sql(metric: str, first_param: int, paged: bool) -> str:
+    """
+    Filter (for an outer query) for results after a (reported distance, video_id,
+    frame, pose_idx) position, bound as parameters $first_param to $first_param + 3
+    """
+    if not paged:
+        return ""
+    n = first_param
+    after = sort_key_sql(f"${n}::double precision", metric)
+    position = f"{after}, ${n + 1}::uuid, ${n + 2}::integer, ${n + 3}::integer"
+    return f"AND ({sort_key_sql('distance', metric)}, {TIEBREAK_ORDER}) > ({position})"
+
+
+def check_embedding(embedding: str, embeddings=POSE_EMBEDDINGS) -> None:
+    if embedding not in embeddings:
+        raise ValueError(f"Unsupported embedding column '{embedding}'")
+
+
+@cache
+def search_by_pose_sql(
+    metric: str, embedding: str, all_videos: bool, paged: bool = False
+) -> str:
+    """
+    $1: query vector, $2: limit, $3: max distance[, $4: video ID][, then the
+    position to continue after (c.f. keyset_sql())]
+    """
+    check_embedding(embedding)
+    distance = distance_sql(f"pose.{embedding}", metric, "$1::vector")
+    reported = reported_distance_sql(distance, metric)
+    video_filter = "TRUE" if all_videos else "pose.video_id = $4"
+    after_param = 4 if all_videos else 5
+    after_distance = after_distance_sql(distance, metric, after_param, paged)
+    return f"""
+    WITH search_results AS(
+        SELECT pose.video_id, video.video_name, pose.frame, pose.pose_idx, pose.norm,
+            pose.keypoints, {reported} AS distance, frame.shot AS shot,
+            face.cluster_id AS face_cluster_id
+        FROM pose, frame, face, video
+        WHERE {video_filter}
+          AND video.id = pose.video_id
+          AND frame.video_id = pose.video_id
+          AND face.video_id = pose.video_id
+          AND face.frame = pose.frame
+          AND face.pose_idx = pose.pose_idx
+          AND pose.frame = frame.frame
+          {after_distance}
+        ORDER BY {distance}
+        LIMIT $2::integer + {TIE_PADDING}
+    )
+    SELECT * from search_results
+    WHERE {sort_key_sql("search_results.distance", metric)} < $3
+      {keyset_sql(metric, after_param, paged)}
+    ORDER BY {sort_key_sql("distance", metric)}, {TIEBREAK_ORDER}
+    LIMIT $2
+    """
+
+
+@cache
+def nearest_poses_sql(
+    metric: str, embedding: str, all_videos: bool, paged: bool = False
+) -> str:
+    """
+    $1: frame, $2: pose_idx, $3: shot to avoid, $4: limit, $5: max distance,
+    $6: ID of the video containing the reference pose[, $7-$10: the position to
+    continue after]
+    """
+    check_embedding(embedding)
+    reference = f"""(
+            SELECT {embedding}
+            FROM pose
+            WHERE video_id = $6 AND frame = $1 AND pose_idx = $2
+        )"""
+    distance = distance_sql(f"pose.{embedding}", metric, reference)
+    reported = reported_distance_sql(distance, metric)
+    video_filter = "TRUE" if all_videos else "pose.video_id = $6"
+    after_distance = after_distance_sql(distance, metric, 7, paged)
+    return f"""
+        WITH search_results AS(
+            SELECT pose.video_id, video.video_name, pose.frame, pose.pose_idx,
+                pose.norm, pose.keypoints, {reported} AS distance, frame.shot AS shot,
+                face.cluster_id AS face_cluster_id
+            FROM pose, frame, face, video
+            WHERE {video_filter}
+              AND video.id = pose.video_id
+              AND frame.video_id = pose.video_id
+              AND face.video_id = pose.video_id
+              AND face.frame = pose.frame
+              AND face.pose_idx = pose.pose_idx
+              AND pose.frame = frame.frame
+              AND NOT ((pose.frame = $1 AND pose.pose_idx = $2) OR frame.shot = $3)
+              {after_distance}
+            ORDER BY {distance}
+            LIMIT $4::integer + {TIE_PADDING}
+        )
+        SELECT * from search_results
+        WHERE {sort_key_sql("search_results.distance", metric)} < $5
+          {keyset_sql(metric, 7, paged)}
+        ORDER BY {sort_key_sql("distance", metric)}, {TIEBREAK_ORDER}
+        LIMIT $4
+        """
+
+
+@cache
+def nearest_actions_sql(all_videos: bool, paged: bool = False) -> str:
+    """
+    $1: frame, $2: track_id, $3: shot to avoid, $4: limit, $5: max distance,
+    $6: ID of the video containing the reference pose[, $7-$10: the position to
+    continue after]
+    """
+    reference = """(
+            SELECT ava_action
+            FROM pose
+            WHERE video_id = $6 AND frame = $1 AND track_id = $2
+        )"""
+    distance = distance_sql("pose.ava_action", "cosine", reference)
+    video_filter = "TRUE" if all_videos else "pose.video_id = $6"
+    after_distance = after_distance_sql(distance, "cosine", 7, paged)
+    return f"""
+        WITH search_results AS(
+            SELECT pose.video_id, video.video_name, pose.frame, pose.pose_idx,
+                pose.track_id, pose.norm, pose.keypoints, {distance} AS distance,
+                pose.ava_action AS ava_action, pose.action_labels AS action_labels,
+                frame.shot AS shot, face.cluster_id AS face_cluster_id
+            FROM pose, frame, face, video
+            WHERE {video_filter}
+              AND video.id = pose.video_id
+              AND frame.video_id = pose.video_id
+              AND face.video_id = pose.video_id
+              AND face.frame = pose.frame
+              AND face.pose_idx = pose.pose_idx
+              AND pose.frame = frame.frame
+              AND NOT (frame.shot = $3 OR (pose.frame = $1 AND pose.track_id = $2))
+              {after_distance}
+            ORDER BY {distance}
+            LIMIT $4::integer + {TIE_PADDING}
+        )
+        SELECT * from search_results
+        WHERE search_results.distance < $5
+          {keyset_sql("cosine", 7, paged)}
+        ORDER BY distance, {TIEBREAK_ORDER}
+        LIMIT $4
+        """
+
+
+@cache
+def nearest_movelets_sql(metric: str) -> str:
+    """
+    $1: video ID, $2: frame, $3: track_id, $4: shot to avoid, $5: limit,
+    $6: max distance
+    """
+    reference = """(
+        SELECT motion
+        FROM movelet
+        WHERE video_id = $1
+          AND start_frame <= $2
+          AND end_frame >= $2
+          AND track_id = $3
+        LIMIT 1
+        )"""
+    distance = distance_sql("motion", metric, reference)
+    reported = reported_distance_sql(distance, metric)
+    return f"""
+        WITH search_results AS(
+            SELECT movelet.video_id, movelet.start_frame, movelet.end_frame,
+                movelet.pose_idx, movelet.track_id, movelet.norm, movelet.prev_norm,
+                {reported} AS distance, frame.shot AS shot,
+                face.cluster_id AS face_cluster_id
+            FROM movelet, frame, face
+            WHERE movelet.video_id = $1
+              AND frame.video_id = $1
+              AND face.video_id = $1
+              AND face.frame = movelet.start_frame
+              AND face.pose_idx = movelet.pose_idx
+              AND movelet.start_frame = frame.frame
+              AND NOT (
+                (movelet.start_frame <= $2 AND movelet.end_frame >= $2)
+                OR frame.shot = $4
+                OR (movelet.start_frame = $2 AND movelet.track_id = $3)
+              )
+            ORDER BY {distance}
+            LIMIT $5
+        )
+        SELECT * from search_results
+        WHERE {sort_key_sql("search_results.distance", metric)} < $6
+        """
+
+
+@cache
+def search_poses_sql(
+    metric: str, embedding: str, filter_videos: bool, paged: bool = False
+) -> str:
+    """
+    Candidates in order of distance (only, so that the index can serve the ORDER BY;
+    ties are put in TIEBREAK_ORDER as they're streamed), to be de-duplicated as
+    they're streamed. $1: query vector, $2: max candidates[, $3: array of video
+    IDs][, then the distance of the position to continue after]
+    """
+    check_embedding(embedding)
+    distance = distance_sql(f"pose.{embedding}", metric, "$1::vector")
+    video_filter = "AND pose.video_id = ANY($3::uuid[])" if filter_videos else ""
+    after = after_distance_sql(distance, metric, 4 if filter_videos else 3, paged)
+    return f"""
+        SELECT pose.video_id,
+            video.video_name,
+            pose.frame,
+            pose.pose_idx,
+            pose.norm,
+            pose.keypoints,
+            pose.bbox,
+            {reported_distance_sql(distance, metric)} AS distance
+
+        FROM pose, video
+
+        WHERE video.id = pose.video_id
+          {video_filter}
+          {after}
+
+        ORDER BY {distance}
+        LIMIT $2
+        ;
+    """
+
+
+@cache
+def batch_search_poses_sql(metric: str, embedding: str, filter_videos: bool) -> str:
+    """
+    Top matches for each of a batch of query vectors, which are passed flattened
+    into one array. $1: query vectors (real[]), $2: number of queries,
+    $3: dimensions per query vector, $4: limit per query, $5: max distance[,
+    $6: array of video IDs]
+    """
+    check_embedding(embedding)
+    distance = distance_sql(f"pose.{embedding}", metric, "query.vector")
+    reported = reported_distance_sql(distance, metric)
+    video_filter = "AND pose.video_id = ANY($6::uuid[])" if filter_videos else ""
+    return f"""
+        SELECT query.query_idx - 1 AS query_idx, matches.*
+        FROM generate_series(1, $2::integer) AS query_number(query_idx)
+        CROSS JOIN LATERAL (
+            SELECT query_number.query_idx,
+                ($1::real[])[
+                    (query_number.query_idx - 1) * $3 + 1 : query_number.query_idx * $3
+                ]::vector AS vector
+        ) AS query
+        CROSS JOIN LATERAL (
+            SELECT pose.video_id,
+                video.video_name,
+                pose.frame,
+                pose.pose_idx,
+                pose.norm,
+                pose.keypoints,
+                pose.bbox,
+                {reported} AS distance
+            FROM pose, video
+            WHERE video.id = pose.video_id
+              {video_filter}
+            ORDER BY {distance}
+            LIMIT $4
+        ) AS matches
+        WHERE {sort_key_sql("matches.distance", metric)} < $5
+        ORDER BY query_idx, {sort_key_sql("distance", metric)}
+        ;
+    """
+
+
+@cache
+def batch_nearest_poses_sql(metric: str, embedding: str, filter_videos: bool) -> str:
+    """
+    Top matches for each of a batch of poses already in the database (excluding
+    the pose itself). $1: video IDs, $2: frames, $3: pose_idxs, $4: limit per
+    query, $5: max distance[, $6: array of video IDs to search]
+    """
+    check_embedding(embedding)
+    distance = distance_sql(f"pose.{embedding}", metric, "reference.vector")
+    reported = reported_distance_sql(distance, metric)
+    video_filter = "AND pose.video_id = ANY($6::uuid[])" if filter_videos else ""
+    return f"""
+        SELECT query.query_idx - 1 AS query_idx, matches.*
+        FROM unnest($1::uuid[], $2::integer[], $3::integer[])
+            WITH ORDINALITY AS query(video_id, frame, pose_idx, query_idx)
+        CROSS JOIN LATERAL (
+            SELECT {embedding} AS vector
+            FROM pose
+            WHERE video_id = query.video_id
+              AND frame = query.frame
+              AND pose_idx = query.pose_idx
+        ) AS reference
+        CROSS JOIN LATERAL (
+            SELECT pose.video_id,
+                video.video_name,
+                pose.frame,
+                pose.pose_idx,
+                pose.norm,
+                pose.keypoints,
+                pose.bbox,
+                {reported} AS distance
+            FROM pose, video
+            WHERE video.id = pose.video_id
+              AND NOT (
+                pose.video_id = query.video_id
+                AND pose.frame = query.frame
+                AND pose.pose_idx = query.pose_idx
+              )
+              {video_filter}
+            ORDER BY {distance}
+            LIMIT $4
+        ) AS matches
+        WHERE {sort_key_sql("matches.distance", metric)} < $5
+        ORDER BY query_idx, {sort_key_sql("distance", metric)}
+        ;
+    """
@@ -0,0 +1,126 @@
+"""Per-video summary tables (video_summary, shown with each video in the video_meta
+view, and video_frame_meta), refreshed one video at a time after its data changes,
+so that a refresh takes time proportional to that video, not to the whole archive.
+"""
+
+import logging
+from uuid import UUID
+
+import asyncpg
+
+
+async def refresh_summaries(conn: asyncpg.Connection, video_id: UUID) -> bool:
+    """
+    Recompute one video's summary rows; False if there is no such video. Runs in a
+    transaction, so readers see either the old or the new summaries.
+    """
+    async with conn.transaction():
+        # Serializes refreshes of the same video (without blocking its ingest, which
+        # only takes FOR KEY SHARE locks on the video row)
+        locked = await conn.fetchval(
+            "SELECT id FROM video WHERE id = $1 FOR NO KEY UPDATE;", video_id
+        )
+        if locked is None:
+            return False
+
+        await conn.execute("DELETE FROM video_frame_meta WHERE video_id = $1;", video_id)
+        await conn.execute(
+            """
+            INSERT INTO video_frame_meta (
+                video_id, frame, track_ct, face_ct, avg_score, is_shot,
+                pose_interest, action_interest, movement, movement3d
+            )
+            SELECT  pose_faces.video_id,
+                    pose_faces.frame,
+                    pose_faces.track_ct,
+                    pose_faces.face_ct,
+                    pose_faces.avg_score,
+                    CAST(frame.is_shot_boundary AS INT) AS is_shot,
+                    frame.pose_interest,
+                    frame.action_interest,
+                    CASE
+                      WHEN frame.total_movement = 'NaN'
+                      THEN 0.0
+                      ELSE ROUND(frame.total_movement::numeric, 2)
+                    END AS "movement",
+                    CASE
+                      WHEN frame.total_movement3d = 'NaN'
+                      THEN 0.0
+                      ELSE ROUND(frame.total_movement3d::numeric, 2)
+                    END AS "movement3d"
+            FROM (
+                SELECT pose.video_id,
+                       pose.frame,
+                       count(NULLIF(pose.track_id,0)) AS track_ct,
+                       count(face.pose_idx) AS face_ct,
+                       ROUND(AVG(pose.score)::numeric, 2) AS avg_score
+                FROM pose
+                LEFT JOIN face ON
+                    pose.video_id = face.video_id AND
+                    pose.frame = face.frame AND
+                    pose.pose_idx = face.pose_idx
+                WHERE pose.video_id = $1
+                GROUP BY pose.video_id, pose.frame
+            ) AS pose_faces
+            LEFT JOIN frame ON
+                pose_faces.video_id = frame.video_id AND
+                pose_faces.frame = frame.frame
+            ;
+            """,
+            video_id,
+        )
+
+        # The counts are NULL (as with the LEFT JOINs of the former materialized view)
+        # if the video has no rows of that kind
+        await conn.execute(
+            """
+            INSERT INTO video_summary (
+                video_id, pose_ct, track_ct, shot_ct, poses_per_frame, face_ct
+            )
+            SELECT video.id,
+                   p.pose_ct,
+                   p.track_ct,
+                   s.shot_ct,
+                   TRUNC(p.pose_ct::decimal / video.frame_count, 2),
+                   f.face_ct
+            FROM video
+            LEFT JOIN (
+                SELECT COUNT(*) AS pose_ct, COUNT(DISTINCT track_id) AS track_ct
+                FROM pose WHERE video_id = $1 HAVING COUNT(*) > 0
+            ) AS p ON TRUE
+            LEFT JOIN (
+                SELECT COUNT(*) FILTER (WHERE is_shot_boundary) AS shot_ct
+                FROM frame WHERE video_id = $1 HAVING COUNT(*) > 0
+            ) AS s ON TRUE
+            LEFT JOIN (
+                SELECT COUNT(*) AS face_ct
+                FROM face WHERE video_id = $1 HAVING COUNT(*) > 0
+            ) AS f ON TRUE
+            WHERE video.id = $1
+            ON CONFLICT (video_id) DO UPDATE SET
+                pose_ct = EXCLUDED.pose_ct,
+                track_ct = EXCLUDED.track_ct,
+                shot_ct = EXCLUDED.shot_ct,
+                poses_per_frame = EXCLUDED.poses_per_frame,
+                face_ct = EXCLUDED.face_ct
+            ;
+            """,
+            video_id,
+        )
+    return True
+
+
+async def refresh_video_summary(self, video_id: UUID) -> None:
+    """Bring a video's summaries up to date after any of its data has changed"""
+    async with self._pool.acquire() as conn:
+        if await refresh_summaries(conn, video_id):
+            logging.info(f"Refreshed summaries for video {video_id}")
+
+
+async def refresh_all_video_summaries(self) -> None:
+    """Rebuild every video's summaries, one video (and transaction) at a time"""
+    async with self._pool.acquire() as conn:
+        video_ids = await conn.fetch("SELECT id FROM video ORDER BY video_name;")
+        for row in video_ids:
+            await refresh_summaries(conn, row["id"])
+    logging.info(f"Refreshed summaries for {len(video_ids)} videos")
@@ -1,5 +1,6 @@
 import os
 import pickle
+import sys
 import warnings
 from pathlib import Path
 
@@ -15,6 +16,10 @@ from ipywidgets import IntProgress
 from PIL import Image, ImageColor, ImageDraw, ImageEnhance, ImageFont
 from scipy.spatial.distance import correlation, cosine
 
+sys.path.append("..")
+
+from lib import pose_utils
+
 # All constants are defined up here, though in the future they could be moved into the appropriate sub-modules.
 
 # The body part numberings and armature connectors for the 17-keypoint COCO pose format are defined in
@@ -72,7 +77,7 @@ FIGURE_WIDTH = 950
 FIGURE_HEIGHT = 500
 
 # Default dimension (length, width, maybe depth, eventually) of single pose viz
-POSE_MAX_DIM = 100
+POSE_MAX_DIM = pose_utils.POSE_MAX_DIM
 
 # XXX ImageDraw does't ship with a scaleable font, so best to use matplotlib's
 font_path = os.path.join(
@@ -108,47 +113,30 @@ def unflatten_pose_data(prediction):
         return out_array
 
 
+# The pose normalization functions below are those of lib.pose_utils (which can
+# normalize whole batches of poses at once), applied to a single prediction
+
+
+def _as_batch(prediction):
+    return np.array(unflatten_pose_data(prediction), dtype=float).reshape(1, -1, 3)
+
+
+def _from_batch(poses):
+    return {"keypoints": poses[0].flatten()}
+
+
 def extract_trustworthy_coords(prediction):
     """
     Convert an Open PifPaf pose prediction from a 1D vector of coordinates and confidence
     values to a 17x2 NumPy array containing only the armature coordinates, with coordinate values
     set to NaN,NaN for any coordinate with a confidence value of 0.
-    Returns the 17x2 array and a separate list of the original confidence values.
     """
-    unflattened_pose = unflatten_pose_data(prediction)
-    trustworthy_coords = np.array(
-        [
-            [coords[0], coords[1]] if coords[2] != 0 else [np.NaN, np.NaN]
-            for coords in unflattened_pose
-        ]
-    ).flatten()
-    # confidences = [coords[3] for coords in unflattened_pose]
-    return trustworthy_coords
+    return pose_utils.extract_trustworthy_coords_batch(_as_batch(prediction))[0]
 
 
 def get_pose_extent(prediction):
     """Get the min and max x and y coordinates of an Open PifPaf pose prediction"""
-    # if "bbox" in prediction:
-    #     # bbox format for PifPaf is x0, y0, width, height
-    #     bbox = prediction["bbox"]
-    #     extent = [bbox[0], bbox[1], bbox[0] + bbox[2], bbox[1] + bbox[3]]
-    #     return extent
-
-    pose_coords = unflatten_pose_data(prediction)
-    min_x = np.NaN
-    min_y = np.NaN
-    max_x = np.NaN
-    max_y = np.NaN
-    for coords in pose_coords:
-        # Coordinates with confidence values of 0 are not considered
-        if coords[2] == 0:
-            continue
-        min_x = np.nanmin([min_x, coords[0]])
-        min_y = np.nanmin([min_y, coords[1]])
-        max_x = np.nanmax([max_x, coords[0]])
-        max_y = np.nanmax([max_y, coords[1]])
-
-    return [min_x, min_y, max_x, max_y]
+    return pose_utils.get_pose_extent_batch(_as_batch(prediction))[0].tolist()
 
 
 def shift_pose_to_origin(prediction):
@@ -157,56 +145,18 @@ def shift_pose_to_origin(prediction):
     min x and y coordinates of its extent are at the 0,0 origin.
     NOTE: This only returns the modified 'keypoints' portion of the prediction.
     """
-    pose_coords = unflatten_pose_data(prediction)
-    min_x, min_y, max_x, max_y = get_pose_extent(prediction)
-
-    for i, coords in enumerate(pose_coords):
-        # Coordinates with confidence values of 0 are not modified; these should not
-        # be used in any pose representations or calculations, and often (but not
-        # always) already have 0,0 coordinates.
-        if coords[2] == 0:
-            continue
-        pose_coords[i] = [coords[0] - min_x, coords[1] - min_y, coords[2]]
-
-    return {"keypoints": np.concatenate(pose_coords, axis=None)}
+    return _from_batch(pose_utils.shift_pose_to_origin_batch(_as_batch(prediction)))
 
 
 def rescale_pose_coords(prediction):
     """
-    Rescale the coordinates of an Open PifPaf pose prediction so that the extent
-    of the pose's long axis is equal to the global POSE_MAX_DIM setting. The
+    Rescale the coordinates of an Open PifPaf pose prediction (already shifted to the
+    origin) so that the extent of the pose's long axis is equal to POSE_MAX_DIM. The
     coordinates of the short axis are scaled by the same factor, and then are
     shifted so that the short axis is centered within the POSE_MAX_DIM extent.
     NOTE: This only returns the modified 'keypoints' portion of the prediction.
     """
-    pose_coords = unflatten_pose_data(prediction)
-    min_x, min_y, max_x, max_y = get_pose_extent(prediction)
-
-    x_extent = max_x - min_x
-    y_extent = max_y - min_y
-
-    scale_factor = POSE_MAX_DIM / np.max([x_extent, y_extent])
-
-    if x_extent >= y_extent:
-        x_recenter = 0
-        y_recenter = round((POSE_MAX_DIM - (scale_factor * y_extent)) / 2)
-    else:
-        x_recenter = round((POSE_MAX_DIM - (scale_factor * x_extent)) / 2)
-        y_recenter = 0
-
-    for i, coords in enumerate(pose_coords):
-        # Coordinates with confidence values of 0 are not modified; these should not
-        # be used in any pose representations or calculations, and often (but not
-        # always) already have 0,0 coordinates.
-        if coords[2] == 0:
-            continue
-        pose_coords[i] = [
-            round(coords[0] * scale_factor + x_recenter),
-            round(coords[1] * scale_factor + y_recenter),
-            coords[2],
-        ]
-
-    return {"keypoints": np.concatenate(pose_coords, axis=None)}
+    return _from_batch(pose_utils.rescale_pose_coords_batch(_as_batch(prediction)))
 
 
 def shift_normalize_rescale_pose_coords(prediction):
@@ -215,7 +165,9 @@ def shift_normalize_rescale_pose_coords(prediction):
     is at the origin, then rescale so that it fits into a POSE_MAX_DIM * POSE_MAX_DIM extent.
     NOTE: This only returns the modified 'keypoints' portion of the prediction.
     """
-    return rescale_pose_coords(shift_pose_to_origin(prediction))
+    return _from_batch(
+        pose_utils.shift_normalize_rescale_pose_coords_batch(_as_batch(prediction))
+    )
 
 
 def compare_poses_cosine_flattened(p1, p2):
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""CLI to refresh a video's summary data (per-video and per-frame counts and scores
+shown in the UI) after any of its poses, faces, frames or tracks change, or to
+rebuild the summaries of all videos."""
+
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from rich.logging import RichHandler
+
+from mime_db import MimeDb
+
+
+async def main() -> None:
+    """Command-line entry-point."""
+
+    parser = argparse.ArgumentParser(description="Description: {}".format(__doc__))
+
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument(
+        "--video-name",
+        action="store",
+        help="The name of the video file (with extension), or a path to it",
+    )
+    target.add_argument(
+        "--all", action="store_true", help="Refresh the summaries of all videos"
+    )
+
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=(os.getenv("LOG_LEVEL") or "INFO").upper(),
+        format="%(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[RichHandler(rich_tracebacks=True)],
+    )
+
+    # Connect to the database
+    db = await MimeDb.create()
+
+    if args.all:
+        await db.refresh_all_video_summaries()
+        return
+
+    video_name = Path(args.video_name).name
+    video_id = await db.get_video_id(video_name)
+    assert video_id, f"No video named '{video_name}' in the db"
+
+    await db.refresh_video_summary(video_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
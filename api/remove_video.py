@@ -10,6 +10,7 @@ from pathlib import Path
 
 from rich.logging import RichHandler
 
+from lib.vector_store import VectorStore
 from mime_db import MimeDb
 
 
@@ -40,6 +41,11 @@ async def main() -> None:
 
     await db.remove_video(video_id)
 
+    # And its exported pose vectors (c.f. export_pose_vectors.py), if any
+    cache_folder = os.getenv("CACHE_FOLDER")
+    if cache_folder:
+        VectorStore(cache_folder).remove(video_id)
+
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,27 +1,66 @@
+import asyncio
 import json
 import logging
 import os
+import weakref
 from pathlib import Path
-from typing import Literal, Set
-from uuid import UUID
+from typing import List, Literal, Set, Tuple
+from uuid import UUID, uuid4
 
-import cv2
 import imageio.v3 as iio
 import numpy as np
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, Query, Request, Response
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi_utils.timing import add_timing_middleware
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from pydantic import BaseModel
 
+from lib.columnar import POSE_DATA_COLUMNS, encode_columns, records_to_columns
+from lib.excerpt_cache import ExcerptCache, pack_jpeg_sprite
+from lib.frame_access import FrameAccess, VideoNotFound
 from lib.json_encoder import MimeJSONEncoder
-from lib.pose_drawing import pad_and_excerpt_image
-from lib.pose_utils import get_poem_embedding
+from lib.metrics import FRAME_REQUESTS, MetricsMiddleware, PoolCollector
+from lib.poem_embedder import poem_embedder
+from lib.precompressed import ensure_precompressed, select_variant, write_precompressed
+from lib.search_cursor import decode_cursor, next_cursor
+from lib.vector_store import VectorStore
+from lib.work_pool import RouteLimit, WorkPool
 from mime_db import MimeDb
 
 load_dotenv()
 VIDEO_SRC_FOLDER = os.getenv("VIDEO_SRC_FOLDER")
 CACHE_FOLDER = os.getenv("CACHE_FOLDER")
+FRAME_CACHE_MB = int(os.getenv("FRAME_CACHE_MB") or 512)
+MAX_BATCH_EXCERPTS = 1000
+MAX_BATCH_SEARCHES = 100
+# Results per page of a similarity search, for requests that don't give a page_size
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE") or 50)
+# "pgvector" (the default) or "mmap", to run single-video similarity searches against
+# memory-mapped exports of the videos' vectors (see export_pose_vectors.py) instead
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND") or "pgvector"
+
+# Worker pool sizes for image decoding/encoding and blocking file I/O
+CPU_WORKERS = int(os.getenv("CPU_WORKERS") or min(8, os.cpu_count() or 4))
+IO_WORKERS = int(os.getenv("IO_WORKERS") or 8)
+# Max requests handled at once by the (heavy) frame image and static image routes, so
+# that they can't starve the search and metadata routes
+FRAME_ROUTE_CONCURRENCY = int(os.getenv("FRAME_ROUTE_CONCURRENCY") or 32)
+IMAGE_ROUTE_CONCURRENCY = int(os.getenv("IMAGE_ROUTE_CONCURRENCY") or 16)
+
+POSE_CLUSTER_IMAGES_FOLDER = Path("/app/pose_cluster_images")
+FACE_IMAGES_FOLDER = Path("/app/face_images")
+
+# Guards against generating the same video's cached pose data more than once at a time
+# (a lock is dropped once no request is holding or waiting for it)
+pose_data_locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+cpu_pool = WorkPool("cpu", CPU_WORKERS)
+io_pool = WorkPool("io", IO_WORKERS)
+frame_routes = RouteLimit("frame", FRAME_ROUTE_CONCURRENCY)
+image_routes = RouteLimit("image", IMAGE_ROUTE_CONCURRENCY)
 
 try:
     assert VIDEO_SRC_FOLDER
@@ -39,6 +78,7 @@ logger = logging.getLogger(__name__)
 
 mime_api = FastAPI(root_path=os.environ.get("PUBLIC_API_BASE", "/"))
 add_timing_middleware(mime_api, record=logger.debug, prefix="api")
+mime_api.add_middleware(MetricsMiddleware)
 
 
 mime_api.add_middleware(
@@ -47,22 +87,168 @@ mime_api.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
+@mime_api.exception_handler(VideoNotFound)
+async def video_not_found(request: Request, exc: VideoNotFound):
+    return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+
+class ExcerptRequest(BaseModel):
+    video_id: UUID
+    frame: int
+    bbox: Tuple[float, float, float, float]
+    size: Tuple[float, float] | None = None
+
+
+class PoseReference(BaseModel):
+    video_id: UUID
+    frame: int
+    pose_idx: int
+
+
+class BatchPoseSearchRequest(BaseModel):
+    # Either query poses (keypoint coordinates) or poses already in the DB
+    poses: List[List[float]] | None = None
+    references: List[PoseReference] | None = None
+    search_type: Literal["cosine", "euclidean", "view_invariant", "3d"] = "cosine"
+    videos: Set[UUID] | None = None
+    limit: int = 50
+    max_distance: float = float("inf")
+    ef_search: int | None = None
+
+
+def parse_cursor(cursor: str | None) -> tuple[tuple | None, dict]:
+    """The position to continue a search after, and any other search state"""
+    if cursor is None:
+        return None, {}
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+def page_limit(max_results: int, page_size: int | None, depth: int) -> int:
+    """
+    Results for a page of a search for up to max_results, `depth` of which were on
+    earlier pages
+    """
+    return min(max_results - depth, page_size or DEFAULT_PAGE_SIZE)
+
+
+def search_response(
+    results: list, limit: int, last_page: bool = False, **state
+) -> Response:
+    """
+    JSON search results, with a cursor for the next page in X-Next-Cursor (unless
+    this was the `last_page`)
+    """
+    cursor = None if last_page else next_cursor(results, limit, **state)
+    return Response(
+        content=json.dumps(results, cls=MimeJSONEncoder),
+        media_type="application/json",
+        headers={"X-Next-Cursor": cursor} if cursor else None,
+    )
+
+
+def multipart_response(parts: list) -> Response:
+    """Build a multipart/mixed response from a list of (headers, content) pairs"""
+    boundary = uuid4().hex
+    body = []
+    for headers, content in parts:
+        body.append(f"--{boundary}\r\n".encode("utf-8"))
+        for header, value in headers.items():
+            body.append(f"{header}: {value}\r\n".encode("utf-8"))
+        body.append(f"Content-Length: {len(content)}\r\n\r\n".encode("utf-8"))
+        body.append(content)
+        body.append(b"\r\n")
+    body.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return Response(
+        content=b"".join(body),
+        media_type=f"multipart/mixed; boundary={boundary}",
+    )
+
+
+def encode_image(img: np.ndarray, extension=".jpeg") -> bytes:
+    return iio.imwrite("<bytes>", img, extension=extension)
+
+
+def asset_path(root: Path, *parts: str) -> Path:
+    """Resolve a path to a file within `root`, refusing any that would escape it"""
+    path = root.joinpath(*parts).resolve()
+    if not path.is_relative_to(root.resolve()):
+        raise HTTPException(status_code=404)
+    return path
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Whether an If-None-Match header (a comma-separated list of ETags, or "*") matches
+    an ETag, using the weak comparison that If-None-Match calls for
+    """
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(
+        tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags
+    )
+
+
+async def file_response(path: Path, request: Request, media_type=None) -> Response:
+    """
+    Stream a file from disk unchanged, with Content-Length, Last-Modified and ETag
+    headers (and a 304 response if the client's copy is current).
+    """
+    try:
+        stat_result = await io_pool.run(os.stat, path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404) from None
+
+    etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    return FileResponse(
+        path, media_type=media_type, headers={"ETag": etag}, stat_result=stat_result
+    )
+
+
+def read_json_file(json_path: str):
+    json_data = {}
+    if os.path.isfile(json_path):
+        with open(json_path, "r", encoding="utf-8") as json_file:
+            json_data = json.load(json_file)
+    return json_data
+
+
 async def get_frame_image(video_id: UUID, frame: int, request: Request) -> np.ndarray:
-    frame_image = Path(CACHE_FOLDER, str(video_id), "frames", f"{frame}.jpeg")
-    if frame_image.exists():
-        return iio.imread(frame_image)
-    else:
-        video = await request.app.state.db.get_video_by_id(video_id)
-        video_path = f"/videos/{video['video_name']}"
-        return iio.imread(video_path, index=frame - 1, plugin="pyav")
+    return await request.app.state.frames.get_frame_image(video_id, frame)
 
 
 @mime_api.on_event("startup")
 async def startup():
     mime_api.state.db = await MimeDb.create(drop=False)
+    REGISTRY.register(PoolCollector(mime_api.state.db.pool_stats))
+    mime_api.state.frames = FrameAccess(
+        mime_api.state.db,
+        VIDEO_SRC_FOLDER,
+        CACHE_FOLDER,
+        frame_cache_bytes=FRAME_CACHE_MB * 1024 * 1024,
+        pool=cpu_pool,
+    )
+    mime_api.state.excerpts = ExcerptCache(mime_api.state.frames, CACHE_FOLDER)
+    mime_api.state.vectors = (
+        VectorStore(CACHE_FOLDER) if VECTOR_SEARCH_BACKEND == "mmap" else None
+    )
+    await poem_embedder.start()
+
+
+@mime_api.on_event("shutdown")
+async def shutdown():
+    await poem_embedder.stop()
+    mime_api.state.frames.close()
+    cpu_pool.shutdown()
+    io_pool.shutdown()
 
 
 @mime_api.get("/")
@@ -70,84 +256,154 @@ async def root():
     return {"message": "MIME API"}
 
 
+@mime_api.get("/metrics")
+async def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @mime_api.get("/videos/")
 async def videos(request: Request):
     available_videos = await request.app.state.db.get_available_videos()
     return {"videos": available_videos}
 
 
-@mime_api.get("/frame/{video_id}/{frame}/")
+@mime_api.get("/frame/{video_id}/{frame}/", dependencies=[frame_routes.depends])
 async def get_frame(video_id: UUID, frame: int, request: Request):
+    frames = request.app.state.frames
+    frame_image = frames.cached_frame_path(video_id, frame)
+    if frame_image.exists():
+        FRAME_REQUESTS.labels("cache_file").inc()
+        return await file_response(frame_image, request, media_type="image/jpeg")
+
     img = await get_frame_image(video_id, frame, request)
     return Response(
-        content=iio.imwrite("<bytes>", img, extension=".jpeg"),
+        content=await cpu_pool.run(encode_image, img),
         media_type="image/jpeg",
     )
 
 
-@mime_api.get("/frame/excerpt/{video_id}/{frame}/{xywh}/")
+@mime_api.get(
+    "/frame/excerpt/{video_id}/{frame}/{xywh}/", dependencies=[frame_routes.depends]
+)
 async def get_frame_region(video_id: UUID, frame: int, xywh: str, request: Request):
-    img = await get_frame_image(video_id, frame, request)
     x, y, w, h = [round(float(elt)) for elt in xywh.split(",")]
-    img_region = pad_and_excerpt_image(img, x, y, w, h)
-    return Response(
-        content=iio.imwrite("<bytes>", img_region, extension=".jpeg"),
-        media_type="image/jpeg",
+    content = await request.app.state.excerpts.get_excerpt(
+        video_id, frame, (x, y, w, h)
     )
+    return Response(content=content, media_type="image/jpeg")
 
 
-@mime_api.get("/frame/resize/{video_id}/{frame}/{xywh_resize}/")
+@mime_api.get(
+    "/frame/resize/{video_id}/{frame}/{xywh_resize}/",
+    dependencies=[frame_routes.depends],
+)
 async def get_frame_region_resized(
     video_id: UUID, frame: int, xywh_resize: str, request: Request
 ):
-    img = await get_frame_image(video_id, frame, request)
     xywh, resize_dims = xywh_resize.split("|")
     x, y, w, h = [round(float(elt)) for elt in xywh.split(",")]
-    img_region = pad_and_excerpt_image(img, x, y, w, h)
     rw, rh = [round(float(elt)) for elt in resize_dims.split(",")]
-    if rw is not None and rh is not None:
-        resized_region = cv2.resize(img_region, (rw, rh))
-    elif rw is not None and rh is None:
-        resized_region = cv2.resize(img_region, (rw, h))
-    elif rw is None and rh is not None:
-        resized_region = cv2.resize(img_region, (w, rh))
-    else:
-        raise ValueError("Invalid resize dimensions specified")
-    return Response(
-        content=iio.imwrite("<bytes>", resized_region, extension=".jpeg"),
-        media_type="image/jpeg",
+    content = await request.app.state.excerpts.get_excerpt(
+        video_id, frame, (x, y, w, h), (rw, rh)
     )
+    return Response(content=content, media_type="image/jpeg")
 
 
-@mime_api.get("/pose_cluster_image/{video_name}/{cluster_id}/")
-async def get_pose_cluster_image(video_name: str, cluster_id: int):
-    image_path = f"/app/pose_cluster_images/{video_name}/{cluster_id}.png"
-    img = iio.imread(image_path)
-    return Response(
-        content=iio.imwrite("<bytes>", img, extension=".png"),
-        media_type="image/png",
+# returns many excerpts in one response, either as a sprite sheet (preceded by a JSON
+# manifest of each excerpt's position in the sheet) or as one JPEG part per excerpt
+@mime_api.post("/frame/excerpts/", dependencies=[frame_routes.depends])
+async def get_frame_regions(
+    excerpts: List[ExcerptRequest],
+    request: Request,
+    format: Literal["sprite", "multipart"] = "sprite",
+):
+    if len(excerpts) > MAX_BATCH_EXCERPTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_EXCERPTS} excerpts can be requested at once",
+        )
+
+    # Visit frames in (video, frame) order, so that each video is decoded forwards
+    order = sorted(
+        range(len(excerpts)),
+        key=lambda i: (str(excerpts[i].video_id), excerpts[i].frame),
     )
 
-
-@mime_api.get("/face_image/{video_name}/{image_fn}/")
-async def get_face_image(video_name: str, image_fn: str):
-    image_path = f"/app/face_images/{video_name}/{image_fn}"
-    img = iio.imread(image_path)
-    return Response(
-        content=iio.imwrite("<bytes>", img, extension=".png"),
-        media_type="image/png",
+    results = [None] * len(excerpts)
+    for i in order:
+        excerpt = excerpts[i]
+        xywh = tuple(round(elt) for elt in excerpt.bbox)
+        resize_dims = (
+            tuple(round(elt) for elt in excerpt.size) if excerpt.size else None
+        )
+        # Sprite tiles too come from the excerpt cache, so are only cut out once
+        results[i] = await request.app.state.excerpts.get_excerpt(
+            excerpt.video_id, excerpt.frame, xywh, resize_dims
+        )
+
+    if format == "multipart":
+        return multipart_response(
+            [
+                (
+                    {
+                        "Content-Type": "image/jpeg",
+                        "Content-ID": f"<{i}>",
+                        "X-Excerpt": f"{excerpt.video_id}/{excerpt.frame}",
+                    },
+                    content,
+                )
+                for i, (excerpt, content) in enumerate(
+                    zip(excerpts, results, strict=True)
+                )
+            ]
+        )
+
+    sheet, offsets = await cpu_pool.run(pack_jpeg_sprite, results)
+    manifest = {
+        "width": sheet.shape[1],
+        "height": sheet.shape[0],
+        "excerpts": [
+            {"video_id": excerpt.video_id, "frame": excerpt.frame, "xywh": offset}
+            for excerpt, offset in zip(excerpts, offsets, strict=True)
+        ],
+    }
+    return multipart_response(
+        [
+            (
+                {"Content-Type": "application/json"},
+                json.dumps(manifest, cls=MimeJSONEncoder).encode("utf-8"),
+            ),
+            (
+                {"Content-Type": "image/jpeg"},
+                await cpu_pool.run(encode_image, sheet),
+            ),
+        ]
     )
 
 
+@mime_api.get(
+    "/pose_cluster_image/{video_name}/{cluster_id}/",
+    dependencies=[image_routes.depends],
+)
+async def get_pose_cluster_image(video_name: str, cluster_id: int, request: Request):
+    image_path = asset_path(POSE_CLUSTER_IMAGES_FOLDER, video_name, f"{cluster_id}.png")
+    return await file_response(image_path, request, media_type="image/png")
+
+
+@mime_api.get(
+    "/face_image/{video_name}/{image_fn}/", dependencies=[image_routes.depends]
+)
+async def get_face_image(video_name: str, image_fn: str, request: Request):
+    image_path = asset_path(FACE_IMAGES_FOLDER, video_name, image_fn)
+    return await file_response(image_path, request)
+
+
 @mime_api.get("/labeled_face_data/{video_name}/")
 async def get_labeled_face_data(video_name: str):
-    json_path = f"/app/face_images/{video_name}/cluster_id_to_image.json"
+    json_path = asset_path(FACE_IMAGES_FOLDER, video_name, "cluster_id_to_image.json")
     # it probably isn't necessary to round-trip text-json-text, but maybe this
     # provides some kind of santitization?
-    json_data = {}
-    if os.path.isfile(json_path):
-        with open(json_path, "r", encoding="utf-8") as json_file:
-            json_data = json.load(json_file)
+    json_data = await io_pool.run(read_json_file, json_path)
     return Response(
         content=json.dumps(json_data),
         media_type="application/json",
@@ -179,21 +435,40 @@ async def face(video_id: UUID, frameno: int, track_id: int, request: Request):
 @mime_api.get("/poses/{video_id}/")
 async def poses(video_id: UUID, request: Request):
     frame_data = Path(CACHE_FOLDER, str(video_id), "pose_data_by_frame.json")
-    if frame_data.exists():
-        with frame_data.open("r", encoding="utf-8") as _fh:
-            frame_data = _fh.read()
-    else:
-        frame_data = await request.app.state.db.get_pose_data_by_frame(video_id)
-        frame_data = json.dumps(frame_data, cls=MimeJSONEncoder)
-        cache_dir = Path(CACHE_FOLDER, str(video_id))
-        cache_dir.mkdir(parents=True, exist_ok=True)
-        with (cache_dir / "pose_data_by_frame.json").open("w") as _fh:
-            _fh.write(frame_data)
+    lock = pose_data_locks.setdefault(video_id, asyncio.Lock())
+    async with lock:
+        if frame_data.exists():
+            await io_pool.run(ensure_precompressed, frame_data)
+        else:
+            rows = await request.app.state.db.get_pose_data_by_frame(video_id)
+            await io_pool.run(
+                lambda: write_precompressed(
+                    frame_data, json.dumps(rows, cls=MimeJSONEncoder).encode("utf-8")
+                )
+            )
+
+    variant, encoding = select_variant(
+        frame_data, request.headers.get("accept-encoding", "")
+    )
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return FileResponse(variant, media_type="application/json", headers=headers)
 
-    return Response(
-        content=frame_data,
-        media_type="application/json",
+
+# the same data as /poses/{video_id}/, as one typed array per column (see lib.columnar)
+@mime_api.get("/poses/{video_id}/columns/")
+async def poses_columns(
+    video_id: UUID,
+    request: Request,
+    start: int | None = None,
+    end: int | None = None,
+):
+    rows = await request.app.state.db.get_pose_data_by_frame(video_id, start, end)
+    content = await cpu_pool.run(
+        lambda: encode_columns(records_to_columns(rows, POSE_DATA_COLUMNS))
     )
+    return Response(content=content, media_type="application/octet-stream")
 
 
 @mime_api.get("/shots/{video_id}/")
@@ -255,8 +530,16 @@ async def get_nearest_poses(
     pose_idx: int,
     avoid_shot: int,
     request: Request,
+    ef_search: int | None = None,
+    page_size: int | None = None,
+    cursor: str | None = None,
 ):
     metric, max_distance = metric_and_max.split("|")
+    after, state = parse_cursor(cursor)
+    depth = state.get("depth", 0)
+    limit = page_limit(max_results, page_size, depth)
+    if limit <= 0:
+        return search_response([], limit)
 
     embedding = "norm"
     if metric == "view_invariant":
@@ -266,20 +549,39 @@ async def get_nearest_poses(
         metric = "cosine"
         embedding = "global3d_coco13"
 
-    frame_data = await request.app.state.db.get_nearest_poses(
-        video_param,
-        frame,
-        pose_idx,
-        metric,
-        embedding,
-        float(max_distance),
-        avoid_shot,
-        max_results,
-    )
-
-    return Response(
-        content=json.dumps(frame_data, cls=MimeJSONEncoder),
-        media_type="application/json",
+    frame_data = None
+    # Falls back to the DB for cross-video searches and videos that aren't exported
+    if request.app.state.vectors is not None and isinstance(video_param, UUID):
+        frame_data = await cpu_pool.run(
+            request.app.state.vectors.get_nearest_poses,
+            video_param,
+            frame,
+            pose_idx,
+            metric,
+            embedding,
+            float(max_distance),
+            avoid_shot,
+            limit,
+            after,
+        )
+    if frame_data is None:
+        frame_data = await request.app.state.db.get_nearest_poses(
+            video_param,
+            frame,
+            pose_idx,
+            metric,
+            embedding,
+            float(max_distance),
+            avoid_shot,
+            limit,
+            ef_search,
+            after,
+            depth,
+        )
+
+    depth += len(frame_data)
+    return search_response(
+        frame_data, limit, last_page=depth >= max_results, depth=depth
     )
 
 
@@ -291,8 +593,16 @@ async def search_nearest_poses(
     video_param: UUID | str,
     coords: str,
     request: Request,
+    ef_search: int | None = None,
+    page_size: int | None = None,
+    cursor: str | None = None,
 ):
     metric, max_distance = metric_and_max.split("|")
+    after, state = parse_cursor(cursor)
+    depth = state.get("depth", 0)
+    limit = page_limit(max_results, page_size, depth)
+    if limit <= 0:
+        return search_response([], limit)
 
     if metric == "global":
         pose_coords = list(map(float, coords.split(",")))
@@ -305,23 +615,39 @@ async def search_nearest_poses(
     if metric == "view_invariant":
         metric = "cosine"
         embedding = "poem_embedding"
-        query_pose = get_poem_embedding(pose_coords)
+        query_pose = await poem_embedder.embed(pose_coords)
     elif metric == "global":
         metric = "cosine"
         embedding = "global3d_coco13"
 
-    frame_data = await request.app.state.db.search_by_pose(
-        video_param,
-        query_pose,
-        metric,
-        embedding,
-        float(max_distance),
-        max_results,
-    )
-
-    return Response(
-        content=json.dumps(frame_data, cls=MimeJSONEncoder),
-        media_type="application/json",
+    frame_data = None
+    if request.app.state.vectors is not None and isinstance(video_param, UUID):
+        frame_data = await cpu_pool.run(
+            request.app.state.vectors.search_by_pose,
+            video_param,
+            query_pose,
+            metric,
+            embedding,
+            float(max_distance),
+            limit,
+            after,
+        )
+    if frame_data is None:
+        frame_data = await request.app.state.db.search_by_pose(
+            video_param,
+            query_pose,
+            metric,
+            embedding,
+            float(max_distance),
+            limit,
+            ef_search,
+            after,
+            depth,
+        )
+
+    depth += len(frame_data)
+    return search_response(
+        frame_data, limit, last_page=depth >= max_results, depth=depth
     )
 
 
@@ -336,9 +662,17 @@ async def get_nearest_actions(
     track_id: int,
     avoid_shot: int,
     request: Request,
+    ef_search: int | None = None,
+    page_size: int | None = None,
+    cursor: str | None = None,
 ):
     # metric is probably always cosine
     _, max_distance = metric_and_max.split("|")
+    after, state = parse_cursor(cursor)
+    depth = state.get("depth", 0)
+    limit = page_limit(max_results, page_size, depth)
+    if limit <= 0:
+        return search_response([], limit)
 
     frame_data = await request.app.state.db.get_nearest_actions(
         video_param,
@@ -346,12 +680,15 @@ async def get_nearest_actions(
         track_id,
         float(max_distance),
         avoid_shot,
-        max_results,
+        limit,
+        ef_search,
+        after,
+        depth,
     )
 
-    return Response(
-        content=json.dumps(frame_data, cls=MimeJSONEncoder),
-        media_type="application/json",
+    depth += len(frame_data)
+    return search_response(
+        frame_data, limit, last_page=depth >= max_results, depth=depth
     )
 
 
@@ -380,11 +717,19 @@ async def get_nearest_movelets(
     track_id: int,
     avoid_shot: int,
     request: Request,
+    ef_search: int | None = None,
 ):
     metric, max_distance = metric_and_max.split("|")
 
     movelet_data = await request.app.state.db.get_nearest_movelets(
-        video_id, frame, track_id, metric, float(max_distance), avoid_shot, max_results
+        video_id,
+        frame,
+        track_id,
+        metric,
+        float(max_distance),
+        avoid_shot,
+        max_results,
+        ef_search,
     )
     return Response(
         content=json.dumps(movelet_data, cls=MimeJSONEncoder),
@@ -400,15 +745,59 @@ async def pose_search(
     videos: Set[str] = Query(None),  # noqa: B008
     limit: int = 50,
     exclude_within_frames: int = 30,
+    ef_search: int | None = None,
+    cursor: str | None = None,
 ):
     pose_coords = json.loads(pose)
+    after, state = parse_cursor(cursor)
+    # The search updates the state with what the next page needs
     results = await request.app.state.db.search_poses(
         pose_coords=pose_coords,
         search_type=search_type,
         videos=videos,
         limit=limit,
         exclude_within_frames=exclude_within_frames,
+        ef_search=ef_search,
+        after=after,
+        state=state,
     )
+    return search_response(results, limit, **state)
+
+
+# runs several searches in one request; returns a list of results per query
+@mime_api.post("/pose-search/batch/")
+async def pose_search_batch(search: BatchPoseSearchRequest, request: Request):
+    if (search.poses is None) == (search.references is None):
+        raise HTTPException(
+            status_code=400, detail="Exactly one of poses or references is required"
+        )
+    query_ct = len(search.poses if search.poses is not None else search.references)
+    if query_ct > MAX_BATCH_SEARCHES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BATCH_SEARCHES} searches can be run at once",
+        )
+
+    if search.poses is not None:
+        results = await request.app.state.db.search_poses_batch(
+            poses=search.poses,
+            search_type=search.search_type,
+            videos=search.videos,
+            limit=search.limit,
+            max_distance=search.max_distance,
+            ef_search=search.ef_search,
+        )
+    else:
+        results = await request.app.state.db.get_nearest_poses_batch(
+            references=[
+                (ref.video_id, ref.frame, ref.pose_idx) for ref in search.references
+            ],
+            search_type=search.search_type,
+            videos=search.videos,
+            limit=search.limit,
+            max_distance=search.max_distance,
+            ef_search=search.ef_search,
+        )
     return Response(
         content=json.dumps(results, cls=MimeJSONEncoder),
         media_type="application/json",
@@ -0,0 +1,81 @@
+import json
+import struct
+
+import numpy as np
+
+from lib.columnar import ALIGNMENT, POSE_DATA_COLUMNS, encode_columns, records_to_columns
+
+
+def decode_columns(payload: bytes) -> tuple[dict, dict]:
+    """Read a payload the way the web UI does: header, then a view per column"""
+    (header_size,) = struct.unpack_from("<I", payload)
+    header = json.loads(payload[4 : 4 + header_size])
+    arrays = {
+        column["name"]: np.frombuffer(
+            payload,
+            dtype=np.dtype(column["dtype"]).newbyteorder("<"),
+            count=column["length"],
+            offset=column["offset"],
+        )
+        for column in header["columns"]
+    }
+    return header, arrays
+
+
+def pose_records(count: int) -> list:
+    rng = np.random.default_rng(0)
+    return [
+        {
+            "frame": frame + 1,
+            "trackCt": int(rng.integers(0, 5)),
+            "faceCt": None if frame % 7 == 0 else int(rng.integers(0, 5)),
+            "avgScore": float(rng.random()),
+            "isShot": frame % 50 == 0,
+            "movement": None if frame % 3 == 0 else float(rng.random() * 10),
+            "movement3d": float(rng.random()),
+            "pose_interest": float(rng.random()),
+            "action_interest": None,
+        }
+        for frame in range(count)
+    ]
+
+
+def test_records_to_columns_types_and_nulls():
+    records = pose_records(20)
+    arrays = records_to_columns(records)
+
+    assert list(arrays) == [name for name, _, _ in POSE_DATA_COLUMNS]
+    for name, _, dtype in POSE_DATA_COLUMNS:
+        assert arrays[name].dtype == np.dtype(dtype)
+        assert len(arrays[name]) == len(records)
+
+    assert arrays["faceCt"][0] == 0
+    assert np.isnan(arrays["movement"][0])
+    assert np.isnan(arrays["action_interest"]).all()
+    assert arrays["isShot"][0] == 1 and arrays["isShot"][1] == 0
+    np.testing.assert_array_equal(
+        arrays["avgScore"],
+        np.array([record["avgScore"] for record in records], dtype=np.float32),
+    )
+
+
+def test_encode_columns_round_trip():
+    arrays = records_to_columns(pose_records(101))
+    header, decoded = decode_columns(encode_columns(arrays))
+
+    assert header["rows"] == 101
+    assert [column["name"] for column in header["columns"]] == list(arrays)
+    for column in header["columns"]:
+        assert column["offset"] % ALIGNMENT == 0
+    for name, array in arrays.items():
+        assert decoded[name].dtype == array.dtype
+        np.testing.assert_array_equal(decoded[name], array)
+
+
+def test_encode_columns_without_rows():
+    arrays = records_to_columns([])
+    header, decoded = decode_columns(encode_columns(arrays))
+
+    assert header["rows"] == 0
+    assert all(len(array) == 0 for array in decoded.values())
+    assert encode_columns({})[4:].strip() == b'{"rows": 0, "columns": []}'
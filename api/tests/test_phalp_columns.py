@@ -0,0 +1,116 @@
+import json
+
+import joblib
+import numpy as np
+import pytest
+
+from lib import phalp_columns
+from lib.phalp_columns import lart_columns, lart_rows, phalp_rows
+
+
+@pytest.fixture(scope="module")
+def frames() -> dict:
+    """PHALP/LART-style output: per-frame dicts of per-detection lists"""
+    rng = np.random.default_rng(0)
+    frames = {}
+    for time in range(200):
+        tids = list(range(int(rng.integers(0, 4))))
+        # Some tracked IDs are "ghosts" that aren't among the frame's detections
+        tracked_ids = [tid for tid in tids if rng.random() < 0.7]
+        if time == 5:
+            tracked_ids.append(99)
+        frames[f"{time:06d}.jpg"] = {
+            "time": time,
+            "tid": tids,
+            "tracked_ids": tracked_ids,
+            "2d_joints": [rng.random(90).astype(np.float32) for _ in tids],
+            "3d_joints": [rng.random((45, 3)).astype(np.float32) for _ in tids],
+            "smpl": [
+                {"global_orient": rng.random((1, 3, 3)).astype(np.float32)} for _ in tids
+            ],
+            "bbox": [rng.random(4).astype(np.float32) for _ in tids],
+            "camera": [rng.random(3).astype(np.float32) for _ in tids],
+            "conf": [float(rng.random()) for _ in tids],
+            "size": [[720, 1280] for _ in tids],
+            "class_name": [0 for _ in tids],
+            "ava_action": {
+                tid: rng.random((1, 60)).astype(np.float32) for tid in tids + [99]
+            },
+            "label": {tid: ["stand", "talk to"] for tid in tids + [99]},
+        }
+    return frames
+
+
+@pytest.fixture
+def pkl_path(tmp_path, frames):
+    path = tmp_path / "video.mp4.phalp.pkl"
+    joblib.dump(frames, path)
+    return path
+
+
+def chunk_rows(columns, max_rows: int) -> list:
+    rows = []
+    for chunk in columns.chunks(max_rows):
+        count = len(chunk["frame"])
+        # Chunks only exceed max_rows when a single frame has more rows
+        assert count <= max_rows or len(set(chunk["frame"])) == 1
+        rows.extend(
+            {name: values[i] for name, values in chunk.items()} for i in range(count)
+        )
+    return rows
+
+
+@pytest.mark.parametrize("max_rows", [1, 7, 10000])
+def test_phalp_sidecar_matches_pickle(frames, pkl_path, max_rows):
+    columns = phalp_columns.phalp_columns(pkl_path)
+    expected = list(phalp_rows(frames))
+    rows = chunk_rows(columns, max_rows)
+
+    assert len(rows) == len(expected) == len(columns)
+    for row, pose in zip(rows, expected, strict=True):
+        for name, value in pose.items():
+            np.testing.assert_array_equal(row[name], np.asarray(value), err_msg=name)
+
+
+def test_lart_sidecar_matches_pickle(frames, tmp_path):
+    path = tmp_path / "video.mp4.lart.pkl"
+    joblib.dump(frames, path)
+    rows = chunk_rows(lart_columns(path), 50)
+    expected = list(lart_rows(frames))
+
+    assert len(rows) == len(expected)
+    for row, action in zip(rows, expected, strict=True):
+        assert row["frame"] == action["frame"]
+        assert row["track_id"] == action["track_id"]
+        np.testing.assert_array_equal(row["ava_action"], action["ava_action"])
+        assert json.loads(str(row["labels"])) == ["stand", "talk to"]
+
+
+def test_sidecar_is_reused_until_the_pickle_changes(frames, pkl_path, monkeypatch):
+    phalp_columns.phalp_columns(pkl_path)
+
+    def no_load(path):
+        raise AssertionError("The pickle was loaded again")
+
+    monkeypatch.setattr(phalp_columns.joblib, "load", no_load)
+    assert len(phalp_columns.phalp_columns(pkl_path)) == len(list(phalp_rows(frames)))
+
+    monkeypatch.undo()
+    fewer = dict(list(frames.items())[:20])
+    joblib.dump(fewer, pkl_path)
+    assert len(phalp_columns.phalp_columns(pkl_path)) == len(list(phalp_rows(fewer)))
+    # The rebuilt sidecar replaced the old one
+    assert sorted(path.name for path in pkl_path.parent.iterdir()) == [
+        pkl_path.name,
+        f"{pkl_path.name}.columns",
+    ]
+
+
+def test_empty_sidecar(tmp_path):
+    path = tmp_path / "empty.phalp.pkl"
+    joblib.dump({}, path)
+    columns = phalp_columns.phalp_columns(path)
+
+    assert len(columns) == 0
+    assert list(columns.chunks(10)) == []
+    assert columns.fields["joints_2d"].shape == (0, 90)
@@ -0,0 +1,236 @@
+import numpy as np
+import pytest
+
+from lib import pose_utils
+
+MAPPINGS = [
+    pose_utils.phalp_to_coco_13,
+    pose_utils.phalp_to_coco_17,
+    pose_utils.phalp_to_reduced,
+]
+
+
+# Reference implementations: the former pose-by-pose, keypoint-by-keypoint versions
+
+
+def reference_merge_coords(
+    all_coords, guide_to_merge, has_confidence=False, is_3d=False
+):
+    new_coords = []
+    for to_merge in guide_to_merge:
+        x_avg = sum(all_coords[i][0] for i in to_merge) / len(to_merge)
+        y_avg = sum(all_coords[i][1] for i in to_merge) / len(to_merge)
+        conf = 1.0
+        if is_3d:
+            z_avg = sum(all_coords[i][2] for i in to_merge) / len(to_merge)
+            new_coords.append([x_avg, y_avg, z_avg])
+        else:
+            if has_confidence:
+                conf = sum(all_coords[i][2] for i in to_merge) / len(to_merge)
+            new_coords.append([x_avg, y_avg, conf])
+    return np.array(new_coords)
+
+
+def reference_extent(keypoints):
+    min_x = min_y = max_x = max_y = np.nan
+    for coords in np.array_split(keypoints, len(keypoints) / 3):
+        if coords[2] == 0:
+            continue
+        min_x = np.nanmin([min_x, coords[0]])
+        min_y = np.nanmin([min_y, coords[1]])
+        max_x = np.nanmax([max_x, coords[0]])
+        max_y = np.nanmax([max_y, coords[1]])
+    return [min_x, min_y, max_x, max_y]
+
+
+def reference_shift(keypoints):
+    pose_coords = np.array_split(keypoints, len(keypoints) / 3)
+    min_x, min_y, _, _ = reference_extent(keypoints)
+    for i, coords in enumerate(pose_coords):
+        if coords[2] == 0:
+            continue
+        pose_coords[i] = [coords[0] - min_x, coords[1] - min_y, coords[2]]
+    return np.concatenate(pose_coords, axis=None)
+
+
+def reference_rescale(keypoints):
+    pose_coords = np.array_split(keypoints, len(keypoints) / 3)
+    min_x, min_y, max_x, max_y = reference_extent(keypoints)
+    scale_factor = pose_utils.POSE_MAX_DIM / np.max([max_x, max_y])
+    x_extent = max_x - min_x
+    y_extent = max_y - min_y
+    if x_extent >= y_extent:
+        x_recenter = 0
+        y_recenter = round((pose_utils.POSE_MAX_DIM - (scale_factor * y_extent)) / 2)
+    else:
+        x_recenter = round((pose_utils.POSE_MAX_DIM - (scale_factor * x_extent)) / 2)
+        y_recenter = 0
+    for i, coords in enumerate(pose_coords):
+        if coords[2] == 0:
+            continue
+        pose_coords[i] = [
+            round(coords[0] * scale_factor + x_recenter),
+            round(coords[1] * scale_factor + y_recenter),
+            coords[2],
+        ]
+    return np.concatenate(pose_coords, axis=None)
+
+
+def reference_normalize(keypoints):
+    rescaled = reference_rescale(reference_shift(keypoints))
+    return np.array(
+        [
+            [coords[0], coords[1]] if coords[2] != 0 else [np.nan, np.nan]
+            for coords in np.array_split(rescaled, len(rescaled) / 3)
+        ]
+    ).flatten()
+
+
+def assert_identical(actual, expected):
+    actual, expected = np.asarray(actual), np.asarray(expected)
+    assert actual.dtype == expected.dtype
+    np.testing.assert_array_equal(actual, expected, strict=True)
+
+
+@pytest.fixture(params=[np.float32, np.float64])
+def dtype(request):
+    return request.param
+
+
+@pytest.fixture
+def keypoints(dtype) -> np.ndarray:
+    """OpenPifPaf-style poses, some with untrustworthy (zero-confidence) keypoints"""
+    rng = np.random.default_rng(0)
+    poses = (rng.random((200, 17, 3)) * 800).astype(dtype)
+    poses[..., 2] = np.where(rng.random((200, 17)) < 0.3, 0, poses[..., 2])
+    # A pose with no horizontal extent, and one with only two trustworthy keypoints
+    poses[1, :, 0] = 5
+    poses[2, 2:, 2] = 0
+    poses[2, :2, 2] = 1
+    return poses
+
+
+@pytest.mark.parametrize("mapping", MAPPINGS)
+def test_merge_coords_batch_matches_reference(dtype, mapping):
+    rng = np.random.default_rng(1)
+    joints_2d = (rng.random((30, 45, 2)) * 1000).astype(dtype)
+    joints_3d = rng.standard_normal((30, 45, 3)).astype(dtype)
+
+    merged_2d = pose_utils.merge_coords_batch(joints_2d, mapping)
+    merged_3d = pose_utils.merge_coords_batch(joints_3d, mapping, is_3d=True)
+    for i in range(len(joints_2d)):
+        assert_identical(merged_2d[i], reference_merge_coords(joints_2d[i], mapping))
+        assert_identical(
+            merged_3d[i], reference_merge_coords(joints_3d[i], mapping, is_3d=True)
+        )
+        assert_identical(
+            pose_utils.merge_coords(joints_2d[i], mapping),
+            reference_merge_coords(joints_2d[i], mapping),
+        )
+
+
+def test_merge_coords_with_confidence_matches_reference(keypoints):
+    mapping = pose_utils.openpifpaf_to_coco_13
+    merged = pose_utils.merge_coords_batch(keypoints, mapping, has_confidence=True)
+    for i in range(len(keypoints)):
+        assert_identical(
+            merged[i],
+            reference_merge_coords(keypoints[i], mapping, has_confidence=True),
+        )
+
+
+def test_normalize_poses_batch_matches_reference(keypoints):
+    normalized = pose_utils.normalize_poses_batch(keypoints)
+    assert normalized.shape == (len(keypoints), 34)
+    for i in range(len(keypoints)):
+        np.testing.assert_array_equal(
+            normalized[i], reference_normalize(keypoints[i].flatten()), strict=True
+        )
+
+
+def test_single_pose_functions_match_reference(keypoints):
+    for pose in keypoints[:50]:
+        prediction = {"keypoints": pose.flatten()}
+        flat = prediction["keypoints"]
+        assert_identical(pose_utils.get_pose_extent(prediction), reference_extent(flat))
+        assert_identical(
+            pose_utils.shift_pose_to_origin(prediction, "keypoints")["keypoints"],
+            reference_shift(flat),
+        )
+        assert_identical(
+            pose_utils.rescale_pose_coords(prediction)["keypoints"],
+            reference_rescale(flat),
+        )
+        assert_identical(
+            pose_utils.extract_trustworthy_coords(
+                pose_utils.shift_normalize_rescale_pose_coords(prediction)
+            ),
+            reference_normalize(flat),
+        )
+
+
+def test_pose_without_trustworthy_keypoints_is_all_nan(keypoints):
+    keypoints[0, :, 2] = 0
+    assert np.isnan(pose_utils.get_pose_extent_batch(keypoints[:1])).all()
+    assert np.isnan(pose_utils.normalize_poses_batch(keypoints[:1])).all()
+
+
+def reference_phalp_pose(joints_2d, size, joints_3d, global_orient) -> dict:
+    """
+    A PHALP pose's keypoint columns as they were computed pose by pose at ingest,
+    then by the annotation passes over the (single-precision) stored values
+    """
+    img_height, img_width = size
+    joints_2d = np.array(joints_2d).reshape(-1, 2)
+    joints_2d *= max(img_width, img_height)
+    joints_2d[:, 1] -= (max(img_width, img_height) - min(img_width, img_height)) / 2
+    keypoints = reference_merge_coords(joints_2d, pose_utils.phalp_to_coco_13)
+    global3d_phalp = np.matmul(joints_3d, global_orient).flatten()
+    stored_keypoints = keypoints.flatten().astype(np.float32)
+    return {
+        "keypoints": keypoints.flatten(),
+        "keypointsopp": reference_merge_coords(
+            joints_2d, pose_utils.phalp_to_coco_17
+        ).flatten(),
+        "keypoints4dh": np.array(
+            [[coord[0], coord[1], 1.0] for coord in joints_2d]
+        ).flatten(),
+        "keypoints3d": reference_merge_coords(
+            joints_3d, pose_utils.phalp_to_coco_13, is_3d=True
+        ).flatten(),
+        "global3d_phalp": global3d_phalp,
+        "global3d_coco13": reference_merge_coords(
+            global3d_phalp.astype(np.float32).reshape(-1, 3),
+            pose_utils.phalp_to_coco_13,
+            is_3d=True,
+        ).flatten(),
+        "norm": np.nan_to_num(reference_normalize(stored_keypoints), nan=-1),
+    }
+
+
+def test_phalp_keypoints_batch_matches_reference():
+    rng = np.random.default_rng(2)
+    count = 100
+    joints_2d = rng.random((count, 90)).astype(np.float32)
+    sizes = rng.integers(200, 2000, (count, 2))
+    joints_3d = rng.standard_normal((count, 45, 3)).astype(np.float32)
+    global_orients = rng.standard_normal((count, 3, 3)).astype(np.float32)
+
+    keypoints = pose_utils.phalp_keypoints_batch(
+        joints_2d, sizes, joints_3d, global_orients
+    )
+    # As MimeDb.load_4dh_predictions() normalizes them
+    keypoints["norm"] = np.nan_to_num(
+        pose_utils.normalize_poses_batch(
+            keypoints["keypoints"].astype(np.float32).reshape(count, -1, 3)
+        ),
+        nan=-1,
+    )
+    for i in range(count):
+        expected = reference_phalp_pose(
+            joints_2d[i], sizes[i].tolist(), joints_3d[i], global_orients[i]
+        )
+        for name, values in expected.items():
+            np.testing.assert_array_equal(
+                keypoints[name][i], values, strict=True, err_msg=name
+            )
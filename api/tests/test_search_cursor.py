@@ -0,0 +1,63 @@
+import base64
+import json
+from uuid import uuid4
+
+import pytest
+
+from lib.search_cursor import decode_cursor, encode_cursor, next_cursor
+
+VIDEO_ID = uuid4()
+
+
+def token(content) -> str:
+    return base64.urlsafe_b64encode(json.dumps(content).encode("utf-8")).decode()
+
+
+def test_round_trip():
+    state = {
+        "windows": [[str(VIDEO_ID), 0, [1, 20], [9, 30]]],
+        "rank": 3,
+        "tied": [[str(VIDEO_ID), 1, 12]],
+        "candidates": 40,
+        "distance": 0.25,
+    }
+    position, decoded = decode_cursor(encode_cursor((0.25, VIDEO_ID, 12, 1), **state))
+    assert position == (0.25, VIDEO_ID, 12, 1)
+    assert decoded == state
+
+
+def test_next_cursor_only_for_full_pages():
+    results = [{"distance": 0.5, "video_id": VIDEO_ID, "frame": 3, "pose_idx": 0}]
+    assert next_cursor(results, 2) is None
+    position, state = decode_cursor(next_cursor(results, 1, depth=1))
+    assert position == (0.5, VIDEO_ID, 3, 0)
+    assert state == {"depth": 1}
+
+
+AFTER = [0.5, str(VIDEO_ID), 3, 0]
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        token([AFTER]),
+        token("after"),
+        token({"depth": 1}),
+        token({"after": [0.5, "not a UUID", 3, 0]}),
+        token({"after": AFTER, "depth": -1}),
+        token({"after": AFTER, "depth": "10"}),
+        token({"after": AFTER, "depth": True}),
+        token({"after": AFTER, "candidates": 1.5}),
+        token({"after": AFTER, "rank": -2}),
+        token({"after": AFTER, "distance": "0.1"}),
+        token({"after": AFTER, "windows": {"a": 1}}),
+        token({"after": AFTER, "windows": [[str(VIDEO_ID), 0, [1, 2], [3]]]}),
+        token({"after": AFTER, "windows": [[str(VIDEO_ID), 0, ["1"], [3]]]}),
+        token({"after": AFTER, "tied": [[str(VIDEO_ID), 0]]}),
+        token({"after": AFTER, "unknown": 1}),
+    ],
+)
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
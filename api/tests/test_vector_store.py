@@ -0,0 +1,149 @@
+from uuid import uuid4
+
+import numpy as np
+import pytest
+
+from lib.vector_store import VectorStore
+
+VIDEO_ID = uuid4()
+METRICS = ["cosine", "euclidean", "innerproduct"]
+
+
+@pytest.fixture(scope="module")
+def poses() -> list:
+    """Pose search records, as MimeDb.get_pose_search_data() returns them"""
+    rng = np.random.default_rng(0)
+    records = []
+    for frame in range(1, 121):
+        for pose_idx in range(int(rng.integers(0, 4))):
+            records.append(
+                {
+                    "frame": frame,
+                    "pose_idx": pose_idx,
+                    "track_id": pose_idx + 1,
+                    "keypoints": rng.random(39).astype(np.float32),
+                    # Some poses lack an embedding, or a face or shot
+                    "norm": None if rng.random() < 0.05 else rng.random(26) * 500,
+                    "shot": None if frame > 115 else frame // 20,
+                    "face_cluster_id": None if pose_idx else int(rng.integers(0, 3)),
+                    "joined": rng.random() > 0.05,
+                }
+            )
+    return records
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory, poses) -> VectorStore:
+    store = VectorStore(str(tmp_path_factory.mktemp("cache")))
+    store.write(VIDEO_ID, "video.mp4", ["norm"], poses)
+    return store
+
+
+def brute_force(poses, query, metric, max_distance, limit, exclude=lambda pose: False):
+    """
+    Search results computed pose by pose, as the DB searches define them: ordered by
+    pgvector's distance (the negative inner product, for innerproduct), then frame
+    and pose_idx, and reporting the inner product itself
+    """
+    query = np.asarray(query, dtype=np.float64)
+    ranked = []
+    for pose in poses:
+        if pose["norm"] is None or not pose["joined"] or pose["shot"] is None:
+            continue
+        if exclude(pose):
+            continue
+        vector = np.asarray(pose["norm"], dtype=np.float32).astype(np.float64)
+        if metric == "cosine":
+            key = 1 - vector @ query / (np.linalg.norm(vector) * np.linalg.norm(query))
+        elif metric == "euclidean":
+            key = np.linalg.norm(vector - query)
+        else:
+            key = -(vector @ query)
+        if key < max_distance:
+            ranked.append((key, pose["frame"], pose["pose_idx"]))
+    ranked.sort()
+    return [
+        (frame, pose_idx, -key if metric == "innerproduct" else key)
+        for key, frame, pose_idx in ranked[:limit]
+    ]
+
+
+def summary(results) -> list:
+    return [(pose["frame"], pose["pose_idx"], pose["distance"]) for pose in results]
+
+
+def assert_same(results, expected):
+    assert [row[:2] for row in summary(results)] == [row[:2] for row in expected]
+    np.testing.assert_allclose(
+        [row[2] for row in summary(results)],
+        [row[2] for row in expected],
+        rtol=1e-4,
+    )
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_search_by_pose_matches_brute_force(store, poses, metric):
+    query = np.random.default_rng(1).random(26) * 500
+    results = store.search_by_pose(VIDEO_ID, query, metric, "norm", limit=25)
+    assert_same(results, brute_force(poses, query, metric, np.inf, 25))
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_search_by_pose_max_distance(store, poses, metric):
+    query = np.random.default_rng(2).random(26) * 500
+    full = brute_force(poses, query, metric, np.inf, len(poses))
+    # Max distances apply to the sort key (c.f. _search_sql.sort_key_sql()); this
+    # one falls between two results partway through
+    keys = [-row[2] if metric == "innerproduct" else row[2] for row in full]
+    cutoff = len(full) // 3
+    max_distance = (keys[cutoff - 1] + keys[cutoff]) / 2
+    results = store.search_by_pose(VIDEO_ID, query, metric, "norm", max_distance, 500)
+    assert_same(results, brute_force(poses, query, metric, max_distance, 500))
+    assert len(results) == cutoff
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_get_nearest_poses_matches_brute_force(store, poses, metric):
+    reference = next(pose for pose in poses[40:] if pose["norm"] is not None)
+    avoid_shot = 3
+
+    def exclude(pose):
+        return pose["shot"] == avoid_shot or (
+            pose["frame"] == reference["frame"]
+            and pose["pose_idx"] == reference["pose_idx"]
+        )
+
+    results = store.get_nearest_poses(
+        VIDEO_ID,
+        reference["frame"],
+        reference["pose_idx"],
+        metric,
+        "norm",
+        avoid_shot=avoid_shot,
+        limit=30,
+    )
+    expected = brute_force(poses, reference["norm"], metric, np.inf, 30, exclude)
+    assert_same(results, expected)
+
+
+@pytest.mark.parametrize("metric", METRICS)
+def test_pages_continue_where_the_last_left_off(store, metric):
+    query = np.random.default_rng(3).random(26) * 500
+    everything = store.search_by_pose(VIDEO_ID, query, metric, "norm", limit=60)
+
+    pages = []
+    after = None
+    while len(pages) < len(everything):
+        page = store.search_by_pose(
+            VIDEO_ID, query, metric, "norm", limit=7, after=after
+        )
+        assert page
+        pages += page
+        last = page[-1]
+        after = (last["distance"], VIDEO_ID, last["frame"], last["pose_idx"])
+
+    assert summary(pages[: len(everything)]) == summary(everything)
+
+
+def test_unexported_video(store):
+    assert store.search_by_pose(uuid4(), np.ones(26)) is None
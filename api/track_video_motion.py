@@ -300,7 +300,7 @@ async def main() -> None:
 
     logging.info(f"Loading {len(movelets)} movelets into DB.")
 
-    await db.add_video_movelets(movelets)
+    await db.add_video_movelets(video_id, movelets)
 
     logging.info("Computing cumulative movement per frame.")
 
@@ -12,3 +12,21 @@ export const formatSeconds = (seconds: number) => {
 
 export const clamp = (num: number, min: number, max: number): number =>
   num < min ? min : num > max ? max : num;
+
+// Results of every page of a paged similarity search, each of which but the last
+// gives the cursor for the next in its X-Next-Cursor header
+export const fetchAllPages = async (url: string): Promise<any[]> => {
+  const results = [];
+  let cursor: string | null = null;
+  do {
+    const separator = url.includes("?") ? "&" : "?";
+    const response = await fetch(
+      cursor === null
+        ? url
+        : `${url}${separator}cursor=${encodeURIComponent(cursor)}`,
+    );
+    results.push(...(await response.json()));
+    cursor = response.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return results;
+};